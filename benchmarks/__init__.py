@@ -0,0 +1,5 @@
+"""
+Reproducible benchmarks of the Rebeca engine on synthetic fleets of devices.
+
+    python -m benchmarks --devices 1000 --rules 100 --events 20000 --output results.json
+"""
@@ -0,0 +1,24 @@
+import argparse
+import json
+
+from .run import run, write_results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Benchmark the Rebeca engine.")
+    parser.add_argument('--devices', type=int, default=1000, help="number of devices of the fleet")
+    parser.add_argument('--rules', type=int, default=100, help="number of rules")
+    parser.add_argument('--events', type=int, default=20000, help="number of triggered events")
+    parser.add_argument('--rule-samples', type=int, default=20, help="number of rules added and removed at run-time")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic fleet")
+    parser.add_argument('--output', help="path of the JSON results, printed if missing")
+    args = parser.parse_args()
+    results = run(args.devices, args.rules, args.events, args.rule_samples, args.seed)
+    if args.output:
+        write_results(results, args.output)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import random
+import typing
+
+from rebeca import Rebeca
+
+
+class BenchmarkEngine(Rebeca):
+    """
+    Rule engine of the benchmarks: it registers the 'device' entity class and counts the fired actions.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.register_entity_class('device', ['id', 'type'])
+        self.fired: int = 0
+
+    @Rebeca.action('service')
+    def on_service(self, **kwargs):
+        self.fired += 1
+
+
+class Fleet:
+    """
+    Synthetic fleet of devices, with rules and events generated from a seed, so that every run of a benchmark
+    works on the same data. Devices have a type, a 'count', a 'temperature' and a 'status' property.
+    Rules mix the supported condition shapes: '$and'/'$or' of single devices and of the 'utc' entity,
+    '$any->' families, '$aggregation' of a group of devices, and the 'between' and 'regex' operators.
+    """
+
+    types = ('people_counter', 'thermometer', 'switch')
+    statuses = ('ok', 'warning', 'error', 'offline')
+    shapes = ('and', 'or', 'any', 'aggregation', 'between', 'regex')
+
+    def __init__(self, devices: int, seed: int = 0):
+        """
+        :param devices: Number of devices of the fleet.
+        :param seed: Seed of the generated data.
+        """
+        self._random = random.Random(seed)
+        self.devices: typing.List[dict] = [dict(id=i, type=self.types[i % len(self.types)])
+                                           for i in range(devices)]
+
+    def _device(self) -> dict:
+        return dict(self._random.choice(self.devices))
+
+    def _device_condition(self, property_name: str, comparisons: list) -> dict:
+        return dict(device=dict(**self._device(), **{'$properties': {property_name: comparisons}}))
+
+    def _condition(self, shape: str) -> dict:
+        r = self._random
+        if shape == 'and':
+            return {'$and': [self._device_condition('count', [{'>': r.randint(0, 5)}]),
+                             {'utc': {'$properties': {'hours': [{'>=': r.randint(0, 23)}]}}}]}
+        if shape == 'or':
+            return {'$or': [self._device_condition('count', [{'>': r.randint(0, 5)}]),
+                            self._device_condition('temperature', [{'>=': r.uniform(15, 30)}])]}
+        if shape == 'any':
+            return {'$and': [{'$any->device||member': {'type': r.choice(self.types),
+                                                       '$properties': {'count': [{'>': r.randint(5, 10)}]}}}]}
+        if shape == 'aggregation':
+            members = r.sample(self.devices, min(len(self.devices), r.randint(2, 10)))
+            return {'$aggregation': {'$function': r.choice(('sum', 'avg', 'max')),
+                                     '$entities': [{'device': dict(device)} for device in members],
+                                     '$property': {'count': [{'>=': r.randint(5, 20)}]}}}
+        if shape == 'between':
+            low = r.uniform(10, 25)
+            return {'$and': [self._device_condition('temperature', [{'between': [low, low + 5]}])]}
+        if shape == 'regex':
+            return {'$and': [self._device_condition('status', [{'regex': r.choice(('^err', '^warn', 'off'))}])]}
+        raise ValueError(f"'{shape}' is not a valid shape")
+
+    def rules(self, count: int) -> typing.List[dict]:
+        """
+        :param count: Number of rules.
+        :return: The payloads of the rules, cycling through the condition shapes.
+        """
+        return [dict(name=f"rule-{i}", description=f"Synthetic {self.shapes[i % len(self.shapes)]} rule", meta={},
+                     condition=self._condition(self.shapes[i % len(self.shapes)]),
+                     action={'$class': 'single', '$category': 'service',
+                             '$data': {'service_name': 'notify', 'target_ids': [i]}})
+                for i in range(count)]
+
+    def events(self, count: int) -> typing.List[typing.Tuple[str, dict]]:
+        """
+        :param count: Number of events.
+        :return: The events, as (entity_name, entity_data) tuples: device updates and a 'utc' tick every 1000 events.
+        """
+        r = self._random
+        events = list()
+        for i in range(count):
+            if i % 1000 == 0:
+                events.append(('utc', dict(hours=(i // 1000) % 24, minutes=0)))
+            else:
+                events.append(('device', dict(**self._device(), count=r.randint(0, 10),
+                                              temperature=round(r.uniform(10, 35), 1),
+                                              status=r.choice(self.statuses))))
+        return events
@@ -0,0 +1,163 @@
+import copy
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import typing
+
+from rebeca.columnar import ColumnarMatcher
+from rebeca.metrics import Histogram
+from .fleet import Fleet, BenchmarkEngine
+
+
+def _engine(rules: typing.List[dict], started: bool = True, **options) -> BenchmarkEngine:
+    engine = BenchmarkEngine(**options)
+    engine.add_rule(*copy.deepcopy(rules))
+    if started:
+        engine.start()
+    return engine
+
+
+def _latencies(histogram: Histogram) -> dict:
+    return dict(p50=histogram.percentile(50), p99=histogram.percentile(99), max=histogram.max)
+
+
+def bench_startup(rules: typing.List[dict]) -> dict:
+    """
+    Time to parse the rules and to start the engine.
+    """
+    start = time.perf_counter()
+    engine = _engine(rules, started=False)
+    parsed = time.perf_counter()
+    engine.start()
+    started = time.perf_counter()
+    return dict(parse_seconds=parsed - start, start_seconds=started - parsed)
+
+
+def bench_trigger(rules: typing.List[dict], events: typing.List[tuple]) -> dict:
+    """
+    Throughput and latency of single triggers, and throughput of coalesced batches.
+    """
+    engine = _engine(rules)
+    histogram = Histogram()
+    start = time.perf_counter()
+    for entity_name, entity_data in events:
+        event_start = time.perf_counter()
+        engine.trigger(entity_name, entity_data)
+        histogram.record(time.perf_counter() - event_start)
+    elapsed = time.perf_counter() - start
+    batched_engine = _engine(rules)
+    batch_start = time.perf_counter()
+    for i in range(0, len(events), 1000):
+        batched_engine.trigger_many(events[i:i + 1000])
+    batch_elapsed = time.perf_counter() - batch_start
+    return dict(events=len(events), events_per_second=len(events) / elapsed, latency_seconds=_latencies(histogram),
+                fired=engine.fired, batch_events_per_second=len(events) / batch_elapsed)
+
+
+def bench_keys(rules: typing.List[dict], events: typing.List[tuple]) -> dict:
+    """
+    Throughput of single triggers with each key mode of the entities: SHA-1 digests (the default) and fast keys.
+    """
+    results = dict()
+    for mode, fast_keys in (('digest', False), ('fast', True)):
+        engine = _engine(rules, fast_keys=fast_keys)
+        start = time.perf_counter()
+        for entity_name, entity_data in events:
+            engine.trigger(entity_name, entity_data)
+        elapsed = time.perf_counter() - start
+        results[mode] = dict(events_per_second=len(events) / elapsed, fired=engine.fired)
+    return results
+
+
+def bench_matchers(rules: typing.List[dict], events: typing.List[tuple]) -> dict:
+    """
+    Throughput of single triggers with the RETE network alone and with the columnar matcher of the single entity
+    rules, which is skipped (None) without NumPy.
+    """
+    results = dict()
+    for mode, columnar in (('rete', False), ('columnar', True)):
+        if columnar and not ColumnarMatcher.available:
+            results[mode] = None
+            continue
+        engine = _engine(rules, columnar=columnar)
+        start = time.perf_counter()
+        for entity_name, entity_data in events:
+            engine.trigger(entity_name, entity_data)
+        elapsed = time.perf_counter() - start
+        results[mode] = dict(events_per_second=len(events) / elapsed, fired=engine.fired)
+    return results
+
+
+def bench_rules(rules: typing.List[dict], events: typing.List[tuple], samples: int) -> dict:
+    """
+    Latency of adding, updating and removing a rule on a running engine with entities, and of a restart.
+    """
+    engine = _engine(rules)
+    engine.trigger_many(events)
+    added, updated, removed = Histogram(), Histogram(), Histogram()
+    for i in range(samples):
+        rule = rules[i % len(rules)]
+        start = time.perf_counter()
+        rule_id, = engine.add_rule(copy.deepcopy(rule))
+        added.record(time.perf_counter() - start)
+        start = time.perf_counter()
+        engine.update_rule(rule_id, copy.deepcopy(rules[(i + 1) % len(rules)]))
+        updated.record(time.perf_counter() - start)
+        start = time.perf_counter()
+        engine.remove_rule(rule_id)
+        removed.record(time.perf_counter() - start)
+    start = time.perf_counter()
+    engine.restart()
+    restart = time.perf_counter() - start
+    return dict(add_seconds=_latencies(added), update_seconds=_latencies(updated),
+                remove_seconds=_latencies(removed), restart_seconds=restart)
+
+
+def bench_memory(rules: typing.List[dict], fleet: Fleet) -> dict:
+    """
+    Memory allocated by the engine for each stored entity.
+    """
+    engine = _engine(rules)
+    events = [('device', dict(**device, count=0, temperature=20., status='ok')) for device in fleet.devices]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    engine.trigger_many(events)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return dict(entities=len(engine.entities), bytes_per_entity=(after - before) / max(len(engine.entities), 1))
+
+
+def run(devices: int = 1000, rules: int = 100, events: int = 20000, rule_samples: int = 20,
+        seed: int = 0) -> dict:
+    """
+    Run the whole benchmark suite on a synthetic fleet.
+    :param devices: Number of devices of the fleet.
+    :param rules: Number of rules.
+    :param events: Number of triggered events.
+    :param rule_samples: Number of rules added, updated and removed at run-time.
+    :param seed: Seed of the fleet.
+    :return: The results, JSON-serializable.
+    """
+    fleet = Fleet(devices, seed)
+    rule_payloads = fleet.rules(rules)
+    event_tuples = fleet.events(events)
+    return dict(
+        parameters=dict(devices=devices, rules=rules, events=events, rule_samples=rule_samples, seed=seed),
+        environment=dict(python=sys.version.split()[0], platform=platform.platform()),
+        startup=bench_startup(rule_payloads),
+        trigger=bench_trigger(rule_payloads, event_tuples),
+        keys=bench_keys(rule_payloads, event_tuples),
+        matchers=bench_matchers(rule_payloads, event_tuples),
+        rules=bench_rules(rule_payloads, event_tuples, rule_samples),
+        memory=bench_memory(rule_payloads, fleet),
+    )
+
+
+def write_results(results: dict, path: str):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
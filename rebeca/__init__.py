@@ -1,4 +1,6 @@
 from .engine import Rebeca
 from .entity import Entity
+from .aio import AsyncRebeca
 
 __version__ = '1.0.0'
+from .sharding import ShardedRebeca
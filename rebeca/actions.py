@@ -1,8 +1,10 @@
-import json
 import re
+import typing
 from abc import ABC
 
-from .condition import Condition
+from experta.utils import unfreeze
+
+from .condition import Condition, ConditionFamily
 from .exceptions import ActionClassNotSupportedError
 
 
@@ -12,6 +14,39 @@ _data_key = '$data'
 _enter_key = '$enter'
 _exit_key = '$exit'
 
+_placeholder_pattern = re.compile(r'^\$([^.]+)\.(.+)$')
+
+
+def _compile_template(data, family: ConditionFamily) -> typing.Callable[[dict], object]:
+    """
+    Compile the data of an action into a template, rendered against the bindings of the match which fired the action.
+    Strings in the form '$alias.property' are bound to the property of the entity matched by the aliased rule
+    member, looked up in the slot of the alias, any other value is kept as a constant, preserving its type.
+    :param data: The data of the action.
+    :param family: The family of the rule condition, defining the aliases.
+    :return: The render function of the template.
+    """
+    if isinstance(data, dict):
+        items = [(k, _compile_template(v, family)) for k, v in data.items()]
+        return lambda bindings: {k: render(bindings) for k, render in items}
+    if isinstance(data, list):
+        renders = [_compile_template(v, family) for v in data]
+        return lambda bindings: [render(bindings) for render in renders]
+    match = _placeholder_pattern.match(data) if isinstance(data, str) else None
+    if match is None:
+        return lambda bindings: data
+    alias, property_name = match.groups()
+    member = family.get_member(alias) if family is not None else None
+    if member is None:
+        raise Exception(f"Rule member '{alias}' undefined")
+    slot = member.slot
+
+    def render_property(bindings):
+        fact = bindings.get(slot)
+        return data if fact is None else unfreeze(fact.get(property_name))
+
+    return render_property
+
 
 class Action(ABC):
 
@@ -21,71 +56,106 @@ class Action(ABC):
         self._condition: Condition = condition
         self._category: str = category
         self._data: dict = data
+        self._templates: typing.Dict[typing.Optional[str], typing.Callable] = self._compile_templates()
         self._engine = None
         self._facts: tuple = tuple()
+        self._bindings: dict = dict()
+        self.rule_name: typing.Optional[str] = None
+        self.rule_id: typing.Optional[int] = None
 
     def __repr__(self):
         return f"{self.__class__.__name__}(category={self._category}, {self._data})"
 
+    def __getstate__(self):
+        # The compiled templates are rebuilt on unpickling, and the engine and the last match are not kept
+        state = dict(vars(self))
+        for name in ('_templates', '_engine', '_facts', '_bindings'):
+            state.pop(name)
+        return state
+
+    def __setstate__(self, state: dict):
+        vars(self).update(state)
+        self._templates = self._compile_templates()
+        self._engine = None
+        self._facts = tuple()
+        self._bindings = dict()
+
+    def _compile_templates(self) -> typing.Dict[typing.Optional[str], typing.Callable]:
+        family = self._condition.family
+        templates = {None: _compile_template(self._data, family)}
+        for key in (_enter_key, _exit_key):
+            if key in self._data:
+                templates[key] = _compile_template(self._data[key], family)
+        return templates
+
     def execution(self, engine, *args, **kwargs):
         self._engine = engine
 
-    def _on_event(self, facts):
+    def _on_event(self, facts, bindings: dict = None):
         self._facts = facts
+        self._bindings = bindings or dict()
 
-    def on_added(self, facts):
-        self._on_event(facts)
+    def on_added(self, facts, bindings: dict = None):
+        self._on_event(facts, bindings)
 
-    def on_removed(self, facts):
-        self._on_event(facts)
+    def on_removed(self, facts, bindings: dict = None):
+        self._on_event(facts, bindings)
+
+    def on_refreshed(self, facts, bindings: dict = None):
+        self._on_event(facts, bindings)
 
     def on_trigger(self):
         pass
 
-    def _on_execute(self, data=None):
+    def _on_execute(self, key: str = None):
         if self._engine is not None:
-            if data is None:
-                data = self._data
-            plain_data = json.dumps(data)
-            matches = re.findall(r'"\$([^"]*)"', plain_data)
-            for match in matches:
-                alias, property_name = match.split('.')
-                member = self._condition.family.get_member(alias)
-                if member is None:
-                    raise Exception(f"Rule member '{alias}' undefined")
-                for fact in self._facts:
-                    if fact.class_name == member.entity_class.class_name:
-                        property_value = str(fact.attributes.get(property_name))
-                        if property_value.isdigit():
-                            property_value = f'§{property_value}§'
-                        plain_data = plain_data.replace(f"${match}", property_value)
-            plain_data = plain_data.replace('"§', '').replace('§"', '')
-            parsed_data = json.loads(plain_data)
-            self._engine.on_execute(action_category=self._category, **parsed_data)
+            render = self._templates.get(key, self._templates[None])
+            self._engine.on_action(self, render(self._bindings))
 
     @property
     def category(self):
         return self._category
 
+    @property
+    def facts(self) -> tuple:
+        return self._facts
+
+    @property
+    def state(self) -> typing.Optional[dict]:
+        """ Execution state of the action, as saved in a snapshot. None if the action is stateless. """
+        return None
+
+    def restore(self, state: dict):
+        """
+        Restore the execution state of the action from a snapshot.
+        :param state: The state, as returned by the state property.
+        """
+        pass
+
     @property
     def info(self) -> dict:
         return {'category': self._category, 'class': self.class_name, 'data': self._data}
 
     @classmethod
     def parse(cls, condition: Condition, payload: dict):
-        action_class_name = payload.pop(_class_key, None)
+        action_class_name = payload.get(_class_key)
         action_class = None
         for subclass in cls.__subclasses__():
             if subclass.class_name == action_class_name:
                 action_class = subclass
         if action_class is None:
             raise ActionClassNotSupportedError(action_class_name)
-        action_category = payload.pop(_category_key)
-        action_data = payload.pop(_data_key)
+        action_category = payload[_category_key]
+        action_data = payload[_data_key]
         return action_class(condition, action_category, action_data)
 
 
 class SingleTimeAction(Action):
+    """
+    Action fired once when a new match of its rule enters, with the '$enter' data if defined.
+    A refreshed match (whose entities changed but still match) does not fire it again. When matches of the rule
+    exit after it fired, the '$exit' data, if defined, is fired once, and the action waits for a new match.
+    """
 
     class_name = 'single'
 
@@ -97,16 +167,23 @@ class SingleTimeAction(Action):
     def execution(self, engine, *args, **kwargs):
         super().execution(engine)
         if self._can_execute and not self._executed:
-            self._on_execute(self._data.get(_enter_key))
+            self._on_execute(_enter_key)
             self._executed = True
 
-    def on_added(self, facts):
-        super().on_added(facts)
+    @property
+    def state(self) -> typing.Optional[dict]:
+        return {'executed': self._executed}
+
+    def restore(self, state: dict):
+        self._executed = state['executed']
+
+    def on_added(self, facts, bindings: dict = None):
+        super().on_added(facts, bindings)
         self._can_execute = True
         self._executed = False
 
-    def on_removed(self, facts):
-        super().on_removed(facts)
+    def on_removed(self, facts, bindings: dict = None):
+        super().on_removed(facts, bindings)
         self._can_execute = False
-        if self._executed and 'exit' in self._data:
-            self._on_execute(self._data.get(_exit_key))
+        if self._executed and _exit_key in self._templates:
+            self._on_execute(_exit_key)
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from .engine import Rebeca
+
+logger = logging.getLogger(__name__)
+
+_stop = object()
+
+
+class AsyncRebeca:
+    """
+    Asyncio front-end for a Rebeca engine.
+    Triggered events are put on a bounded queue, which is drained in batches by a single engine task. The engine
+    itself runs on a dedicated thread, so the event loop keeps ingesting while rules are evaluated and actions fired.
+    When the queue is full, the overflow policy determines what happens to a new event:
+        - 'block': the caller waits for a free slot (backpressure);
+        - 'drop_new': the new event is dropped;
+        - 'drop_old': the oldest queued event is dropped to make room for the new one.
+    If the clock of the engine is enabled, a scheduler task ticks it at the start of each period.
+
+        async with AsyncRebeca(rebeca, maxsize=1000, policy='drop_old') as engine:
+            await engine.trigger('device', {'id': 2, 'type': 'people_counter', 'count': 1})
+    """
+
+    policies = ('block', 'drop_new', 'drop_old')
+
+    def __init__(self, rebeca: Rebeca, maxsize: int = 1000, policy: str = 'block', batch_size: int = 100,
+                 coalesce: bool = True):
+        """
+        :param rebeca: The rule engine to feed. It must not be accessed from other threads while running.
+        :param maxsize: Maximum number of queued events.
+        :param policy: Overflow policy of the queue.
+        :param batch_size: Maximum number of events evaluated in a single batch.
+        :param coalesce: Whether to fire actions only on the final state of each batch (see Rebeca.trigger_many).
+        """
+        if policy not in self.policies:
+            raise ValueError(f"'{policy}' is not a valid policy, use one of {self.policies}")
+        self._rebeca: Rebeca = rebeca
+        self._maxsize: int = maxsize
+        self._policy: str = policy
+        self._batch_size: int = batch_size
+        self._coalesce: bool = coalesce
+        self._queue: asyncio.Queue = None
+        self._task: asyncio.Task = None
+        self._clock_task: asyncio.Task = None
+        self._stopping: bool = False
+        self._executor: ThreadPoolExecutor = None
+        self._processed: int = 0
+        self._dropped: int = 0
+        self._failed: int = 0
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop(drain=exc_type is None)
+
+    @property
+    def rebeca(self) -> Rebeca:
+        return self._rebeca
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None
+
+    @property
+    def queue_depth(self) -> int:
+        """ Number of events waiting to be evaluated. """
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def stats(self) -> dict:
+        """ Counters of the processed, dropped and failed events. """
+        return dict(queued=self.queue_depth, processed=self._processed, dropped=self._dropped, failed=self._failed)
+
+    async def start(self):
+        """
+        Start the engine task, starting the wrapped rule engine too if needed.
+        """
+        if self.is_running:
+            return
+        self._queue = asyncio.Queue(maxsize=self._maxsize)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rebeca')
+        if not self._rebeca.is_running:
+            await self.call(self._rebeca.start)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        if self._rebeca.clock_resolution is not None:
+            self._clock_task = asyncio.get_running_loop().create_task(self._run_clock())
+
+    async def stop(self, drain: bool = True):
+        """
+        Stop the engine task.
+        :param drain: If True, the queued events are evaluated before stopping, otherwise they are discarded.
+        """
+        if not self.is_running:
+            return
+        self._stopping = True
+        if self._clock_task is not None:
+            self._clock_task.cancel()
+            try:
+                await self._clock_task
+            except asyncio.CancelledError:
+                pass
+            self._clock_task = None
+        if drain:
+            await self._queue.put(_stop)
+            await self._task
+        else:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._dropped += self._queue.qsize()
+        self._task = None
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        self._queue = None
+        self._stopping = False
+
+    async def trigger(self, entity_name: str, entity_data: dict) -> bool:
+        """
+        Queue an Entity state update.
+        :return: False if the event has been dropped because of the overflow policy, True elsewhere.
+        """
+        if not self.is_running or self._stopping:
+            raise Exception("Must start the rule engine before triggering entities")
+        event = (entity_name, entity_data)
+        if self._policy == 'block':
+            await self._queue.put(event)
+            return True
+        if self._queue.full():
+            self._dropped += 1
+            if self._policy == 'drop_new':
+                return False
+            self._queue.get_nowait()
+            self._queue.task_done()
+        self._queue.put_nowait(event)
+        return True
+
+    async def join(self):
+        """ Wait until every queued event has been evaluated. """
+        await self._queue.join()
+
+    async def call(self, function: typing.Callable, *args, **kwargs):
+        """
+        Run a function on the engine thread, e.g. to add or remove rules while the engine task is running.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: function(*args, **kwargs))
+
+    async def _run_clock(self):
+        while self._rebeca.clock_resolution is not None:
+            resolution = self._rebeca.clock_resolution
+            await asyncio.sleep(resolution - time.time() % resolution)
+            try:
+                await self.call(self._rebeca.tick)
+            except Exception:
+                logger.exception("Error while ticking the clock")
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            events = [await self._queue.get()]
+            while events[-1] is not _stop and len(events) < self._batch_size and not self._queue.empty():
+                events.append(self._queue.get_nowait())
+            if events[-1] is _stop:
+                events.pop()
+                stopping = True
+            try:
+                if events:
+                    await self.call(self._rebeca.trigger_many, events, self._coalesce)
+                self._processed += len(events)
+            except Exception:
+                self._failed += len(events)
+                logger.exception("Error while evaluating a batch of %d events", len(events))
+            finally:
+                for _ in range(len(events) + stopping):
+                    self._queue.task_done()
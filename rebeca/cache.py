@@ -0,0 +1,154 @@
+import hashlib
+import io
+import os
+import pickle
+import typing
+
+from experta.conditionalelement import ConditionalElement
+from experta.fieldconstraint import P
+
+_format_version = 1
+
+
+def _conditional_element(element_class: type, items: tuple) -> ConditionalElement:
+    return element_class(*items)
+
+
+class _RulePickler(pickle.Pickler):
+    """
+    Pickler of the compiled rules. The predicates of the comparisons and the registered entity classes cannot be
+    pickled: they are saved as their definition, and rebuilt by the engine loading the rules.
+    """
+
+    def __init__(self, file, predicates: typing.Dict[int, tuple], entity_classes: typing.Dict[type, str]):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._predicates: typing.Dict[int, tuple] = predicates
+        self._entity_classes: typing.Dict[type, str] = entity_classes
+
+    def persistent_id(self, obj):
+        if isinstance(obj, P):
+            return 'predicate', self._predicates[id(obj)]
+        if isinstance(obj, type) and obj in self._entity_classes:
+            return 'entity_class', self._entity_classes[obj]
+        return None
+
+    def reducer_override(self, obj):
+        # Conditional elements are tuples built from their items as arguments, not from a single tuple
+        if isinstance(obj, ConditionalElement):
+            return _conditional_element, (type(obj), tuple(obj)), vars(obj) or None
+        return NotImplemented
+
+
+class _RuleUnpickler(pickle.Unpickler):
+
+    def __init__(self, file, parse_predicate: typing.Callable[[str, tuple], P], type_entities: dict):
+        super().__init__(file)
+        self._parse_predicate = parse_predicate
+        self._type_entities: dict = type_entities
+
+    def persistent_load(self, pid):
+        kind, definition = pid
+        if kind == 'predicate':
+            return self._parse_predicate(*definition)
+        if kind == 'entity_class' and definition in self._type_entities:
+            return self._type_entities[definition]
+        raise pickle.UnpicklingError(f"unsupported persistent id {pid}")
+
+
+def _operator_name(operator) -> str:
+    """
+    :param operator: A comparison operator.
+    :return: A name identifying the operator across processes, including the functions it wraps
+             (e.g. experta's GT is a closure over operator.gt).
+    """
+    name = f"{getattr(operator, '__module__', None)}.{getattr(operator, '__qualname__', type(operator).__qualname__)}"
+    wrapped = [_operator_name(cell.cell_contents) for cell in getattr(operator, '__closure__', None) or ()
+               if callable(cell.cell_contents)]
+    return f"{name}({', '.join(wrapped)})" if wrapped else name
+
+
+def rule_cache_key(source: typing.BinaryIO, type_entities: dict, operators: dict) -> str:
+    """
+    Compute the key of a compiled rule set: a digest of the source of the rules, of the registered entity classes,
+    of the comparison operators, of the version of the package and of the format of the cache.
+    The source is read in chunks.
+    :param source: The source of the rules (e.g. the rules file, opened in binary mode).
+    :param type_entities: The registered entity classes, by name.
+    :param operators: The comparison operators of the engine, by operator key.
+    :return: The key.
+    """
+    from . import __version__
+    classes = sorted((name, entity_class.attribute_keys, entity_class.meta_keys, entity_class.broadcast,
+                      entity_class.fast_keys) for name, entity_class in type_entities.items())
+    operator_names = sorted((operator_key, _operator_name(operator)) for operator_key, operator in operators.items())
+    digest = hashlib.sha256(repr((_format_version, __version__, classes, operator_names)).encode('utf-8'))
+    for chunk in iter(lambda: source.read(1 << 20), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dumps_rules(rules: list, predicates: typing.Dict[int, tuple], type_entities: dict) -> bytes:
+    """
+    Serialize compiled rules, e.g. to send them to another process.
+    :param rules: The parsed rules.
+    :param predicates: The definition, as (operator, operands), of the predicates of the rules, by predicate id.
+    :param type_entities: The registered entity classes, by name.
+    :return: The serialized rules.
+    """
+    f = io.BytesIO()
+    _dump_rules(f, rules, predicates, type_entities)
+    return f.getvalue()
+
+
+def loads_rules(data: bytes, parse_predicate: typing.Callable[[str, tuple], P], type_entities: dict) -> list:
+    """
+    Deserialize compiled rules (see dumps_rules).
+    :param data: The serialized rules.
+    :param parse_predicate: Function building the predicate of a comparison from its operator and operands.
+    :param type_entities: The registered entity classes, by name.
+    :return: The parsed rules.
+    """
+    return _RuleUnpickler(io.BytesIO(data), parse_predicate, type_entities).load()
+
+
+def _dump_rules(file, rules: list, predicates: typing.Dict[int, tuple], type_entities: dict):
+    entity_classes = {entity_class: name for name, entity_class in type_entities.items()}
+    _RulePickler(file, predicates, entity_classes).dump(rules)
+
+
+def write_rule_cache(path: str, key: str, rules: list, predicates: typing.Dict[int, tuple], type_entities: dict):
+    """
+    Write a compiled rule set to a cache file. The file is replaced atomically.
+    :param path: Path of the cache file.
+    :param key: Key of the rule set (see rule_cache_key).
+    :param rules: The parsed rules.
+    :param predicates: The definition, as (operator, operands), of the predicates of the rules, by predicate id.
+    :param type_entities: The registered entity classes, by name.
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'wb') as f:
+        pickle.dump((_format_version, key), f, protocol=pickle.HIGHEST_PROTOCOL)
+        _dump_rules(f, rules, predicates, type_entities)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+def read_rule_cache(path: str, key: str, parse_predicate: typing.Callable[[str, tuple], P],
+                    type_entities: dict) -> typing.Optional[list]:
+    """
+    Read a compiled rule set from a cache file. A missing, unreadable or stale cache is a miss, as well as a cache
+    whose rules cannot be rebuilt (e.g. referencing an operator or an entity class which is no longer defined).
+    :param path: Path of the cache file.
+    :param key: Key of the expected rule set (see rule_cache_key).
+    :param parse_predicate: Function building the predicate of a comparison from its operator and operands.
+    :param type_entities: The registered entity classes, by name.
+    :return: The parsed rules, None if the cache misses.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if pickle.load(f) != (_format_version, key):
+                return None
+            return _RuleUnpickler(f, parse_predicate, type_entities).load()
+    except Exception:
+        return None
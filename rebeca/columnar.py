@@ -0,0 +1,418 @@
+import typing
+
+from experta.activation import Activation
+from experta.conditionalelement import AND
+from experta.fact import Fact
+from experta.fieldconstraint import ANDFC, FieldConstraint, P
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional: without it, every rule is matched by the RETE network
+    numpy = None
+
+_missing = object()
+_max_exact_integer = 2 ** 53
+
+# Interval form of the supported comparisons: (lower bound, upper bound, lower inclusive, upper inclusive, negated)
+_intervals = {
+    '>': lambda a: (a, float('inf'), False, True, False),
+    '>=': lambda a: (a, float('inf'), True, True, False),
+    '<': lambda a: (float('-inf'), a, True, False, False),
+    '<=': lambda a: (float('-inf'), a, True, True, False),
+    '=': lambda a: (a, a, True, True, False),
+    '!=': lambda a: (a, a, True, True, True),
+    'between': lambda a, b: (a, b, True, True, False),
+}
+
+
+def _is_number(value) -> bool:
+    """ Whether a value is compared by Python exactly as its float64 conversion. """
+    value_type = type(value)
+    if value_type is int:
+        return -_max_exact_integer <= value <= _max_exact_integer
+    return value_type is float or value_type is bool
+
+
+class _ColumnarRule:
+    """
+    Rule compiled for the columnar matcher: the literal values its pattern tests on the attributes of the fact, and
+    the comparisons it tests on the properties, each in interval form.
+    """
+
+    def __init__(self, rule, slot: str, literals: typing.Tuple[tuple, tuple],
+                 comparisons: typing.List[typing.Tuple[str, tuple, P]]):
+        self.rule = rule
+        self.slot: str = slot
+        self.literals: typing.Tuple[tuple, tuple] = literals
+        self.comparisons: typing.List[typing.Tuple[str, tuple, P]] = comparisons
+
+    def match(self, fact: Fact) -> bool:
+        """ Match a fact as the RETE network does, running the predicates of the comparisons. """
+        attributes, values = self.literals
+        for attribute, value in zip(attributes, values):
+            if attribute not in fact or not value == fact[attribute]:
+                return False
+        for property_name, _, predicate in self.comparisons:
+            if property_name not in fact or not predicate.match(fact[property_name]):
+                return False
+        return True
+
+    def activation(self, fact: Fact) -> Activation:
+        return Activation(self.rule, frozenset((fact,)), {self.slot: fact})
+
+
+class _ColumnarTable:
+    """
+    Columnar table of the declared facts of a class, matched by the columnar rules of the class. Each fact is a row,
+    and each property compared by the rules is a column of float64 values, with a mask of the numeric values: a
+    batch of rows is matched against all the rules in a single vectorized pass. Rows holding a value which is not a
+    number in a compared property are matched by running the predicates of the rules instead.
+    """
+
+    def __init__(self):
+        self.rules: typing.List[_ColumnarRule] = list()
+        self.facts: typing.List[typing.Optional[Fact]] = list()
+        self.activations: typing.List[typing.List[Activation]] = list()
+        self._rows: typing.Dict[int, int] = dict()
+        self._free_rows: typing.List[int] = list()
+        self._columns: typing.Dict[str, int] = dict()
+        self._values = numpy.empty((0, 0))
+        self._numeric = numpy.empty((0, 0), dtype=bool)
+        self._fallback = numpy.empty(0, dtype=bool)
+        self._compiled: typing.Optional[tuple] = None
+
+    def add_rule(self, rule: _ColumnarRule) -> int:
+        self.rules.append(rule)
+        self._compiled = None
+        return len(self.rules) - 1
+
+    def remove_rules(self, action) -> bool:
+        """
+        Remove the rules of an action, dropping their activations.
+        :return: True if any rule is removed.
+        """
+        rules = [rule for rule in self.rules if rule.rule.action is not action]
+        if len(rules) == len(self.rules):
+            return False
+        self.rules = rules
+        self.activations = [[activation for activation in activations if activation.rule.action is not action]
+                            for activations in self.activations]
+        self._compiled = None
+        return True
+
+    def _compile(self) -> tuple:
+        """
+        Compile the rules: the index of the rules by the literal values they test, and the flat arrays of their
+        comparisons, grouped by rule.
+        """
+        literal_index: typing.Dict[tuple, typing.Dict[tuple, list]] = dict()
+        comparisons = list()
+        starts, counts = list(), list()
+        columns = dict(self._columns)
+        for index, rule in enumerate(self.rules):
+            attributes, values = rule.literals
+            literal_index.setdefault(attributes, dict()).setdefault(values, list()).append(index)
+            starts.append(len(comparisons))
+            counts.append(len(rule.comparisons))
+            for property_name, interval, _ in rule.comparisons:
+                comparisons.append((columns.setdefault(property_name, len(columns)), *interval))
+        literal_index = [(attributes, {values: numpy.array(indexes) for values, indexes in index.items()})
+                         for attributes, index in literal_index.items()]
+        if columns != self._columns:
+            self._columns = columns
+            self._rebuild_columns()
+        comparisons = numpy.array(comparisons, dtype=float).reshape(-1, 6)
+        flags = comparisons[:, 3:].astype(bool)
+        self._compiled = (literal_index, numpy.array(starts, dtype=int), numpy.array(counts, dtype=int),
+                          comparisons[:, 0].astype(int), comparisons[:, 1], comparisons[:, 2],
+                          flags[:, 0], flags[:, 1], flags[:, 2])
+        return self._compiled
+
+    def _rebuild_columns(self):
+        capacity = len(self.facts)
+        self._values = numpy.zeros((capacity, len(self._columns)))
+        self._numeric = numpy.zeros((capacity, len(self._columns)), dtype=bool)
+        self._fallback = numpy.zeros(capacity, dtype=bool)
+        for row, fact in enumerate(self.facts):
+            if fact is not None:
+                self._write_row(row, fact)
+
+    def _write_row(self, row: int, fact: Fact):
+        fallback = False
+        for property_name, column in self._columns.items():
+            value = fact.get(property_name, _missing)
+            if value is not _missing and _is_number(value):
+                self._values[row, column] = value
+                self._numeric[row, column] = True
+            else:
+                self._numeric[row, column] = False
+                fallback = fallback or value is not _missing
+        self._fallback[row] = fallback
+
+    def insert(self, fact: Fact) -> typing.Optional[int]:
+        """
+        Add a declared fact to the table.
+        :return: The row of the fact, None if already in the table.
+        """
+        if id(fact) in self._rows:
+            return None
+        if self._compiled is None:
+            self._compile()
+        if self._free_rows:
+            row = self._free_rows.pop()
+            self.facts[row] = fact
+        else:
+            row = len(self.facts)
+            self.facts.append(fact)
+            self.activations.append(list())
+            if row >= len(self._values):
+                capacity = max(16, 2 * len(self._values))
+                self._values = numpy.resize(self._values, (capacity, len(self._columns)))
+                self._numeric = numpy.resize(self._numeric, (capacity, len(self._columns)))
+                self._fallback = numpy.resize(self._fallback, capacity)
+        self._rows[id(fact)] = row
+        self._write_row(row, fact)
+        return row
+
+    def remove(self, fact: Fact) -> typing.List[Activation]:
+        """
+        Remove a retracted fact from the table.
+        :return: The activations of the fact.
+        """
+        row = self._rows.pop(id(fact), None)
+        if row is None:
+            return []
+        activations, self.activations[row] = self.activations[row], list()
+        self.facts[row] = None
+        self._free_rows.append(row)
+        return activations
+
+    def match_rules(self, rule_indexes: typing.Collection[int]) -> typing.List[Activation]:
+        """
+        Match all the rows against some rules, reading again the values of the facts, which may have been updated
+        in place since their insertion.
+        :param rule_indexes: The indexes of the rules to match.
+        :return: The new activations, by row and by rule.
+        """
+        self._compiled or self._compile()
+        self._rebuild_columns()
+        return self.match(sorted(self._rows.values()), rule_indexes)
+
+    def match(self, rows: typing.List[int], rule_indexes: typing.Collection[int] = None) -> typing.List[Activation]:
+        """
+        Match the facts of a batch of rows against the rules, in a single vectorized pass, and store the activations
+        of the matches.
+        :param rows: The rows to match.
+        :param rule_indexes: The indexes of the rules to match. If None, all the rules are matched.
+        :return: The new activations, by row and by rule.
+        """
+        if not rows or not self.rules:
+            return []
+        literal_index, starts, counts, columns, lower, upper, lower_inclusive, upper_inclusive, negated = \
+            self._compiled or self._compile()
+        selected = None
+        if rule_indexes is not None:
+            selected = numpy.zeros(len(self.rules), dtype=bool)
+            selected[list(rule_indexes)] = True
+        # Candidate (row, rule) pairs: the rules whose literal values the fact has
+        pair_rows, pair_rules = list(), list()
+        for row in rows:
+            fact = self.facts[row]
+            for attributes, index in literal_index:
+                values = tuple(fact.get(attribute, _missing) for attribute in attributes)
+                try:
+                    candidates = index.get(values)
+                except TypeError:
+                    candidates = None
+                if candidates is not None:
+                    if selected is not None:
+                        candidates = candidates[selected[candidates]]
+                    pair_rows.append(numpy.full(len(candidates), row))
+                    pair_rules.append(candidates)
+        if not pair_rules:
+            return []
+        pair_rows, pair_rules = numpy.concatenate(pair_rows), numpy.concatenate(pair_rules)
+        order = numpy.lexsort((pair_rules, pair_rows))
+        pair_rows, pair_rules = pair_rows[order], pair_rules[order]
+        # Comparisons of each pair, tested all at once
+        pair_counts = counts[pair_rules]
+        pairs = numpy.repeat(numpy.arange(len(pair_rules)), pair_counts)
+        offsets = numpy.arange(len(pairs)) - numpy.repeat(numpy.cumsum(pair_counts) - pair_counts, pair_counts)
+        comparisons = numpy.repeat(starts[pair_rules], pair_counts) + offsets
+        comparison_rows, comparison_columns = pair_rows[pairs], columns[comparisons]
+        values = self._values[comparison_rows, comparison_columns]
+        above = numpy.where(lower_inclusive[comparisons], values >= lower[comparisons], values > lower[comparisons])
+        below = numpy.where(upper_inclusive[comparisons], values <= upper[comparisons], values < upper[comparisons])
+        passed = self._numeric[comparison_rows, comparison_columns] & ((above & below) ^ negated[comparisons])
+        failures = numpy.bincount(pairs, weights=~passed, minlength=len(pair_rules))
+        matched = failures == 0
+        fallback = self._fallback[pair_rows]
+        activations = list()
+        for row, rule_index, is_matched, is_fallback in zip(pair_rows.tolist(), pair_rules.tolist(),
+                                                            matched.tolist(), fallback.tolist()):
+            rule = self.rules[rule_index]
+            fact = self.facts[row]
+            if is_fallback:
+                is_matched = rule.match(fact)
+            if is_matched:
+                activation = rule.activation(fact)
+                self.activations[row].append(activation)
+                activations.append(activation)
+        return activations
+
+
+class ColumnarMatcher:
+    """
+    Columnar backend of the matcher for the rules whose condition is a single pattern of one entity class, testing
+    literal values on the attributes and numeric comparisons ('>', '>=', '<', '<=', '=', '!=', 'between') on the
+    properties. Such rules need no join: instead of passing each fact through the alpha nodes of the RETE network,
+    the facts of each class are kept in a columnar table (see _ColumnarTable), and the batches of declared facts
+    are matched against the compiled rules with vectorized NumPy operations. The activations are the same as the
+    RETE network's, and are collected together with them.
+    Requires NumPy: check the available attribute.
+    """
+
+    available = numpy is not None
+
+    def __init__(self, predicates: typing.Dict[int, tuple]):
+        """
+        :param predicates: The definition, as (operator, operands), of the predicates of the rules, by predicate id.
+        """
+        self._predicates: typing.Dict[int, tuple] = predicates
+        self._tables: typing.Dict[type, _ColumnarTable] = dict()
+        self._added: typing.Dict[int, Activation] = dict()
+
+    def __len__(self):
+        return sum(len(table.rules) for table in self._tables.values())
+
+    def _compile_rule(self, rule) -> typing.Optional[_ColumnarRule]:
+        """
+        :param rule: A prepared rule.
+        :return: The compiled rule, None if the rule is not supported.
+        """
+        pattern = rule[0] if len(rule) == 1 else None
+        if isinstance(pattern, AND) and len(pattern) == 1:
+            pattern = pattern[0]
+        if not isinstance(pattern, Fact) or not isinstance(rule.salience, (int, float)):
+            return None
+        slot = f"__pattern_{id(pattern)}__"
+        literals, comparisons = list(), list()
+        for key, value in pattern.items():
+            if not isinstance(key, str):
+                return None
+            if key == '__bind__':
+                slot = value
+            elif '__' in key:
+                return None
+            elif isinstance(value, FieldConstraint):
+                predicates = list(value) if isinstance(value, ANDFC) else [value]
+                for predicate in predicates:
+                    definition = self._predicates.get(id(predicate)) if isinstance(predicate, P) else None
+                    if definition is None or definition[0] not in _intervals or \
+                            not all(_is_number(operand) for operand in definition[1]):
+                        return None
+                    operator_key, operands = definition
+                    comparisons.append((key, _intervals[operator_key](*operands), predicate))
+            else:
+                try:
+                    hash(value)
+                except TypeError:
+                    return None
+                if value != value:  # NaN never equals itself, but is found by identity in the literal index
+                    return None
+                literals.append((key, value))
+        literals.sort(key=lambda literal: literal[0])
+        return _ColumnarRule(rule, slot, (tuple(k for k, _ in literals), tuple(v for _, v in literals)), comparisons)
+
+    def add(self, rule, facts: typing.Iterable[Fact] = ()) -> bool:
+        """
+        Add a rule, if supported, matching it against the given declared facts.
+        :param rule: A prepared rule.
+        :param facts: The declared facts, matched against the rule.
+        :return: True if the rule is added, False if it is not supported.
+        """
+        return not self.attach([rule], facts)
+
+    def attach(self, rules: typing.Iterable, facts: typing.Iterable[Fact] = ()) -> list:
+        """
+        Add the supported rules, matching them against the given declared facts. The activations of the matches
+        are collected on the next changes.
+        :param rules: The prepared rules.
+        :param facts: The declared facts, matched against the rules.
+        :return: The rules which are not supported.
+        """
+        unsupported, added = list(), dict()
+        for rule in rules:
+            compiled = self._compile_rule(rule)
+            if compiled is None:
+                unsupported.append(rule)
+                continue
+            fact_type = type(rule[0][0] if isinstance(rule[0], AND) else rule[0])
+            table = self._tables.get(fact_type)
+            if table is None:
+                table = self._tables[fact_type] = _ColumnarTable()
+                for fact in facts:
+                    if type(fact) is fact_type:
+                        table.insert(fact)
+            added.setdefault(fact_type, list()).append(table.add_rule(compiled))
+        for fact_type, rule_indexes in added.items():
+            for activation in self._tables[fact_type].match_rules(rule_indexes):
+                self._added[id(activation)] = activation
+        return unsupported
+
+    def detach(self, action) -> bool:
+        """
+        Remove the rule of an action, discarding its activations.
+        :param action: The action of the rule.
+        :return: True if the rule is found.
+        """
+        for table in self._tables.values():
+            if table.remove_rules(action):
+                self._added = {key: activation for key, activation in self._added.items()
+                               if activation.rule.action is not action}
+                return True
+        return False
+
+    def load(self, facts: typing.Iterable[Fact]):
+        """
+        Add a bulk of declared facts, whose activations are collected on the next changes.
+        :param facts: The declared facts.
+        """
+        self._match(facts)
+
+    def _match(self, facts: typing.Iterable[Fact]):
+        batches: typing.Dict[type, typing.List[int]] = dict()
+        for fact in facts:
+            table = self._tables.get(type(fact))
+            if table is not None:
+                row = table.insert(fact)
+                if row is not None:
+                    batches.setdefault(type(fact), list()).append(row)
+        for fact_type, rows in batches.items():
+            for activation in self._tables[fact_type].match(rows):
+                self._added[id(activation)] = activation
+
+    def changes(self, adding: typing.Iterable[Fact] = None, deleting: typing.Iterable[Fact] = None) -> tuple:
+        """
+        Match the changes of the facts, as the RETE network does.
+        :param adding: The declared facts.
+        :param deleting: The retracted facts.
+        :return: The added and the removed activations.
+        """
+        removed = list()
+        for fact in deleting or ():
+            table = self._tables.get(type(fact))
+            if table is not None:
+                for activation in table.remove(fact):
+                    if self._added.pop(id(activation), None) is None:
+                        removed.append(activation)
+        self._match(adding or ())
+        added, self._added = list(self._added.values()), dict()
+        return added, removed
+
+    def reset(self):
+        for fact_type, table in self._tables.items():
+            self._tables[fact_type] = reset_table = _ColumnarTable()
+            for rule in table.rules:
+                reset_table.add_rule(rule)
+        self._added = dict()
@@ -1,11 +1,17 @@
 import typing
 
+from experta import Rule as ExpRule
 from experta.conditionalelement import ConditionalElement
+from experta.matchers.rete.utils import prepare_rule
 
 from .entity import Entity
 
 
 class ConditionFamilyMember:
+    """
+    Aliased member of a condition (e.g. '$any->device||counter'). The pattern of the member binds the matched
+    entity to the slot of the alias, so that the actions find it directly in the bindings of the match.
+    """
 
     def __init__(self, key: str, entity_class: Entity, alias: str):
         self._key: str = key
@@ -16,6 +22,15 @@ class ConditionFamilyMember:
     def entity_class(self) -> Entity:
         return self._entity_class
 
+    @property
+    def alias(self) -> str:
+        return self._alias
+
+    @property
+    def slot(self) -> str:
+        """ Name of the binding of the matched entity. """
+        return f"__{self._alias}__"
+
 
 class ConditionFamily:
 
@@ -26,6 +41,7 @@ class ConditionFamily:
 
     def __init__(self):
         self._members: typing.Dict[str, ConditionFamilyMember] = dict()
+        self._class_members: typing.Dict[str, ConditionFamilyMember] = dict()
 
     def parse_add_member(self, k, type_entities: dict) -> ConditionFamilyMember:
         for key in self._keys:
@@ -35,6 +51,7 @@ class ConditionFamily:
                 entity_class = type_entities.get(entity_class_name)
                 member = ConditionFamilyMember(key, entity_class, alias)
                 self._members[alias] = member
+                self._class_members.setdefault(entity_class.class_name, member)
                 return member
 
     def get_member(self, k):
@@ -44,10 +61,12 @@ class ConditionFamily:
     def members(self) -> typing.Dict[str, ConditionFamilyMember]:
         return self._members
 
-    def match(self, fact: Entity):
-        for member in self._members.values():
-            if member.entity_class.class_name == fact.class_name:
-                return member
+    def match(self, fact: Entity) -> typing.Optional[ConditionFamilyMember]:
+        """
+        :param fact: An entity.
+        :return: The first member of the class of the entity, None if missing.
+        """
+        return self._class_members.get(fact.class_name)
 
 
 class Condition:
@@ -58,11 +77,22 @@ class Condition:
         self._is_aggregation: bool = is_aggregation
         self._family: ConditionFamily = family
         self._payload: dict = payload
+        self._normal_form: typing.Optional[tuple] = None
 
     @property
     def expression(self) -> ConditionalElement:
         return self._expression
 
+    @property
+    def normal_form(self) -> tuple:
+        """
+        Condition elements of the expression prepared for the network (i.e. in disjunctive normal form),
+        computed once, so that building the engine does not normalize the rules again.
+        """
+        if self._normal_form is None:
+            self._normal_form = tuple(prepare_rule(ExpRule(self._expression)))
+        return self._normal_form
+
     @property
     def payload(self) -> dict:
         return self._payload
@@ -74,3 +104,18 @@ class Condition:
     @property
     def family(self) -> ConditionFamily:
         return self._family
+
+    @property
+    def patterns(self) -> typing.List[Entity]:
+        """ Entity patterns contained in the condition expression. """
+        patterns = list()
+
+        def collect(element):
+            if isinstance(element, Entity):
+                patterns.append(element)
+            elif isinstance(element, ConditionalElement):
+                for child in element:
+                    collect(child)
+
+        collect(self._expression)
+        return patterns
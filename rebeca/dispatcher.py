@@ -0,0 +1,156 @@
+import asyncio
+import threading
+import typing
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+
+from .actions import Action
+
+
+class ActionDispatcher:
+    """
+    Dispatcher of the fired actions to a concurrent.futures executor (or to an asyncio loop, for coroutine
+    action functions), so that the matching of the rules does not wait for the execution of the actions.
+
+    Actions sharing the same ordering key are executed one at a time, in firing order:
+        - 'rule': actions of the same rule are ordered;
+        - 'entity': actions fired by the same set of entities are ordered;
+        - None: no ordering is guaranteed.
+
+    A failing action is retried up to the given number of times, keeping its place in the ordering. Once
+    completed, on_complete(category, data, result) or on_failure(category, data, exception) is called.
+    """
+
+    orderings = ('rule', 'entity', None)
+
+    def __init__(self, executor: Executor = None, loop: asyncio.AbstractEventLoop = None,
+                 ordering: typing.Optional[str] = 'rule', retries: int = 0,
+                 on_complete: typing.Callable = None, on_failure: typing.Callable = None):
+        """
+        :param executor: Executor of the action functions, a single-thread executor by default.
+        :param loop: Running asyncio loop, used to execute the coroutine action functions.
+        :param ordering: Ordering key of the actions.
+        :param retries: Number of retries of a failing action.
+        :param on_complete: Hook called when an action completes.
+        :param on_failure: Hook called when an action fails after its retries.
+        """
+        if ordering not in self.orderings:
+            raise ValueError(f"'{ordering}' is not a valid ordering, use one of {self.orderings}")
+        self._executor: Executor = executor if executor is not None else ThreadPoolExecutor(max_workers=1)
+        self._loop: asyncio.AbstractEventLoop = loop
+        self._ordering: typing.Optional[str] = ordering
+        self._retries: int = retries
+        self._on_complete: typing.Callable = on_complete
+        self._on_failure: typing.Callable = on_failure
+        self._queues: typing.Dict[object, deque] = dict()
+        self._pending: int = 0
+        self._condition = threading.Condition()
+
+    @property
+    def pending(self) -> int:
+        """ Number of dispatched actions not completed yet. """
+        return self._pending
+
+    def _ordering_key(self, action: Action) -> object:
+        if self._ordering == 'rule':
+            return action
+        if self._ordering == 'entity':
+            return frozenset(fact.key for fact in action.facts)
+        return object()
+
+    def dispatch(self, action: Action, function: typing.Callable, data: dict):
+        """
+        Schedule the execution of an action function. If the executor (or the loop) rejects it, e.g. because it is
+        shut down, the exception is raised and the action is not counted as pending.
+        :param action: The fired action.
+        :param function: The function executing the action, called with the data as keyword arguments.
+        :param data: The rendered data of the action.
+        """
+        job = (action.category, function, data, 0)
+        key = self._ordering_key(action)
+        with self._condition:
+            self._pending += 1
+            queue = self._queues.get(key)
+            if queue is not None:
+                queue.append(job)
+                return
+            self._queues[key] = deque()
+        try:
+            self._submit(key, job)
+        except BaseException:
+            # Release the slot of the action, and start the ones queued behind it in the meantime
+            self._start(key, self._release(key))
+            raise
+
+    def _submit(self, key, job):
+        category, function, data, attempt = job
+        if self._loop is not None and asyncio.iscoroutinefunction(function):
+            future: Future = asyncio.run_coroutine_threadsafe(function(**data), self._loop)
+        else:
+            future: Future = self._executor.submit(function, **data)
+        future.add_done_callback(lambda f: self._on_done(key, job, f))
+
+    def _start(self, key, job):
+        """
+        Submit the next job of an ordering key. A rejected job fails, and the following one is submitted.
+        :param key: The ordering key.
+        :param job: The job, None if the key has no queued job.
+        """
+        while job is not None:
+            try:
+                self._submit(key, job)
+                return
+            except Exception as exception:
+                self._complete(job, exception=exception)
+                job = self._release(key)
+
+    def _release(self, key) -> typing.Optional[tuple]:
+        """
+        Release the slot of a completed job.
+        :param key: The ordering key of the job.
+        :return: The next queued job of the key, None if missing.
+        """
+        with self._condition:
+            queue = self._queues[key]
+            next_job = queue.popleft() if queue else None
+            if next_job is None:
+                del self._queues[key]
+            self._pending -= 1
+            self._condition.notify_all()
+        return next_job
+
+    def _complete(self, job, result=None, exception: BaseException = None):
+        category, _, data, _ = job
+        if exception is None:
+            if self._on_complete is not None:
+                self._on_complete(category, data, result)
+        elif self._on_failure is not None:
+            self._on_failure(category, data, exception)
+
+    def _on_done(self, key, job, future: Future):
+        category, function, data, attempt = job
+        exception = future.exception()
+        if exception is not None and attempt < self._retries:
+            try:
+                self._submit(key, (category, function, data, attempt + 1))
+                return
+            except Exception as retry_exception:
+                exception = retry_exception
+        try:
+            self._complete(job, None if exception is not None else future.result(), exception)
+        finally:
+            self._start(key, self._release(key))
+
+    def join(self, timeout: float = None) -> bool:
+        """
+        Wait for the completion of all the dispatched actions.
+        :return: False if the timeout expired before the completion, True elsewhere.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending == 0, timeout)
+
+    def shutdown(self, wait: bool = True):
+        """ Shut the executor down, waiting for the dispatched actions if required. """
+        if wait:
+            self.join()
+        self._executor.shutdown(wait=wait)
@@ -1,15 +1,34 @@
+import asyncio
+import copy
+import datetime
+import functools
+import time
 import typing
+from collections import Counter
+from contextlib import contextmanager
 
 from experta import (
     KnowledgeEngine, GT, GE, LT, LE, EQ, NE,
     BETWEEN, CONTAINS, REGEX, AND, OR
 )
+from experta.fieldconstraint import ANDFC, P
+from experta.utils import freeze
 
 from .rule import Rule, _RuleEngineAction
 from .entity import Entity, AggregationEntity, UTC
 from .strategy import _RuleEngineStrategy
+from .matcher import _RuleEngineMatcher, _WorkingMemory
+from .columnar import ColumnarMatcher
 from .condition import Condition, ConditionFamily, ConditionFamilyMember
 from .actions import Action
+from .dispatcher import ActionDispatcher
+from .snapshot import write_snapshot, read_snapshot
+from .loader import RuleLoader
+from .eventlog import EventLog, read_events
+from .intervals import PropertyIntervals
+from .metrics import Metrics
+from .store import RuleStore
+from .retention import RetentionPolicy
 from .exceptions import *
 
 import logging
@@ -54,6 +73,7 @@ class Rebeca:
 
     _aggregation_key = '$aggregation'
     _aggregation_function_key = '$function'
+    _aggregation_window_key = '$window'
     _properties_key = '$properties'
     _property_key = '$property'
     _entities_key = '$entities'
@@ -72,11 +92,70 @@ class Rebeca:
         "$or": OR
     }
 
-    def __init__(self):
+    def __init__(self, action_dispatcher: ActionDispatcher = None, event_log: EventLog = None,
+                 metrics: Metrics = None, columnar: bool = False, fast_keys: bool = False):
+        """
+        :param action_dispatcher: Dispatcher executing the fired actions off the matching loop. If None, the
+                                  actions are executed synchronously while evaluating the rules.
+        :param event_log: Log recording every triggered event. If None, events are not recorded.
+        :param metrics: Collector of the counters and latencies of the engine. If None, nothing is measured.
+        :param columnar: Whether to match the single entity rules with the columnar matcher (see ColumnarMatcher)
+                         instead of the RETE network. Requires NumPy, an optional dependency.
+        :param fast_keys: Default key mode of the entity classes registered by the engine (see
+                          register_entity_class).
+        """
+        if columnar and not ColumnarMatcher.available:
+            raise ImportError("The columnar matcher requires NumPy")
+        self._metrics: Metrics = metrics
+        self._columnar: bool = columnar
+        self._fast_keys: bool = fast_keys
         self._engine: KnowledgeEngine = None
-        self._rules = dict()
+        self._working_memory: _WorkingMemory = None
+        self._action_dispatcher: ActionDispatcher = action_dispatcher
+        self._event_log: EventLog = event_log
+        self._replay_actions: typing.Optional[list] = None
+        self._rules: RuleStore = RuleStore()
         self._entities = dict()
-        self._aggregation_entities = dict()
+        self._aggregation_entities: typing.Dict[object, typing.Set[int]] = dict()
+        self._windowed_aggregations: typing.Dict[int, AggregationEntity] = dict()
+        self._referenced_properties: typing.Dict[str, Counter] = dict()
+        self._property_intervals: typing.Dict[str, typing.Dict[str, PropertyIntervals]] = dict()
+        self._predicates: typing.Dict[tuple, P] = dict()
+        self._predicate_definitions: typing.Dict[int, tuple] = dict()
+        self._predicate_references: Counter = Counter()
+        self._unreferenced_predicates: typing.Set[int] = set()
+        self._retention: typing.Dict[str, RetentionPolicy] = dict()
+        self._clock_resolution: float = None
+        self._clock_tick: float = None
+        self._pending_evaluation: bool = False
+        self._batch: typing.List[tuple] = None
+        self._snapshot_path: str = None
+        self._snapshot_interval: float = None
+        self._snapshot_time: float = None
+
+    @classmethod
+    def _new_parser(cls, entity_classes: typing.List[tuple]) -> 'Rebeca':
+        """
+        Build an engine only used to parse rules (e.g. in the worker processes of a RuleLoader), registering the
+        given entity classes.
+        :param entity_classes: The definitions of the entity classes (see _entity_class_definitions).
+        :return: The engine, never started.
+        """
+        parser = cls.__new__(cls)
+        Rebeca.__init__(parser)
+        for class_name, attributes, meta_keys, broadcast, fast_keys in entity_classes:
+            parser._registered_type_entities[class_name] = type(class_name.title(), (Entity,), {
+                "attribute_keys": attributes, "meta_keys": meta_keys, "class_name": class_name,
+                "broadcast": broadcast, "fast_keys": fast_keys})
+        return parser
+
+    def _entity_class_definitions(self) -> typing.List[tuple]:
+        """
+        :return: The (name, key attributes, meta keys, broadcast, fast keys) definitions of the registered entity
+                 classes.
+        """
+        return [(class_name, entity_class.attribute_keys, entity_class.meta_keys, entity_class.broadcast,
+                 entity_class.fast_keys) for class_name, entity_class in self._registered_type_entities.items()]
 
     @property
     def _strategy(self) -> _RuleEngineStrategy:
@@ -95,17 +174,20 @@ class Rebeca:
                 **self._basic_type_entities}
 
     def _parse_rule(self, payload: dict) -> Rule:
-        condition_payload = payload.pop('condition')
-        action_payload = payload.pop('action')
+        """
+        Parse a rule. The payload is left untouched.
+        :param payload: Content of the rule.
+        :return: The parsed rule.
+        """
         try:
             # Parse the condition payload
-            condition = self._parse_condition(condition_payload)
+            condition = self._parse_condition(payload['condition'])
             # Parse the action payload
-            action = Action.parse(condition, action_payload)
-        except ActionClassNotSupportedError as e:
-            raise RuleParsingError(payload['name'], e)
+            action = Action.parse(condition, payload['action'])
+        except Exception as e:
+            raise RuleParsingError(payload.get('name'), e) from e
         # Create a new rule with the parsed condition, action and the remaining payload
-        return Rule(condition, action, **payload)
+        return Rule(condition, action, **{k: v for k, v in payload.items() if k not in ('condition', 'action')})
 
     def _add_rule(self, payload) -> int:
         """
@@ -113,35 +195,184 @@ class Rebeca:
         :param payload: Content of the rule to add.
         :return: The id of the stored rule.
         """
-        rule: Rule = self._parse_rule(payload)
+        rule_id = self._store_rule(self._parse_rule(payload))
+        self._release_predicates()
+        return rule_id
 
-        ids = sorted(self._rules.keys())
-        missing_ids = [x for x in range(ids[0], ids[-1] + 1) if x not in ids] if ids else []
-        rule_id = min(missing_ids) if missing_ids else max(ids) + 1 if ids else 1
+    def _store_rule(self, rule: Rule) -> int:
+        """
+        Save a parsed rule in the storage.
+        :param rule: The rule.
+        :return: The id of the stored rule.
+        """
+        rule_id = self._rules.add(rule)
+        rule.action.rule_id = rule_id
+        self._index_aggregation(rule_id, rule)
+        self._index_properties(rule)
+        return rule_id
+
+    def _index_properties(self, rule: Rule, increment: int = 1):
+        """
+        Count the references of the rule to the properties of each entity class and to the interned predicates,
+        and index the comparisons the rule tests on them.
+        :param rule: The rule.
+        :param increment: 1 to add the references of the rule, -1 to remove them.
+        """
+        for pattern in rule.condition.patterns:
+            for value in pattern.values():
+                for predicate in (value if isinstance(value, ANDFC) else (value,)):
+                    predicate_id = id(predicate)
+                    if predicate_id in self._predicate_definitions:
+                        self._predicate_references[predicate_id] += increment
+                        if self._predicate_references[predicate_id] <= 0:
+                            del self._predicate_references[predicate_id]
+                            self._unreferenced_predicates.add(predicate_id)
+                        else:
+                            self._unreferenced_predicates.discard(predicate_id)
+            referenced = self._referenced_properties.setdefault(pattern.class_name, Counter())
+            for property_name in pattern.property_keys:
+                referenced[property_name] += increment
+                if referenced[property_name] <= 0:
+                    del referenced[property_name]
+            class_intervals = self._property_intervals.setdefault(pattern.class_name, dict())
+            for property_name, comparisons in pattern.comparisons.items():
+                intervals = class_intervals.setdefault(property_name, PropertyIntervals())
+                for comparison in comparisons:
+                    for operator_key, values in comparison.items():
+                        intervals.add(operator_key, values if isinstance(values, list) else [values], increment)
+                if not intervals:
+                    del class_intervals[property_name]
 
-        self._rules[rule_id] = rule
+    def _index_aggregation(self, rule_id: int, rule: Rule):
+        """
+        Add an aggregation rule to the index of the aggregations which each member entity feeds.
+        :param rule_id: The id of the rule.
+        :param rule: The rule, ignored if not an aggregation.
+        """
         if rule.condition.is_aggregation:
-            for entity_key in rule.condition.expression[0].entity_keys:
-                self._aggregation_entities[entity_key] = rule
-        return rule_id
+            aggregation_entity: AggregationEntity = rule.condition.expression[0]
+            for entity_key in aggregation_entity.entity_keys:
+                self._aggregation_entities.setdefault(entity_key, set()).add(rule_id)
+            if aggregation_entity.function is not None and aggregation_entity.function.windowed:
+                self._windowed_aggregations[rule_id] = aggregation_entity
+
+    def _unindex_aggregation(self, rule_id: int, rule: Rule):
+        """
+        Remove an aggregation rule from the index of the aggregations which each member entity feeds.
+        If no other rule refers to the same aggregation, its entity is retracted too.
+        :param rule_id: The id of the rule.
+        :param rule: The rule, ignored if not an aggregation.
+        """
+        if not rule.condition.is_aggregation:
+            return
+        self._windowed_aggregations.pop(rule_id, None)
+        aggregation_entity: AggregationEntity = rule.condition.expression[0]
+        for entity_key in aggregation_entity.entity_keys:
+            rule_ids = self._aggregation_entities.get(entity_key)
+            if rule_ids is not None:
+                rule_ids.discard(rule_id)
+                if not rule_ids:
+                    del self._aggregation_entities[entity_key]
+        shared = any(self._rules[other_id].condition.expression[0].key == aggregation_entity.key
+                     for other_id in self._rules.by_class(AggregationEntity.class_name) if other_id != rule_id)
+        stored_entity: Entity = self._entities.get(aggregation_entity.key)
+        if not shared and stored_entity is not None:
+            del self._entities[aggregation_entity.key]
+            if self.is_running:
+                self._engine.retract(stored_entity)
 
-    def register_entity_class(self, class_name: str, attributes: typing.List[str]):
-        entity_class: Entity = type(class_name.title(), (Entity,), {"attribute_keys": attributes})
-        entity_class.class_name = class_name
+    def register_entity_class(self, class_name: str, attributes: typing.List[str], broadcast: bool = False,
+                              fast_keys: bool = None):
+        """
+        Register an entity class.
+        :param class_name: Name of the entity class, used in the rules.
+        :param attributes: Names of the key attributes.
+        :param broadcast: Whether the entities of the class are global, e.g. a clock (see Entity).
+        :param fast_keys: Whether the entities are keyed by the plain tuple of their key attributes, instead of by
+                          their digest (see Entity). The keys of the two modes differ, so the mode of a class must not
+                          change once its entities are stored, snapshotted or cached as aggregation members.
+                          If None, the default mode of the engine is used.
+        """
+        entity_class: Entity = type(class_name.title(), (Entity,), {
+            "attribute_keys": tuple(attributes), "class_name": class_name, "broadcast": broadcast,
+            "fast_keys": self._fast_keys if fast_keys is None else fast_keys})
         self._registered_type_entities[class_name] = entity_class
 
+    def set_retention_policy(self, class_name: str, ttl: float = None, max_count: int = None):
+        """
+        Bound the number of the stored entities of a class: entities not updated for longer than the TTL, and the
+        least recently updated ones exceeding the maximum count, are evicted (see evict). The current entities of
+        the class are tracked as just updated.
+        :param class_name: Name of the entity class.
+        :param ttl: Time to live of an entity since its last update, in seconds. If None, entities never expire.
+        :param max_count: Maximum number of entities of the class. If None, the number is unbounded.
+                          If both are None, the policy of the class is removed.
+        """
+        if class_name not in self.type_entities:
+            raise Exception(f"'{class_name}' is not a registered entity class.")
+        if ttl is None and max_count is None:
+            self._retention.pop(class_name, None)
+            return
+        policy = RetentionPolicy(ttl, max_count)
+        now = time.monotonic()
+        for entity_key, entity in self._entities.items():
+            if entity.class_name == class_name:
+                policy.touch(entity_key, now)
+        self._retention[class_name] = policy
+
+    @property
+    def evictions(self) -> typing.Dict[str, dict]:
+        """ Number of entities evicted by the retention policies, by class and by reason ('ttl' or 'max_count'). """
+        return {class_name: policy.evictions for class_name, policy in self._retention.items()}
+
     def add_rule(self, *payloads):
         """
         Parse and add one or more rule(s) to the engine, storing it.
         :param payloads: Content of the rule(s) to add.
-        :return: The id of the stored rule.
+        :return: The ids of the stored rules.
         """
-        # Parse and add the rule
-        for payload in payloads:
-            self._add_rule(payload)
-        # If engine already started, restart it
-        if self.is_running:
-            self.restart()
+        return self.add_rules(payloads)
+
+    def add_rules(self, payloads: typing.Iterable[dict]) -> typing.List[int]:
+        """
+        Parse and add a bulk of rules to the engine, storing them. If the engine is already started, all the rules
+        are wired in the running engine at once.
+        :param payloads: Iterable of the contents of the rules to add.
+        :return: The ids of the stored rules.
+        """
+        return self._store_rules([self._parse_rule(payload) for payload in payloads])
+
+    def _store_rules(self, rules: typing.List[Rule]) -> typing.List[int]:
+        """
+        Save a bulk of parsed rules in the storage, wiring them in the running engine at once.
+        :param rules: The rules.
+        :return: The ids of the stored rules.
+        """
+        rule_ids = [self._store_rule(rule) for rule in rules]
+        self._release_predicates()
+        # If engine already started, hot-patch it
+        if self.is_running and rule_ids:
+            self._attach_rules(rules)
+        return rule_ids
+
+    def load_rules(self, path: str, cache_path: str = None, workers: int = 0,
+                   batch_size: int = 500) -> typing.List[int]:
+        """
+        Add the rules of a YAML, JSON or JSON Lines file (by extension: '.jsonl' or '.ndjson' for JSON Lines, '.json'
+        for JSON, and YAML otherwise) to the engine. The file is read as a stream, one rule at a time, and each rule
+        is validated and parsed, also in worker processes (see RuleLoader): if any rule is not valid, no rule is added
+        and a RuleLoadingError reports all the errors with their line. Otherwise, all the rules are added at once.
+        With a cache, the compiled rules (parsed and in normal form) are saved to the cache file, keyed by a digest
+        of the content of the file, of the registered entity classes, of the comparison operators and of the version
+        of the package: while they are unchanged, the next loads read the compiled rules from the cache, skipping the
+        parsing of the file and of the rules.
+        :param path: Path of the rules file.
+        :param cache_path: Path of the cache file. If None, the rules are not cached.
+        :param workers: Number of worker processes parsing the rules. If 0, the rules are parsed in this process.
+        :param batch_size: Number of rules parsed by a worker at a time.
+        :return: The ids of the stored rules.
+        """
+        return RuleLoader(self, workers, batch_size).load(path, cache_path)
 
     def remove_rule(self, rule_id):
         """
@@ -153,7 +384,10 @@ class Rebeca:
         if rule is None:
             raise RuleNotFoundError(rule_id)
         if self.is_running:
-            self.restart()
+            self._detach_rule(rule)
+        self._unindex_aggregation(rule_id, rule)
+        self._index_properties(rule, -1)
+        self._release_predicates()
         return rule
 
     def _update_rule(self, rule_id, payload) -> bool:
@@ -165,8 +399,18 @@ class Rebeca:
         """
         rule = self._rules.get(rule_id)
         if rule is not None:
+            if self.is_running:
+                self._detach_rule(rule)
+            self._unindex_aggregation(rule_id, rule)
+            self._index_properties(rule, -1)
             rule = self._parse_rule(payload)
-            self._rules[rule_id] = rule
+            self._rules.replace(rule_id, rule)
+            rule.action.rule_id = rule_id
+            self._index_aggregation(rule_id, rule)
+            self._index_properties(rule)
+            self._release_predicates()
+            if self.is_running:
+                self._attach_rules([rule])
         return rule is not None
 
     def update_rule(self, rule_id, payload):
@@ -175,11 +419,38 @@ class Rebeca:
         :param rule_id: Id of the rule to update.
         :param payload: Payload of the rule.
         """
-        # Update the rule
+        # Update the rule, hot-patching the engine if already started
         self._update_rule(rule_id, payload)
-        # If engine already started, restart it
-        if self.is_running:
-            self.restart()
+
+    def _attach_rules(self, rules: typing.List[Rule]):
+        """
+        Wire rules in the running engine, evaluating them only on the stored entities they reference.
+        The state of the entities and of the actions of the other rules is preserved.
+        :param rules: The rules to attach.
+        """
+        self._engine.matcher.attach(*(rule.build() for rule in rules))
+        self._update_agenda()
+        for rule in rules:
+            if rule.condition.is_aggregation:
+                aggregation_entity: AggregationEntity = rule.condition.expression[0]
+                if any(entity_key in self._entities for entity_key in aggregation_entity.entity_keys):
+                    self._evaluate_aggregation(aggregation_entity)
+
+    def _detach_rule(self, rule: Rule):
+        """
+        Unwire a rule from the running engine, discarding its pending activations.
+        :param rule: The rule to detach.
+        """
+        self._engine.matcher.detach(rule.action)
+        self._engine.agenda.activations = [activation for activation in self._engine.agenda.activations
+                                           if activation.rule.action is not rule.action]
+
+    def _update_agenda(self):
+        """
+        Collect the pending activations of the engine network and update the agenda.
+        """
+        added, removed = self._engine.get_activations()
+        self._strategy.update_agenda(self._engine.agenda, added, removed)
 
     def read_rules(self) -> dict:
         """
@@ -188,56 +459,339 @@ class Rebeca:
         """
         return {rule_id: rule.info for rule_id, rule in self._rules.items()}
 
+    def network_statistics(self) -> typing.Optional[dict]:
+        """
+        Measure the network of the running engine and how much the rules share its nodes: since identical
+        comparisons and identical conditions are parsed to the same canonical form, the matching cost scales
+        with the distinct tests rather than with the number of rules.
+        :return: The statistics of the network (see _RuleEngineMatcher.statistics), None if the engine is not started.
+        """
+        if not self.is_running:
+            return None
+        return self._engine.matcher.statistics()
+
     def _build_knowledge_engine(self) -> KnowledgeEngine:
         """
         Dynamically build the knowledge engine.
         :return: The KnowledgeEngine instance.
         """
-        built_rules = {rule.name: rule.build() for rule in self._rules.values()}
-        methods = {**{self.on_execute.__name__: self.on_execute}, **built_rules}
+        # Rules are named by their id too, so that rules with the same name (or the name of a method) do not collide
+        built_rules = {f"{rule.name}#{rule_id}": rule.build() for rule_id, rule in self._rules.items()}
+        columnar = None
+        if self._columnar:
+            columnar = ColumnarMatcher(self._predicate_definitions)
+        methods = {**{self.on_execute.__name__: self.on_execute, self.on_action.__name__: self.on_action,
+                      '__matcher__': _RuleEngineMatcher, '__columnar__': columnar}, **built_rules}
         return type(self.__class__.__name__, (KnowledgeEngine,), methods)()
 
-    def _trigger(self, entity: Entity):
+    def _trigger(self, entity: Entity) -> dict:
         """
         Declare or modify a tuple of Entity in the engine.
         :param entity: The Entity Events to declare or modify.
+        :return: The changed properties of the entity (all of them, if the entity is new).
         """
         if self._engine is None:
             raise Exception("Must start the rule engine before adding entities")
         _entity: Entity = self._entities.get(entity.key)
         if _entity is not None:
-            if entity.properties != _entity.properties:
-                self._entities[entity.key] = self._engine.modify(_entity, **entity.properties)
-                self._entities[entity.key].refresh(entity.properties)
+            changes = entity.diff(_entity)
+            if changes:
+                referenced = self._referenced_properties.get(entity.class_name)
+                if referenced is None or referenced.keys().isdisjoint(changes) or \
+                        self._keeps_comparisons(_entity, changes, referenced):
+                    # No rule tests the changed properties, or no comparison on them flips,
+                    # so the matches cannot change
+                    self._working_memory.refresh(_entity, changes)
+                else:
+                    # The retraction and the declaration are seen by the agenda as a single update
+                    with self._working_memory.deferred_agenda() as running:
+                        self._entities[entity.key] = self._engine.modify(_entity, **changes)
+                    if not running:
+                        self._update_agenda()
+                    self._pending_evaluation = True
         else:
+            changes = entity.diff({})
             self._entities[entity.key] = self._engine.declare(*([entity]))
+            self._pending_evaluation = True
+        policy = self._retention.get(entity.class_name)
+        if policy is not None:
+            policy.touch(entity.key, time.monotonic())
+        return changes
+
+    def _keeps_comparisons(self, entity: Entity, changes: dict, referenced: Counter) -> bool:
+        """
+        Check whether the changed properties of an entity keep the outcome of every comparison the rules test on
+        them, i.e. whether their old and new values lie in the same intervals of the indexed comparisons.
+        :param entity: The declared entity, with its old values.
+        :param changes: The changed properties, with their new values.
+        :param referenced: The references of the rules to the properties of the entity class.
+        :return: True if no comparison flips, False elsewhere.
+        """
+        class_intervals = self._property_intervals.get(entity.class_name, {})
+        for property_name, value in changes.items():
+            if property_name in referenced:
+                intervals = class_intervals.get(property_name)
+                if intervals is None or property_name not in entity or \
+                        intervals.signature(entity[property_name]) != intervals.signature(value):
+                    return False
+        return True
+
+    def _trigger_aggregation(self, *entities: Entity):
+        """
+        Update the running state of the aggregations which the given entities are member of,
+        and evaluate each aggregation only once.
+        :param entities: The updated entities.
+        """
+        aggregation_rules: typing.Dict[int, Rule] = dict()
+        for entity in entities:
+            for rule_id in self._aggregation_entities.get(entity.key, ()):
+                aggregation_rule: Rule = self._rules[rule_id]
+                aggregation_entity: AggregationEntity = aggregation_rule.condition.expression[0]
+                if aggregation_entity.function is not None:
+                    # An entity no longer stored (i.e. evicted) leaves the aggregation
+                    stored_entity: Entity = self._entities.get(entity.key)
+                    properties = stored_entity.properties if stored_entity is not None else dict()
+                    aggregation_entity.function.update(entity.key, properties)
+                    aggregation_rules[rule_id] = aggregation_rule
+        for aggregation_rule in aggregation_rules.values():
+            self._trigger_aggregation_event(aggregation_rule.condition.expression[0])
+
+    def _trigger_aggregation_event(self, aggregation_entity: AggregationEntity):
+        """
+        Declare or modify the entity of an aggregation with its current value. An undefined value (e.g. the average
+        of no members) is not triggered, and retracts the entity of the aggregation, so that its rules no longer match.
+        :param aggregation_entity: The aggregation to trigger.
+        """
+        value = aggregation_entity.function.value
+        if value is not None:
+            self._trigger(aggregation_entity.generate_event(value))
+            return
+        stored_entity: Entity = self._entities.pop(aggregation_entity.key, None)
+        if stored_entity is not None:
+            self._engine.retract(stored_entity)
+            self._pending_evaluation = True
 
-    def _trigger_aggregation(self, entity):
-        aggregation_rule: Rule = self._aggregation_entities.get(entity.key)
-        if aggregation_rule is not None:
-            aggregation_entity: AggregationEntity = aggregation_rule.condition.expression[0]
-            properties_list = [entity.properties for entity_key, entity in self._entities.items()
-                               if entity_key in aggregation_entity.entity_keys]
-            if aggregation_entity.function is not None:
-                value = aggregation_entity.function.apply(properties_list)
-                self._trigger(aggregation_entity.generate_event(value))
+    def _evaluate_aggregation(self, aggregation_entity: AggregationEntity):
+        """
+        Feed the running state of an aggregation with all its stored members, and evaluate it.
+        :param aggregation_entity: The aggregation to evaluate.
+        """
+        if aggregation_entity.function is not None:
+            for entity_key in aggregation_entity.entity_keys:
+                entity: Entity = self._entities.get(entity_key)
+                if entity is not None:
+                    aggregation_entity.function.update(entity_key, entity.properties)
+            self._trigger_aggregation_event(aggregation_entity)
 
     def start(self) -> KnowledgeEngine:
         """
         Start the rule engine, dynamically building defined rules.
         """
         self._engine: KnowledgeEngine = self._build_knowledge_engine()
-        self._engine.strategy = _RuleEngineStrategy()
+        self._working_memory = _WorkingMemory(self._engine)
+        self._engine.strategy = _RuleEngineStrategy(metrics=self._metrics)
         self._engine.reset()
 
     def restart(self):
         """
         Restart the rule engine. This causes all the current entities state to be re-triggered.
+        Adding, updating and removing rules does not require a restart, since the running engine is hot-patched.
         """
         events = self._entities
         self._entities = dict()
         self.start()
-        self._trigger(*tuple(events.values()))
+        for entity in events.values():
+            self._trigger(entity)
+
+    def snapshot(self, path: str):
+        """
+        Save the state of the rule engine to a binary snapshot file: the entities states, the running state of the
+        aggregations and the execution state of the actions (e.g. whether a single time action already fired).
+        :param path: Path of the snapshot file.
+        """
+        entities = [(entity.class_name, key, entity.state) for key, entity in self._entities.items()]
+        aggregations, actions = dict(), dict()
+        for rule_id, rule in self._rules.items():
+            if rule.condition.is_aggregation:
+                aggregation_entity: AggregationEntity = rule.condition.expression[0]
+                if aggregation_entity.function is not None:
+                    aggregations[aggregation_entity.key] = aggregation_entity.function.state
+            action_state = rule.action.state
+            if action_state is not None:
+                actions[rule_id] = action_state
+        write_snapshot(path, dict(entities=entities, aggregations=aggregations, actions=actions))
+        self._snapshot_time = time.monotonic()
+
+    def restore(self, path: str):
+        """
+        Restart the rule engine from a snapshot file, loading its entities states in bulk. The rules must be added
+        before restoring: the state of the aggregations is restored on the rules matching the saved ones, and the
+        state of the actions on the rules with the same id (i.e. rules added in the same order), while the other
+        rules are evaluated on the restored entities as if they were just added.
+        Entities of unregistered classes are ignored.
+        :param path: Path of the snapshot file.
+        """
+        state = read_snapshot(path)
+        type_entities = {**self.type_entities, AggregationEntity.class_name: AggregationEntity}
+        entities = list()
+        for class_name, entity_key, entity_state in state['entities']:
+            entity_class = type_entities.get(class_name)
+            if entity_class is not None:
+                entities.append(entity_class.from_state(entity_key, entity_state))
+        self.start()
+        self._entities = {entity.key: entity for entity in entities}
+        # Entities are declared at once, skipping the validation, and only those reaching some rule are fed
+        # to the network
+        self._working_memory.load(entities)
+        self._update_agenda()
+        now = time.monotonic()
+        for policy in self._retention.values():
+            policy.clear()
+        for entity in entities:
+            policy = self._retention.get(entity.class_name)
+            if policy is not None:
+                policy.touch(entity.key, now)
+        restored_aggregations = set()
+        for rule_id, rule in self._rules.items():
+            if rule.condition.is_aggregation:
+                aggregation_entity: AggregationEntity = rule.condition.expression[0]
+                aggregation_state = state['aggregations'].get(aggregation_entity.key)
+                if aggregation_entity.function is not None and aggregation_state is not None:
+                    if aggregation_entity.key in restored_aggregations:
+                        aggregation_state = copy.deepcopy(aggregation_state)
+                    aggregation_entity.function.restore(aggregation_state)
+                    restored_aggregations.add(aggregation_entity.key)
+                elif any(entity_key in self._entities for entity_key in aggregation_entity.entity_keys):
+                    self._evaluate_aggregation(aggregation_entity)
+            action_state = state['actions'].get(rule_id)
+            if action_state is not None:
+                rule.action.restore(action_state)
+        self._pending_evaluation = True
+        self._evaluate()
+        self._strategy.reset()
+
+    def schedule_snapshots(self, path: str, interval: float):
+        """
+        Periodically save the state of the rule engine: once the interval is elapsed from the last snapshot,
+        a new one is saved after the evaluation of the next triggered event.
+        :param path: Path of the snapshot file.
+        :param interval: Minimum interval between two snapshots, in seconds. If None, periodic snapshots stop.
+        """
+        self._snapshot_path = path
+        self._snapshot_interval = interval
+        self._snapshot_time = time.monotonic()
+
+    def enable_clock(self, resolution: typing.Optional[float] = 60):
+        """
+        Let the engine advance the 'utc' entity by itself: before evaluating a triggered event, the clock ticks if
+        a new period of the given resolution has started. Call tick() to advance it while no event is triggered
+        (AsyncRebeca does it on its own). Comparisons on the time properties are indexed by interval, so a tick only
+        reaches the network when some comparison on the changed properties flips: it is then propagated to all the
+        rules testing the 'utc' entity, not only to the ones whose comparisons flip.
+        :param resolution: Resolution of the clock, in seconds. If None, the clock is disabled.
+        """
+        self._clock_resolution = resolution
+        self._clock_tick = None
+
+    @property
+    def clock_resolution(self) -> typing.Optional[float]:
+        return self._clock_resolution
+
+    def tick(self, now: datetime.datetime = None):
+        """
+        Trigger the 'utc' entity with the current UTC time, truncated to the resolution of the clock.
+        :param now: The current time, now by default.
+        """
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        if self._clock_resolution is not None:
+            self._clock_tick = now.timestamp() // self._clock_resolution
+        data = dict(year=now.year, month=now.month, day=now.day, weekday=now.weekday(),
+                    hours=now.hour, minutes=now.minute)
+        if self._clock_resolution is not None and self._clock_resolution < 60:
+            data['seconds'] = now.second
+        self.trigger(UTC.class_name, data)
+        if self._batch is None:
+            self.expire_windows()
+
+    def _advance_clock(self):
+        if self._clock_resolution is not None and self._batch is None and \
+                time.time() // self._clock_resolution != self._clock_tick:
+            self.tick()
+
+    def _snapshot_if_due(self):
+        if self._snapshot_interval is not None and \
+                time.monotonic() - self._snapshot_time >= self._snapshot_interval:
+            self.snapshot(self._snapshot_path)
+
+    def evict(self, now: float = None) -> int:
+        """
+        Retract the entities which expired or exceed the retention policy of their class, least recently updated
+        first. The matches of their rules exit, firing the '$exit' actions, and they leave the aggregations they are
+        member of. Evictions are checked after each triggered event (and clock tick): call it to check them while no
+        event is triggered.
+        :param now: The current time, as returned by time.monotonic(), now by default.
+        :return: The number of evicted entities.
+        """
+        if self._engine is None:
+            raise Exception("Must start the rule engine before evicting entities")
+        now = time.monotonic() if now is None else now
+        evicted = list()
+        for class_name, policy in self._retention.items():
+            for entity_key, reason in policy.expired(now):
+                entity: Entity = self._entities.get(entity_key)
+                if entity is not None:
+                    evicted.append(entity)
+                    if self._metrics is not None:
+                        self._metrics.increment('entities_evicted_total', (('class', class_name), ('reason', reason)))
+        return len(self._retract_entities(evicted))
+
+    def _retract_entities(self, entities: typing.List[Entity]) -> typing.List[Entity]:
+        """
+        Retract stored entities at once, as if they were never triggered: the matches of their rules exit and they
+        leave the aggregations they are member of.
+        :param entities: The entities to retract, identified by their key.
+        :return: The retracted entities, i.e. the stored ones.
+        """
+        retracted = [entity for entity in (self._entities.pop(entity.key, None) for entity in entities)
+                     if entity is not None]
+        if retracted:
+            # The retractions are seen by the agenda as a single update
+            with self._working_memory.deferred_agenda():
+                for entity in retracted:
+                    self._engine.retract(entity)
+            self._update_agenda()
+            self._trigger_aggregation(*retracted)
+            self._pending_evaluation = True
+            self._evaluate()
+            self._strategy.reset()
+        return retracted
+
+    def _evict_if_due(self):
+        if self._retention:
+            self.evict()
+
+    def expire_windows(self) -> int:
+        """
+        Evaluate again the aggregations over a time window whose value changed since their last evaluation, as their
+        samples expired while their members were not updated: e.g. a count of errors in the last 5 minutes drops
+        below its threshold once the devices go quiet, firing the '$exit' actions. Windows are checked on each clock
+        tick (see enable_clock), so they expire with the resolution of the clock: call it to check them otherwise.
+        :return: The number of aggregations evaluated again.
+        """
+        if self._engine is None:
+            raise Exception("Must start the rule engine before expiring windows")
+        expired = 0
+        for aggregation_entity in self._windowed_aggregations.values():
+            stored_entity: Entity = self._entities.get(aggregation_entity.key)
+            stored_value = stored_entity.get('result') if stored_entity is not None else None
+            if aggregation_entity.function.value != stored_value:
+                self._trigger_aggregation_event(aggregation_entity)
+                expired += 1
+        if expired:
+            self._pending_evaluation = True
+            self._evaluate()
+            self._strategy.reset()
+        return expired
 
     def _evaluate(self):
         """
@@ -245,19 +799,176 @@ class Rebeca:
         """
         if self._engine is None:
             raise Exception("Must generate the rule engine before evaluating")
-        self._engine.run()
+        if self._pending_evaluation or self._engine.agenda.activations:
+            self._engine.run()
+        self._pending_evaluation = False
 
     def trigger(self, entity_name: str, entity_data: dict):
         """
         Trigger an Entity state update and evaluate the rules.
+        Inside a batch block, the update is buffered until the end of the block.
+        """
+        self._advance_clock()
+        if self._batch is not None:
+            self._batch.append((entity_name, entity_data))
+            return
+        if self._event_log is not None:
+            self._event_log.append(entity_name, entity_data)
+        self._trigger_event(entity_name, entity_data)
+
+    def _trigger_event(self, entity_name: str, entity_data: dict):
+        """
+        Trigger a single Entity state update and evaluate the rules.
         """
         entity_class = self.type_entities.get(entity_name)
         if entity_class is not None:
+            if self._metrics is not None:
+                return self._trigger_event_measured(entity_class, entity_data)
             entity = entity_class(**entity_data)
             self._trigger(entity)
             self._trigger_aggregation(entity)
             self._evaluate()
             self._strategy.reset()
+            self._evict_if_due()
+            self._snapshot_if_due()
+
+    def _trigger_event_measured(self, entity_class: typing.Type[Entity], entity_data: dict):
+        """
+        Trigger a single Entity state update and evaluate the rules, measuring the latency of each phase.
+        """
+        metrics = self._metrics
+        metrics.increment('events_total')
+        start = metrics.clock()
+        entity = entity_class(**entity_data)
+        start = metrics.observe('phase_seconds', (('phase', 'entity'),), start)
+        self._trigger(entity)
+        start = metrics.observe('phase_seconds', (('phase', 'match'),), start)
+        self._trigger_aggregation(entity)
+        start = metrics.observe('phase_seconds', (('phase', 'aggregation'),), start)
+        self._evaluate()
+        metrics.observe('phase_seconds', (('phase', 'run'),), start)
+        self._strategy.reset()
+        self._evict_if_due()
+        self._snapshot_if_due()
+
+    def trigger_many(self, events: typing.Iterable[typing.Tuple[str, dict]], coalesce: bool = True):
+        """
+        Trigger a batch of Entity state updates.
+        If coalesced, the updates of the same entity are merged in its final state, the affected aggregations are
+        evaluated once and the rules are evaluated once for the whole batch: only the final state fires actions.
+        Otherwise, each update is evaluated in order as a single trigger, so intermediate states fire actions too.
+        :param events: Iterable of (entity_name, entity_data) tuples.
+        :param coalesce: Whether to fire actions only on the final state of the batch.
+        """
+        self._advance_clock()
+        if self._batch is not None:
+            self._batch.extend(events)
+            return
+        if self._event_log is not None:
+            events = list(events)
+            for entity_name, entity_data in events:
+                self._event_log.append(entity_name, entity_data)
+        if not coalesce:
+            for entity_name, entity_data in events:
+                self._trigger_event(entity_name, entity_data)
+            return
+        metrics = self._metrics
+        start = metrics.clock() if metrics is not None else None
+        states: typing.Dict[object, tuple] = dict()
+        events_count = 0
+        for entity_name, entity_data in events:
+            entity_class = self.type_entities.get(entity_name)
+            if entity_class is not None:
+                events_count += 1
+                entity = entity_class(**entity_data)
+                state = states.get(entity.key)
+                if state is not None:
+                    entity = entity_class(**{**state[1], **entity_data})
+                states[entity.key] = (entity, entity.as_dict())
+        entities = [entity for entity, _ in states.values()]
+        if metrics is not None:
+            # Events are counted as triggered, and the ones merged with another update of the batch as coalesced
+            metrics.increment('events_total', value=events_count)
+            metrics.increment('events_coalesced_total', value=events_count - len(entities))
+            start = metrics.observe('phase_seconds', (('phase', 'entity'),), start)
+        # Each entity is declared or modified once, so the network can be updated once for the whole batch
+        with self._working_memory.deferred_agenda():
+            for entity in entities:
+                self._trigger(entity)
+        self._update_agenda()
+        if metrics is not None:
+            start = metrics.observe('phase_seconds', (('phase', 'match'),), start)
+        self._trigger_aggregation(*entities)
+        if metrics is not None:
+            start = metrics.observe('phase_seconds', (('phase', 'aggregation'),), start)
+        self._evaluate()
+        if metrics is not None:
+            metrics.observe('phase_seconds', (('phase', 'run'),), start)
+        self._strategy.reset()
+        self._evict_if_due()
+        self._snapshot_if_due()
+
+    def replay(self, path: str, speed: float = None, batch_size: int = 1000, coalesce: bool = False,
+               execute: bool = False) -> typing.List[typing.Tuple[str, dict]]:
+        """
+        Replay the events of a log through the running engine, in batches, without recording them again.
+        Unless executed, the fired actions are captured instead of being executed.
+        :param path: Path of the directory of the log.
+        :param speed: Replay rate, as a multiple of the recorded one (e.g. 10 replays ten times faster than live).
+                      If None, events are replayed as fast as possible.
+        :param batch_size: Maximum number of events triggered in a single batch.
+        :param coalesce: Whether to fire actions only on the final state of each batch (see trigger_many).
+        :param execute: Whether to execute the fired actions.
+        :return: The captured (category, data) tuples of the fired actions, in firing order.
+        """
+        if self._engine is None:
+            raise Exception("Must start the rule engine before replaying events")
+        captured = list()
+        event_log, self._event_log = self._event_log, None
+        clock_resolution, self._clock_resolution = self._clock_resolution, None
+        self._replay_actions = None if execute else captured
+        try:
+            batch = list()
+            start_time, start_timestamp = time.monotonic(), None
+            for timestamp, entity_name, entity_data in read_events(path):
+                if speed is not None:
+                    if start_timestamp is None:
+                        start_timestamp = timestamp
+                    delay = start_time + (timestamp - start_timestamp) / speed - time.monotonic()
+                    if delay > 0:
+                        if batch:
+                            self.trigger_many(batch, coalesce)
+                            batch = list()
+                        time.sleep(delay)
+                batch.append((entity_name, entity_data))
+                if len(batch) >= batch_size:
+                    self.trigger_many(batch, coalesce)
+                    batch = list()
+            if batch:
+                self.trigger_many(batch, coalesce)
+        finally:
+            self._event_log = event_log
+            self._clock_resolution = clock_resolution
+            self._replay_actions = None
+        return captured
+
+    @contextmanager
+    def batch(self, coalesce: bool = True):
+        """
+        Context manager which buffers the triggered Entity state updates and evaluates them with trigger_many
+        at the end of the block. Nested blocks join the outermost one. Updates are discarded if the block raises.
+        :param coalesce: Whether to fire actions only on the final state of the batch.
+        """
+        if self._batch is not None:
+            yield self
+            return
+        self._batch = list()
+        try:
+            yield self
+            events = self._batch
+        finally:
+            self._batch = None
+        self.trigger_many(events, coalesce)
 
     def _default_execution_function(self, category, *args, **kwargs):
         """ Default execution function for an undefined action category. """
@@ -274,13 +985,57 @@ class Rebeca:
             return default_function(category=action_category, *args, **kwargs)
         return self._category_functions[action_category](self, *args, **kwargs)
 
+    def on_action(self, action: Action, data: dict):
+        """
+        Engine interface to execute an action fired by an Entity-state update on a matched rule, either directly
+        or through the action dispatcher.
+        :param action: The fired action.
+        :param data: The rendered data of the action.
+        """
+        if self._metrics is not None:
+            metrics = self._metrics
+            start = metrics.clock()
+            try:
+                return self._on_action(action, data)
+            finally:
+                elapsed = metrics.clock() - start
+                metrics.increment('actions_total', (('category', action.category),))
+                metrics.record('action_seconds', (('category', action.category),), elapsed)
+                metrics.record('rule_action_seconds', (('rule', action.rule_name),), elapsed)
+        return self._on_action(action, data)
+
+    def _on_action(self, action: Action, data: dict):
+        if self._replay_actions is not None:
+            self._replay_actions.append((action.category, data))
+            return
+        if self._action_dispatcher is None:
+            return self.on_execute(action.category, **data)
+        function = self._category_functions.get(action.category)
+        if function is not None and asyncio.iscoroutinefunction(function):
+            function = functools.partial(function, self)
+        else:
+            function = functools.partial(self.on_execute, action.category)
+        self._action_dispatcher.dispatch(action, function, data)
+
+    @property
+    def action_dispatcher(self) -> ActionDispatcher:
+        return self._action_dispatcher
+
+    @property
+    def event_log(self) -> EventLog:
+        return self._event_log
+
+    @property
+    def metrics(self) -> Metrics:
+        return self._metrics
+
     @property
     def is_running(self) -> bool:
         """ Check if the rule engine is running. """
         return self._engine is not None
 
     @property
-    def rules(self) -> dict:
+    def rules(self) -> RuleStore:
         """ Dictionary of rules defined in the engine. """
         return self._rules
 
@@ -316,7 +1071,9 @@ class Rebeca:
                 aggregation_entity = AggregationEntity.aggregate(
                     function_name=aggregation_function_name,
                     property_name=aggregation_property_name,
-                    entity_keys=entity_keys, result=result_comparisons)
+                    entity_keys=entity_keys, result=result_comparisons,
+                    window=aggregation_payload.get(self._aggregation_window_key))
+                aggregation_entity.comparisons = {'result': aggregation_property_payload}
                 expression_data = AND(aggregation_entity)
         else:
             expression_data = self._parse_expression_recursive(payload, family)
@@ -329,35 +1086,98 @@ class Rebeca:
             if k.startswith('$'):
                 family_member: ConditionFamilyMember = family.parse_add_member(k, self.type_entities)
                 if family_member is not None:
-                    return self._parse_entity(family_member.entity_class.class_name, v)
+                    entity = self._parse_entity(family_member.entity_class.class_name, v)
+                    entity['__bind__'] = family_member.slot
+                    return entity
                 conjunction_class = self._conjunctions_map.get(k)
                 if conjunction_class is None:
                     raise Exception(f"Conjunction '{k}' not valid.")
                 if not isinstance(v, list):
                     raise Exception(f"Conjunction '{k}' does not contain a list of expressions.")
                 conjunction_args = [self._parse_expression_recursive(vi, family) for vi in v]
-                return conjunction_class(*conjunction_args)
+                # Sort the members, so that identical conditions are built in the same order and share their joins
+                return conjunction_class(*sorted(conjunction_args, key=self._canonical_key))
             elif self._properties_key in v:
                 return self._parse_entity(k, v)
 
-    def _parse_comparisons(self, comparisons: typing.List[dict]) -> object:
-        comparison_args = list()
+    @staticmethod
+    def _canonical_comparisons(comparisons: typing.List[dict]) -> typing.List[tuple]:
+        """
+        Normalize the comparisons tested on a property into a sorted list of distinct (operator, operands) pairs,
+        so that the same test written in different ways (e.g. in a different order, or with a scalar operand
+        instead of a list) has the same canonical form.
+        :param comparisons: The comparisons, as in the rule payload.
+        :return: The canonical comparisons.
+        """
+        canonical = dict()
         for comparison in comparisons:
             for operator_key, values in comparison.items():
-                operator = self._comparison_operators_map.get(operator_key)
-                if operator is None:
-                    raise Exception(f"'{operator_key}' is not a valid operator.")
                 if not isinstance(values, list):
                     values = [values]
-                comparison_args.append(operator(*tuple(values)))
-        return AND(*tuple(comparison_args))
+                pair = (operator_key, tuple(values))
+                canonical[repr(pair)] = pair
+        return [canonical[k] for k in sorted(canonical)]
+
+    def _canonical_key(self, element) -> str:
+        """
+        :param element: A parsed condition expression (an entity pattern or a conjunction).
+        :return: A key identifying the canonical form of the expression.
+        """
+        if isinstance(element, Entity):
+            attributes = sorted((k, repr(v)) for k, v in element.items() if k not in element.comparisons)
+            comparisons = sorted((k, self._canonical_comparisons(v)) for k, v in element.comparisons.items())
+            return repr((element.class_name, attributes, comparisons))
+        return repr((element.__class__.__name__, sorted(self._canonical_key(arg) for arg in element)))
+
+    def _parse_predicate(self, operator_key: str, values: tuple) -> P:
+        """
+        Build the predicate of a comparison. Predicates are interned by their canonical form: since the network
+        identifies the alpha tests by their predicate, the rules testing the same comparison share its node.
+        :param operator_key: The comparison operator.
+        :param values: The operands of the comparison.
+        :return: The predicate.
+        """
+        operator = self._comparison_operators_map.get(operator_key)
+        if operator is None:
+            raise Exception(f"'{operator_key}' is not a valid operator.")
+        key = self._predicate_key(operator_key, values)
+        predicate = self._predicates.get(key)
+        if predicate is None:
+            predicate = self._predicates[key] = operator(*values)
+            self._predicate_definitions[id(predicate)] = (operator_key, tuple(values))
+            self._unreferenced_predicates.add(id(predicate))
+        return predicate
+
+    @staticmethod
+    def _predicate_key(operator_key: str, values: tuple) -> tuple:
+        return operator_key, tuple((type(v), freeze(v)) for v in values)
+
+    def _release_predicates(self):
+        """
+        Release the interned predicates which no stored rule references, i.e. the ones of the removed rules and
+        the ones parsed for rules which were never stored. Called after storing or removing rules, since the
+        predicates of the rules being parsed are not referenced until the rules are stored.
+        """
+        for predicate_id in self._unreferenced_predicates:
+            operator_key, values = self._predicate_definitions.pop(predicate_id)
+            del self._predicates[self._predicate_key(operator_key, values)]
+        self._unreferenced_predicates = set()
+
+    def _parse_comparisons(self, comparisons: typing.List[dict]) -> object:
+        predicates = [self._parse_predicate(operator_key, values)
+                      for operator_key, values in self._canonical_comparisons(comparisons)]
+        if len(predicates) == 1:
+            return predicates[0]
+        return ANDFC(*predicates)
 
     def _parse_entity(self, entity_class_name: str, entity_data: dict):
-        entity_properties = entity_data.pop(self._properties_key)
+        comparisons = entity_data[self._properties_key]
         entity_properties = {
-            name: self._parse_comparisons(comparisons)
-            for name, comparisons in entity_properties.items()
+            name: self._parse_comparisons(property_comparisons)
+            for name, property_comparisons in comparisons.items()
         }
         entity_class = self.type_entities.get(entity_class_name)
-        entity_payload = {**entity_data, **entity_properties}
-        return entity_class(**entity_payload)
+        entity_payload = {**{k: v for k, v in entity_data.items() if k != self._properties_key}, **entity_properties}
+        entity = entity_class(**entity_payload)
+        entity.comparisons = comparisons
+        return entity
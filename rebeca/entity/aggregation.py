@@ -0,0 +1,344 @@
+import functools
+import heapq
+import math
+import re
+import time
+import typing
+from collections import Counter, deque
+
+
+class AggregationState:
+    """
+    Running state of an aggregation function, updated by delta each time a member value is added or removed,
+    so that its value never requires a scan of the members.
+    """
+
+    def __init__(self):
+        self._count: int = 0
+
+    def add(self, value):
+        self._count += 1
+
+    def remove(self, value):
+        self._count -= 1
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def value(self) -> object:
+        raise NotImplementedError
+
+
+class SumState(AggregationState):
+
+    def __init__(self):
+        super().__init__()
+        self._total = 0
+
+    def add(self, value):
+        super().add(value)
+        self._total += value
+
+    def remove(self, value):
+        super().remove(value)
+        self._total -= value
+
+    @property
+    def value(self) -> object:
+        return self._total
+
+
+class CountState(AggregationState):
+
+    @property
+    def value(self) -> object:
+        return self._count
+
+
+class NotState(AggregationState):
+
+    @property
+    def value(self) -> object:
+        return self._count == 0
+
+
+class AvgState(SumState):
+
+    @property
+    def value(self) -> object:
+        return self._total / self._count if self._count else None
+
+
+class StdDevState(AggregationState):
+    """ Population standard deviation of the members, from the running sums of the values and of their squares. """
+
+    def __init__(self):
+        super().__init__()
+        self._total = 0
+        self._squares = 0
+
+    def add(self, value):
+        super().add(value)
+        self._total += value
+        self._squares += value * value
+
+    def remove(self, value):
+        super().remove(value)
+        self._total -= value
+        self._squares -= value * value
+
+    @property
+    def value(self) -> object:
+        if not self._count:
+            return None
+        mean = self._total / self._count
+        return math.sqrt(max(self._squares / self._count - mean * mean, 0))
+
+
+class AnyState(AggregationState):
+
+    def __init__(self):
+        super().__init__()
+        self._truthy: int = 0
+
+    def add(self, value):
+        super().add(value)
+        self._truthy += bool(value)
+
+    def remove(self, value):
+        super().remove(value)
+        self._truthy -= bool(value)
+
+    @property
+    def value(self) -> object:
+        return self._truthy > 0
+
+
+class AllState(AnyState):
+
+    @property
+    def value(self) -> object:
+        return self._truthy == self._count
+
+
+class _Reversed:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __hash__(self):
+        return hash(self.value)
+
+
+class MinState(AggregationState):
+    """ Minimum of the members, kept in a heap with lazy deletion of the removed values. """
+
+    _wrap: typing.Callable = staticmethod(lambda value: value)
+
+    def __init__(self):
+        super().__init__()
+        self._heap: list = list()
+        self._counter: Counter = Counter()
+
+    def add(self, value):
+        super().add(value)
+        item = self._wrap(value)
+        self._counter[item] += 1
+        heapq.heappush(self._heap, item)
+
+    def remove(self, value):
+        super().remove(value)
+        item = self._wrap(value)
+        self._counter[item] -= 1
+        if not self._counter[item]:
+            del self._counter[item]
+        if len(self._heap) > 2 * self._count + 16:
+            self._heap = list(self._counter.elements())
+            heapq.heapify(self._heap)
+
+    @property
+    def value(self) -> object:
+        while self._heap and self._heap[0] not in self._counter:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        top = self._heap[0]
+        return top.value if isinstance(top, _Reversed) else top
+
+
+class MaxState(MinState):
+
+    _wrap: typing.Callable = _Reversed
+
+
+class PercentileState(AggregationState):
+    """
+    Percentile of the members (linearly interpolated), from two heaps: a max-heap of the values up to the rank of
+    the percentile and a min-heap of the values above it, rebalanced on each update, so that adding or removing a
+    member costs O(log n) instead of the O(n) insertion in a sorted list.
+    """
+
+    def __init__(self, percentile: float):
+        super().__init__()
+        self._percentile: float = percentile
+        self._lower: AggregationState = MaxState()
+        self._upper: AggregationState = MinState()
+
+    def _position(self) -> float:
+        return (self._count - 1) * self._percentile / 100
+
+    def _rebalance(self):
+        size = math.floor(self._position()) + 1 if self._count else 0
+        while self._lower.count > size:
+            value = self._lower.value
+            self._lower.remove(value)
+            self._upper.add(value)
+        while self._lower.count < size:
+            value = self._upper.value
+            self._upper.remove(value)
+            self._lower.add(value)
+
+    def add(self, value):
+        super().add(value)
+        if self._lower.count and value <= self._lower.value:
+            self._lower.add(value)
+        else:
+            self._upper.add(value)
+        self._rebalance()
+
+    def remove(self, value):
+        super().remove(value)
+        # Values equal to the top of the lower heap may sit in either heap, and removing any of them is the same
+        if self._lower.count and value <= self._lower.value:
+            self._lower.remove(value)
+        else:
+            self._upper.remove(value)
+        self._rebalance()
+
+    @property
+    def value(self) -> object:
+        if not self._count:
+            return None
+        position = self._position()
+        lower = self._lower.value
+        upper = self._upper.value if self._upper.count else lower
+        return lower + (upper - lower) * (position - math.floor(position))
+
+
+class WindowState(AggregationState):
+    """
+    Aggregation over the values added in a time window, kept in a bounded ring buffer of (timestamp, value, member)
+    samples. A sliding window keeps the samples of the last `size` seconds, a tumbling window the samples of the
+    current `size` seconds long interval. Expired samples, and the samples of the members leaving the aggregation,
+    are removed by delta from the wrapped state, so the
+    samples are a deque rather than NumPy arrays, which are only needed by the optional columnar matcher.
+    """
+
+    sliding = 'sliding'
+    tumbling = 'tumbling'
+
+    def __init__(self, state_factory: typing.Callable[[], AggregationState], size: float, kind: str = sliding,
+                 capacity: int = None, clock: typing.Callable[[], float] = time.time):
+        super().__init__()
+        if kind not in (self.sliding, self.tumbling):
+            raise Exception(f"'{kind}' is not a valid window type")
+        self._state_factory = state_factory
+        self._state: AggregationState = state_factory()
+        self._size: float = size
+        self._kind: str = kind
+        self._capacity: int = capacity
+        self._clock = clock
+        self._samples: deque = deque()
+        self._interval: int = None
+
+    def _expire(self, now: float):
+        if self._kind == self.tumbling:
+            interval = int(now // self._size)
+            if interval != self._interval:
+                self._interval = interval
+                self._samples.clear()
+                self._state = self._state_factory()
+                self._count = 0
+            return
+        while self._samples and self._samples[0][0] <= now - self._size:
+            super().remove(None)
+            self._state.remove(self._samples.popleft()[1])
+
+    def add(self, value, member=None):
+        """
+        Add a sample to the window.
+        :param value: The value of the sample.
+        :param member: The key of the member which the value belongs to.
+        """
+        now = self._clock()
+        self._expire(now)
+        if self._capacity is not None and len(self._samples) >= self._capacity:
+            super().remove(None)
+            self._state.remove(self._samples.popleft()[1])
+        super().add(value)
+        self._samples.append((now, value, member))
+        self._state.add(value)
+
+    def remove(self, value):
+        """ A new value of a member is a new sample, which does not replace the previous ones. """
+        pass
+
+    def discard(self, member):
+        """
+        Remove the samples of a member leaving the aggregation (e.g. an evicted entity), without waiting for them to
+        expire.
+        :param member: The key of the member.
+        """
+        samples = deque()
+        for sample in self._samples:
+            if sample[2] == member:
+                super().remove(None)
+                self._state.remove(sample[1])
+            else:
+                samples.append(sample)
+        self._samples = samples
+
+    @property
+    def value(self) -> object:
+        self._expire(self._clock())
+        return self._state.value
+
+
+_aggregation_states_map = {
+    'sum': SumState,
+    'count': CountState,
+    'avg': AvgState,
+    'min': MinState,
+    'max': MaxState,
+    'stddev': StdDevState,
+    'any': AnyState,
+    'all': AllState,
+    'not': NotState
+}
+
+_percentile_pattern = re.compile(r'^p(\d+(\.\d+)?)$')
+
+
+def get_state_factory(name: str) -> typing.Optional[typing.Callable[[], AggregationState]]:
+    """
+    Get the factory of the running state of an aggregation function by its name. Besides the names in the
+    aggregation states map, percentiles are named by 'p' followed by the percentile (e.g. 'p50', 'p99.9').
+    :param name: Name of the aggregation function.
+    :return: The factory of the state, or None if the name is not valid.
+    """
+    state_class = _aggregation_states_map.get(name)
+    if state_class is not None:
+        return state_class
+    match = _percentile_pattern.match(name or '')
+    if match is not None and float(match.group(1)) <= 100:
+        return functools.partial(PercentileState, float(match.group(1)))
+    return None
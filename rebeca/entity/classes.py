@@ -1,5 +1,10 @@
+import functools
+import typing
+
 from experta import Fact
+from experta.utils import unfreeze
 
+from .aggregation import AggregationState, WindowState, get_state_factory
 from .utils import get_id_from_dict, get_id_from_list
 
 
@@ -13,12 +18,53 @@ _aggregation_callables_map = {
 }
 
 
+_scalar_types = frozenset((str, int, float, bool, type(None)))
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _key_digest(class_name: str, attributes: tuple) -> str:
+    """
+    Digest of the key of an entity, cached for the most recently triggered entities.
+    :param class_name: Name of the class of the entity.
+    :param attributes: The (name, type, value) of the key attributes, whose values are scalars. The type tells
+                       apart the values which are equal but render differently (e.g. 1, 1.0 and True).
+    :return: The SHA-1 digest of the key.
+    """
+    return get_id_from_dict({k: v for k, _, v in attributes}, class_name)
+
+
 class Entity(Fact):
+    """
+    Entity-state, identified by its class and the values of its key attributes.
+    The split between key attributes and properties is computed once per entity class.
+    The key of the entity is computed once and cached: by default it is a SHA-1 digest of the class name and of the
+    key attributes, stable across processes (e.g. for the members of the aggregations of cached rules), while with
+    fast_keys enabled (see Rebeca.register_entity_class) it is the plain tuple of the class name and of the
+    values of the key attributes, which is cheaper to build and to hash. Since each trigger builds a new
+    Entity-state, the digests of the scalar key attributes are also cached by class and by values (see _key_digest),
+    so that the states of a known entity are not hashed again.
+    Broadcast entities are global entities, such as a clock, which the conditions of any rule may join with:
+    a sharded engine sends their events to every shard.
+    As a pattern of a rule condition, an entity also keeps the comparisons tested on each property.
+    """
 
     class_name = 'entity'
-    meta_keys = []
-    attribute_keys = []
+    meta_keys = ()
+    attribute_keys = ()
     type_class = None
+    fast_keys = False
+    broadcast = False
+    comparisons: typing.Dict[str, typing.List[dict]] = {}
+
+    _attribute_set = frozenset()
+    _identity_keys = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.meta_keys = tuple(cls.meta_keys)
+        cls.attribute_keys = tuple(cls.attribute_keys)
+        cls._attribute_set = frozenset(cls.attribute_keys)
+        cls._identity_keys = tuple(k for k in cls.attribute_keys if k not in cls.meta_keys)
 
     def __str__(self):
         attr = ",".join([f"{k}={v}" for k, v in self.attributes.items()])
@@ -27,15 +73,59 @@ class Entity(Fact):
 
     @property
     def properties(self) -> dict:
-        return {k: v for k, v in self.as_dict().items() if k not in self.attribute_keys}
+        return {k: unfreeze(v) for k, v in self.items() if k not in self._attribute_set and not self.is_special(k)}
 
     @property
     def attributes(self):
-        return {k: v for k, v in self.as_dict().items() if k in self.attribute_keys and k not in self.meta_keys}
+        return {k: unfreeze(self[k]) for k in self._identity_keys if k in self}
+
+    @property
+    def property_keys(self) -> typing.Set[str]:
+        """ Names of the properties of the entity (for a pattern of a rule condition, the tested ones). """
+        return {k for k in self.keys() if k not in self._attribute_set and not self.is_special(k)}
+
+    def diff(self, other: 'Entity') -> dict:
+        """
+        Compare the properties of this Entity-state with another state of the same entity.
+        :param other: The other state of the entity.
+        :return: The properties (with their values in this state) which are missing or different in the other one.
+        """
+        return {k: v for k, v in self.items()
+                if k not in self._attribute_set and not self.is_special(k) and (k not in other or other[k] != v)}
 
     @property
     def key(self):
-        return get_id_from_dict(self.attributes, str(hash(self.__class__.__name__)))
+        try:
+            return self._key
+        except AttributeError:
+            if self.fast_keys:
+                self._key = (self.class_name, *(self.get(k) for k in self._identity_keys))
+            else:
+                attributes = tuple((k, type(self[k]), self[k]) for k in self._identity_keys if k in self)
+                if all(value_type in _scalar_types for _, value_type, _ in attributes):
+                    self._key = _key_digest(self.__class__.__name__, attributes)
+                else:
+                    self._key = get_id_from_dict(self.attributes, self.__class__.__name__)
+            return self._key
+
+    @property
+    def state(self) -> dict:
+        """ Attributes and properties of the Entity-state, with their frozen values, as saved in a snapshot. """
+        return {k: v for k, v in self.items() if not self.is_special(k)}
+
+    @classmethod
+    def from_state(cls, key, state: dict) -> 'Entity':
+        """
+        Rebuild an Entity-state saved in a snapshot, skipping the freezing of its values and the computation of its key.
+        :param key: The key of the entity.
+        :param state: The state of the entity, as returned by the state property.
+        :return: The Entity-state.
+        """
+        entity = cls.__new__(cls)
+        dict.update(entity, state)
+        entity._Fact__defaults = dict()
+        entity._key = key
+        return entity
 
     def refresh(self, properties):
         fact_id = self.__factid__
@@ -46,57 +136,136 @@ class Entity(Fact):
 
 class AggregationFunction:
 
-    def __init__(self, name, property, filter_name=None, **kwargs):
-        self._callable = _aggregation_callables_map.get(name)
-        if self._callable is None:
+    def __init__(self, name, property, filter_name=None, window: dict = None, **kwargs):
+        """
+        :param name: Name of the aggregation function (e.g. 'sum', 'avg', 'p95').
+        :param property: Name of the aggregated property.
+        :param filter_name: Name of the function to apply to each value before aggregating it.
+        :param window: If given, the function aggregates the values updated in a time window instead of the
+                       current values of the members. It defines the 'size' of the window in seconds, its 'type'
+                       ('sliding' or 'tumbling') and optionally the maximum number of samples ('capacity').
+        """
+        state_factory = get_state_factory(name)
+        if state_factory is None:
             raise Exception(f"'{name}' is not a valid function name")
+        if window is not None:
+            self._state_class = functools.partial(WindowState, state_factory, size=window['size'],
+                                                  kind=window.get('type', WindowState.sliding),
+                                                  capacity=window.get('capacity'))
+        else:
+            self._state_class = state_factory
         self._filter = _aggregation_callables_map.get(filter_name)
         self._property: str = property
+        self._state: AggregationState = self._state_class()
+        self._values: dict = dict()
 
     def _apply_filter(self, value):
         return value if self._filter is None else self._filter(value)
 
     def apply(self, properties: list) -> object:
-        values = []
+        state = self._state_class()
         for property_data in properties:
             value = property_data.get(self._property)
             if value is not None:
-                values.append(self._apply_filter(value))
-        return self._callable(values)
+                state.add(self._apply_filter(value))
+        return state.value
+
+    def update(self, entity_key, properties: dict) -> object:
+        """
+        Update the running state of the aggregation with the current properties of one of its members.
+        On a time window, the value is added as a new sample instead of replacing the previous value of the member,
+        while a member without the property (e.g. an evicted entity) leaves the window with all its samples.
+        :param entity_key: Key of the member entity.
+        :param properties: Properties of the member entity.
+        :return: The aggregated value.
+        """
+        value = properties.get(self._property)
+        previous = self._values.pop(entity_key, None)
+        if value is not None:
+            value = self._apply_filter(value)
+            self._values[entity_key] = value
+        if self.windowed:
+            # A member leaving the aggregation takes its samples away
+            if value is not None:
+                self._state.add(value, entity_key)
+            elif previous is not None:
+                self._state.discard(entity_key)
+            return self._state.value
+        if previous is not None:
+            self._state.remove(previous)
+        if value is not None:
+            self._state.add(value)
+        return self._state.value
+
+    @property
+    def value(self) -> object:
+        return self._state.value
+
+    @property
+    def windowed(self) -> bool:
+        """ Whether the function aggregates the values of a time window, which change as time passes. """
+        return isinstance(self._state, WindowState)
+
+    @property
+    def state(self) -> tuple:
+        """ Running state of the aggregation and current values of its members, as saved in a snapshot. """
+        return self._state, self._values
+
+    def restore(self, state: tuple):
+        """
+        Restore the running state of the aggregation from a snapshot.
+        :param state: The state, as returned by the state property.
+        """
+        self._state, self._values = state
 
 
 class AggregationEntity(Entity):
+    """
+    Entity representing the aggregated value of a set of member entities. The member keys are kept out of the
+    fact itself, so that neither the aggregation events nor their matching depend on the number of members.
+    """
 
-    meta_keys = ['entity_keys']
-    attribute_keys = ['key', 'entity_keys']
+    class_name = 'aggregation'
+    attribute_keys = ['key']
 
-    def __init__(self, function_name=None, property_name=None, *args, **kwargs):
+    def __init__(self, function_name=None, property_name=None, entity_keys=None, window=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._entity_keys: tuple = tuple(entity_keys or ())
         self._function = None
         if function_name is not None and property_name is not None:
-            self._function = AggregationFunction(function_name, property_name)
+            self._function = AggregationFunction(function_name, property_name, window=window)
 
     @property
     def function(self) -> AggregationFunction:
         return self._function
 
     @classmethod
-    def aggregate(cls, entity_keys: list, result, function_name: str=None, property_name: str=None):
+    def aggregate(cls, entity_keys: list, result, function_name: str=None, property_name: str=None,
+                  window: dict=None):
+        window_salt = ":".join(f"{k}={v}" for k, v in sorted(window.items())) if window else ""
         return cls(
             entity_keys=entity_keys,
-            key=get_id_from_list(entity_keys, cls.__name__),
+            key=get_id_from_list(entity_keys, f"{cls.__name__}:{function_name}:{property_name}:{window_salt}"),
             result=result,
             function_name=function_name,
-            property_name=property_name
+            property_name=property_name,
+            window=window
         )
 
+    @classmethod
+    def from_state(cls, key, state: dict) -> 'AggregationEntity':
+        entity = super().from_state(key, state)
+        entity._entity_keys = tuple()
+        entity._function = None
+        return entity
+
     @property
-    def entity_keys(self) -> list:
-        return self.as_dict()['entity_keys']
+    def entity_keys(self) -> tuple:
+        return self._entity_keys
 
     @property
     def key(self):
-        return self.as_dict().get('key')
+        return self.get('key')
 
     def generate_event(self, value):
-        return self.aggregate(self.entity_keys, value)
+        return self.__class__(key=self.key, result=value)
@@ -2,4 +2,6 @@ from .classes import Entity
 
 
 class UTC(Entity):
-    pass
+
+    class_name = 'utc'
+    broadcast = True
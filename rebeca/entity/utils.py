@@ -7,5 +7,5 @@ def get_id_from_dict(d: dict, salt: str):
 
 
 def get_id_from_list(l: list, salt: str):
-    unique_str = f'{salt}:' + '-'.join([f"{v}" for v in sorted(l)])
+    unique_str = f'{salt}:' + '-'.join(sorted(f"{v}" for v in l))
     return hashlib.sha1(unique_str.encode('utf-8')).hexdigest()
@@ -0,0 +1,107 @@
+import mmap
+import os
+import pickle
+import struct
+import time
+import typing
+
+_length = struct.Struct('<I')
+_segment_suffix = '.log'
+
+
+def _segment_paths(path: str) -> typing.List[str]:
+    names = sorted(name for name in os.listdir(path) if name.endswith(_segment_suffix))
+    return [os.path.join(path, name) for name in names]
+
+
+class EventLog:
+    """
+    Segmented append-only log of the triggered events, stored in a directory.
+    Each segment is a memory-mapped file of a fixed size, filled with length-prefixed records of
+    (timestamp, entity_name, entity_data); when a record does not fit, a new segment is started.
+    The unused tail of a segment is zero-filled, so the log of a crashed process stays readable up to its
+    last complete record. Opening an existing log appends new segments after the existing ones.
+
+        rebeca = Rebeca(event_log=EventLog('events'))
+    """
+
+    def __init__(self, path: str, segment_size: int = 64 * 1024 * 1024):
+        """
+        :param path: Path of the directory of the log, created if missing.
+        :param segment_size: Size of each segment, in bytes.
+        """
+        os.makedirs(path, exist_ok=True)
+        self._path: str = path
+        self._segment_size: int = segment_size
+        segments = _segment_paths(path)
+        self._segment_index: int = int(os.path.basename(segments[-1])[:-len(_segment_suffix)]) if segments else 0
+        self._file: typing.BinaryIO = None
+        self._map: mmap.mmap = None
+        self._offset: int = 0
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def _open_segment(self, size: int):
+        self._close_segment()
+        self._segment_index += 1
+        segment_path = os.path.join(self._path, f"{self._segment_index:08d}{_segment_suffix}")
+        self._file = open(segment_path, 'w+b')
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._offset = 0
+
+    def _close_segment(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._file.truncate(self._offset)
+            self._file.close()
+            self._map, self._file = None, None
+
+    def append(self, entity_name: str, entity_data: dict, timestamp: float = None):
+        """
+        Append a triggered event to the log.
+        :param entity_name: Name of the entity class.
+        :param entity_data: Data of the entity.
+        :param timestamp: Time of the event, now by default.
+        """
+        record = pickle.dumps((time.time() if timestamp is None else timestamp, entity_name, entity_data),
+                              protocol=pickle.HIGHEST_PROTOCOL)
+        size = _length.size + len(record)
+        if self._map is None or self._offset + size > len(self._map):
+            self._open_segment(max(self._segment_size, size))
+        _length.pack_into(self._map, self._offset, len(record))
+        self._map[self._offset + _length.size:self._offset + size] = record
+        self._offset += size
+
+    def flush(self):
+        """ Flush the current segment to disk. """
+        if self._map is not None:
+            self._map.flush()
+
+    def close(self):
+        """ Close the log, truncating the current segment to its records. """
+        self._close_segment()
+
+
+def read_events(path: str) -> typing.Iterator[typing.Tuple[float, str, dict]]:
+    """
+    Read the events of a log, in order, memory-mapping a segment at a time.
+    :param path: Path of the directory of the log.
+    :return: Iterator of (timestamp, entity_name, entity_data) tuples.
+    """
+    for segment_path in _segment_paths(path):
+        with open(segment_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                continue
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as segment:
+                offset, end = 0, len(segment)
+                while offset + _length.size <= end:
+                    length, = _length.unpack_from(segment, offset)
+                    offset += _length.size
+                    if length == 0 or offset + length > end:
+                        break
+                    yield pickle.loads(segment[offset:offset + length])
+                    offset += length
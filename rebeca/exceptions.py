@@ -23,6 +23,14 @@ class RuleParsingError(RuleEngineError):
         super().__init__(f"Error while parsing rule '{rule_name}': {reason}")
 
 
+class RuleLoadingError(RuleEngineError):
+
+    def __init__(self, path, errors):
+        self.errors = errors
+        details = "\n".join(f"  {position}: {message}" for position, message in errors)
+        super().__init__(f"{len(errors)} error(s) while loading rules from '{path}':\n{details}")
+
+
 # Actions
 
 class ActionClassNotSupportedError(RuleEngineError):
@@ -35,3 +43,11 @@ class ActionCategoryNotSupportedError(RuleEngineError):
 
     def __init__(self, category):
         super().__init__(f"Action category '{category}' not supported.")
+
+
+# Snapshots
+
+class SnapshotError(RuleEngineError):
+
+    def __init__(self, path, reason):
+        super().__init__(f"Error while reading snapshot '{path}': {reason}")
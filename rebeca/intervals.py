@@ -0,0 +1,68 @@
+import bisect
+import numbers
+import typing
+from collections import Counter
+
+_ordering_operators = frozenset({'>', '>=', '<', '<=', '=', '!=', 'between'})
+_equality_operators = frozenset({'=', '!='})
+
+
+class PropertyIntervals:
+    """
+    Index of the comparisons which the rules test on a property of an entity class.
+    The numeric operands of the ordering comparisons split the values of the property into intervals, where every
+    comparison has the same outcome: the signature of a value identifies its interval (and whether it lies on a
+    boundary) and the non-numeric literals it equals. If two values have the same signature, no comparison on the
+    property flips between them. Values tested by other operators (e.g. 'regex') are never considered equivalent.
+    """
+
+    def __init__(self):
+        self._boundaries: Counter = Counter()
+        self._literals: Counter = Counter()
+        self._opaque: int = 0
+        self._sorted_boundaries: typing.Optional[list] = None
+
+    @staticmethod
+    def _is_number(value) -> bool:
+        return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+    def add(self, operator_key: str, values: list, increment: int = 1):
+        """
+        Add a comparison to the index.
+        :param operator_key: The comparison operator (e.g. '>=').
+        :param values: The operands of the comparison.
+        :param increment: 1 to add the comparison, -1 to remove it.
+        """
+        if operator_key in _ordering_operators and all(self._is_number(v) for v in values):
+            counter = self._boundaries
+            self._sorted_boundaries = None
+        elif operator_key in _equality_operators:
+            counter = self._literals
+        else:
+            self._opaque += increment
+            return
+        for value in values:
+            counter[value] += increment
+            if counter[value] <= 0:
+                del counter[value]
+
+    def __bool__(self):
+        return bool(self._boundaries or self._literals or self._opaque)
+
+    def signature(self, value) -> tuple:
+        """
+        :param value: A value of the property.
+        :return: The signature of the value.
+        """
+        if self._opaque or (self._boundaries and not self._is_number(value)):
+            return value,
+        if self._sorted_boundaries is None:
+            self._sorted_boundaries = sorted(self._boundaries)
+        boundaries = self._sorted_boundaries
+        position = (bisect.bisect_left(boundaries, value), bisect.bisect_right(boundaries, value)) \
+            if boundaries else None
+        try:
+            literal = value if value in self._literals else None
+        except TypeError:
+            return value,
+        return position, literal
@@ -0,0 +1,325 @@
+import collections
+import itertools
+import json
+import multiprocessing
+import re
+import typing
+
+import yaml
+from yaml.events import DocumentEndEvent, SequenceEndEvent, SequenceStartEvent, StreamEndEvent
+
+from .actions import Action
+from .cache import dumps_rules, loads_rules, rule_cache_key, read_rule_cache, write_rule_cache
+from .schema import RuleSchema
+from .exceptions import RuleLoadingError
+
+# Item of a rules source: (line of the rule, decoding function or None if already decoded, data)
+_SourceItem = typing.Tuple[int, typing.Optional[typing.Callable], object]
+
+_yaml_item_pattern = re.compile(r'-(\s|$)')
+_yaml_header_pattern = re.compile(r'(#|---|%|\s*$)')
+_whitespace_pattern = re.compile(r'\s*')
+
+_worker_parser = None
+_worker_schema: RuleSchema = None
+
+
+class _SourceError(ValueError):
+    """ Error breaking the structure of a rules source, after which no rule can be read. """
+
+    def __init__(self, line: int, message: str):
+        super().__init__(message)
+        self.line: int = line
+
+
+def _load_yaml(text: str):
+    return yaml.load(text, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+def _load_yaml_item(text: str):
+    items = _load_yaml(text)
+    if not isinstance(items, list) or len(items) != 1:
+        raise ValueError("a single item of the list of rules is expected")
+    return items[0]
+
+
+def _read_jsonl(f: typing.TextIO) -> typing.Iterator[_SourceItem]:
+    """ Read a JSON Lines source: one rule per non-blank line. """
+    for line, text in enumerate(f, 1):
+        if text.strip():
+            # Without its line break, a truncated rule is reported on its own line rather than on the next one
+            yield line, json.loads, text.rstrip('\r\n')
+
+
+def _read_json(f: typing.TextIO, chunk_size: int = 1 << 20) -> typing.Iterator[_SourceItem]:
+    """ Read a JSON source holding a list of rules, decoding one rule at a time. """
+    decoder = json.JSONDecoder()
+    buffer, index, line, eof = '', 0, 1, False
+
+    def skip_whitespace():
+        nonlocal buffer, index, line, eof
+        while True:
+            end = _whitespace_pattern.match(buffer, index).end()
+            line += buffer.count('\n', index, end)
+            index = end
+            if index < len(buffer) or eof:
+                return
+            buffer, index = f.read(chunk_size), 0
+            eof = not buffer
+
+    def expect(token: str):
+        skip_whitespace()
+        if buffer[index:index + 1] != token:
+            raise _SourceError(line, f"expecting '{token}'")
+
+    expect('[')
+    index += 1
+    skip_whitespace()
+    if buffer[index:index + 1] == ']':
+        return
+    while True:
+        try:
+            payload, end = decoder.raw_decode(buffer, index)
+            complete = end < len(buffer) or eof
+        except json.JSONDecodeError as e:
+            if eof:
+                raise _SourceError(line + buffer.count('\n', index, e.pos), e.msg)
+            complete = False
+        if not complete:
+            # The rule is split across the chunks read so far: read one more chunk and decode it again
+            more = f.read(chunk_size)
+            buffer, index, eof = buffer[index:] + more, 0, not more
+            continue
+        yield line, None, payload
+        line += buffer.count('\n', index, end)
+        index = end
+        skip_whitespace()
+        if buffer[index:index + 1] == ']':
+            return
+        expect(',')
+        index += 1
+        skip_whitespace()
+
+
+def _read_yaml(f: typing.TextIO) -> typing.Iterator[_SourceItem]:
+    """
+    Read a YAML source holding a list of rules. A block list starting at the first column is split into the texts of
+    its items, decoded separately, while any other layout is composed one item at a time.
+    """
+    for line, text in enumerate(f, 1):
+        if _yaml_item_pattern.match(text):
+            break
+        if not _yaml_header_pattern.match(text):
+            break
+    else:
+        text = ''
+    if not _yaml_item_pattern.match(text):
+        f.seek(0)
+        yield from _compose_yaml(f)
+        return
+    start, item = line, [text]
+    for line, text in enumerate(f, line + 1):
+        if _yaml_item_pattern.match(text):
+            yield start, _load_yaml_item, ''.join(item)
+            start, item = line, []
+        item.append(text)
+    yield start, _load_yaml_item, ''.join(item)
+
+
+def _compose_yaml(f: typing.TextIO) -> typing.Iterator[_SourceItem]:
+    loader = yaml.SafeLoader(f)
+    try:
+        loader.get_event()
+        if loader.check_event(StreamEndEvent):
+            return
+        event = loader.get_event()
+        if loader.check_event(DocumentEndEvent):
+            return
+        if not loader.check_event(SequenceStartEvent):
+            raise _SourceError(event.end_mark.line + 1, "a list of rules is expected")
+        loader.get_event()
+        while not loader.check_event(SequenceEndEvent):
+            node = loader.compose_node(None, None)
+            yield node.start_mark.line + 1, None, loader.construct_document(node)
+        loader.get_event()
+        if not loader.check_event(DocumentEndEvent):
+            raise _SourceError(loader.peek_event().start_mark.line + 1, "a single list of rules is expected")
+    finally:
+        loader.dispose()
+
+
+def _read_source(path: str) -> typing.Iterator[_SourceItem]:
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(('.jsonl', '.ndjson')):
+            yield from _read_jsonl(f)
+        elif path.endswith('.json'):
+            yield from _read_json(f)
+        else:
+            yield from _read_yaml(f)
+
+
+def _decoding_error(line: int, error: Exception) -> typing.Tuple[int, str]:
+    """
+    :param line: Line of the decoded text.
+    :param error: Error decoding the text.
+    :return: The line and the message of the error, relative to the source.
+    """
+    if isinstance(error, json.JSONDecodeError):
+        return line + error.lineno - 1, f"invalid document: {error.msg} (column {error.colno})"
+    if isinstance(error, yaml.MarkedYAMLError) and error.problem_mark is not None:
+        problem = ', '.join(filter(None, (error.context, error.problem)))
+        return line + error.problem_mark.line, f"invalid document: {problem} (column {error.problem_mark.column + 1})"
+    return line, f"invalid document: {error}"
+
+
+def _parse_items(parser, schema: RuleSchema, items: typing.List[_SourceItem]) -> tuple:
+    """
+    Decode, validate and parse the rules of a batch, computing their normal form.
+    :return: The parsed rules and the (line, message) errors of the batch.
+    """
+    rules, errors = list(), list()
+    for line, decode, data in items:
+        try:
+            payload = decode(data) if decode is not None else data
+        except Exception as e:
+            errors.append(_decoding_error(line, e))
+            continue
+        payload_errors = schema.errors(payload)
+        if payload_errors:
+            name = payload.get('name') if isinstance(payload, dict) else None
+            errors.extend((line, f"rule '{name}': {error}") for error in payload_errors)
+            continue
+        try:
+            rule = parser._parse_rule(payload)
+            rule.condition.normal_form
+        except Exception as e:
+            errors.append((line, str(e)))
+            continue
+        rules.append(rule)
+    return rules, errors
+
+
+def _init_worker(engine_class, entity_classes: typing.List[tuple]):
+    global _worker_parser, _worker_schema
+    _worker_parser = engine_class._new_parser(entity_classes)
+    _worker_schema = RuleLoader.schema(_worker_parser)
+
+
+def _parse_batch(items: typing.List[_SourceItem]) -> tuple:
+    rules, errors = _parse_items(_worker_parser, _worker_schema, items)
+    if errors:
+        return None, errors
+    return dumps_rules(rules, _worker_parser._predicate_definitions, _worker_parser.type_entities), errors
+
+
+class RuleLoader:
+    """
+    Loader of the rules of large YAML, JSON or JSON Lines files. The file is read as a stream, one rule at a time,
+    without building the whole document. Each rule is validated against the rule schema and parsed, also in a pool
+    of worker processes: the loading fails if any rule is not valid, reporting all the errors with their line, and
+    otherwise all the rules are added to the engine at once, with a single build of the network.
+    """
+
+    def __init__(self, rebeca, workers: int = 0, batch_size: int = 500, mp_context: str = None):
+        """
+        :param rebeca: The engine to load the rules into.
+        :param workers: Number of worker processes parsing the rules. If 0, the rules are parsed in this process.
+        :param batch_size: Number of rules parsed by a worker at a time.
+        :param mp_context: Start method of the worker processes, the platform default if None.
+        """
+        if workers < 0:
+            raise ValueError("The number of workers cannot be negative")
+        if batch_size <= 0:
+            raise ValueError("The batch size must be positive")
+        self._rebeca = rebeca
+        self._workers: int = workers
+        self._batch_size: int = batch_size
+        self._context = multiprocessing.get_context(mp_context)
+
+    @staticmethod
+    def schema(rebeca) -> RuleSchema:
+        """
+        :param rebeca: An engine.
+        :return: The schema of the rules of the engine.
+        """
+        return RuleSchema(entity_classes=rebeca.type_entities,
+                          operators=rebeca._comparison_operators_map,
+                          conjunctions=rebeca._conjunctions_map,
+                          action_classes=[action_class.class_name for action_class in Action.__subclasses__()])
+
+    def load(self, path: str, cache_path: str = None) -> typing.List[int]:
+        """
+        Load the rules of a file (by extension: '.jsonl' or '.ndjson' for JSON Lines, '.json' for JSON, and YAML
+        otherwise), adding them to the engine.
+        :param path: Path of the rules file.
+        :param cache_path: Path of the cache of the compiled rules (see Rebeca.load_rules). If None, the rules are
+                           not cached.
+        :return: The ids of the stored rules.
+        :raise RuleLoadingError: If any rule is not valid, and then no rule is added.
+        """
+        type_entities = self._rebeca.type_entities
+        rules = None
+        if cache_path is not None:
+            with open(path, 'rb') as f:
+                key = rule_cache_key(f, type_entities, self._rebeca._comparison_operators_map)
+            rules = read_rule_cache(cache_path, key, self._rebeca._parse_predicate, type_entities)
+        if rules is None:
+            try:
+                rules = self._parse(path)
+            except RuleLoadingError:
+                # No rule is stored: release the predicates of the parsed ones
+                self._rebeca._release_predicates()
+                raise
+            if cache_path is not None:
+                write_rule_cache(cache_path, key, rules, self._rebeca._predicate_definitions, type_entities)
+        return self._rebeca._store_rules(rules)
+
+    def _parse(self, path: str) -> list:
+        rules, errors = list(), list()
+        try:
+            for batch_rules, batch_errors in self._parse_batches(self._batches(_read_source(path))):
+                errors.extend(batch_errors)
+                if not errors:
+                    rules.extend(batch_rules)
+        except _SourceError as e:
+            # The source is broken: the rules after the error cannot be read
+            errors.append((e.line, f"invalid document: {e}"))
+        except (yaml.YAMLError, UnicodeDecodeError) as e:
+            errors.append(_decoding_error(1, e))
+        if errors:
+            raise RuleLoadingError(path, [(f"{path}:{line}", message) for line, message in errors])
+        return rules
+
+    def _batches(self, items: typing.Iterator[_SourceItem]) -> typing.Iterator[typing.List[_SourceItem]]:
+        while True:
+            batch = list(itertools.islice(items, self._batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def _parse_batches(self, batches: typing.Iterator[typing.List[_SourceItem]]) -> typing.Iterator[tuple]:
+        """
+        Parse the batches of rules, in order. With workers, at most two batches per worker are pending at a time,
+        so that the source is read as the batches are parsed.
+        """
+        if not self._workers:
+            schema = self.schema(self._rebeca)
+            for batch in batches:
+                yield _parse_items(self._rebeca, schema, batch)
+            return
+        type_entities = self._rebeca.type_entities
+        with self._context.Pool(self._workers, initializer=_init_worker,
+                                initargs=(type(self._rebeca), self._rebeca._entity_class_definitions())) as pool:
+            pending = collections.deque()
+            for batch in batches:
+                pending.append(pool.apply_async(_parse_batch, (batch,)))
+                if len(pending) >= 2 * self._workers:
+                    yield self._collect(pending.popleft().get(), type_entities)
+            while pending:
+                yield self._collect(pending.popleft().get(), type_entities)
+
+    def _collect(self, result: tuple, type_entities: dict) -> tuple:
+        data, errors = result
+        if data is None:
+            return [], errors
+        return loads_rules(data, self._rebeca._parse_predicate, type_entities), errors
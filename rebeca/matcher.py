@@ -0,0 +1,579 @@
+import functools
+import typing
+from collections import Counter
+from contextlib import contextmanager
+from collections.abc import Mapping
+from itertools import chain
+
+from experta.conditionalelement import ConditionalElement, AND, OR
+from experta.engine import KnowledgeEngine
+from experta.fact import Fact, InitialFact
+from experta.factlist import FactList
+from experta.fieldconstraint import L
+from experta.matchers import ReteMatcher
+from experta.matchers.rete.check import TypeCheck, FactCapture, FeatureCheck
+from experta.matchers.rete.mixins import ChildNode
+from experta.matchers.rete.nodes import BusNode, ConflictSetNode, FeatureTesterNode
+from experta.matchers.rete.token import Token
+from experta.matchers.rete.utils import prepare_rule, extract_facts, generate_checks, wire_rule
+from experta.rule import Rule
+
+from .actions import Action
+from .columnar import ColumnarMatcher
+from .rule import _Rule
+
+_missing = object()
+
+
+class _AlphaChildren(list):
+    """
+    Children of an alpha node (or of the root node), indexed by the check of the child alpha nodes. The alpha nodes
+    testing the type of the fact are indexed by type, the ones testing a literal value of an attribute (e.g. the
+    'type' or the 'id' of a device) by attribute and value: a fact is passed only to the alpha nodes whose test
+    it may pass, instead of to every child. The index is extended on append, and rebuilt lazily after any other
+    change of the children.
+    """
+
+    def __init__(self, children=()):
+        super().__init__(children)
+        self._index: typing.Optional[tuple] = None
+
+    def _build_index(self) -> tuple:
+        self._index = dict(), dict(), dict(), list()
+        for child in self:
+            self._index_child(child)
+        return self._index
+
+    def _index_child(self, child: ChildNode):
+        by_check, by_type, by_value, others = self._index
+        check = getattr(child.node, 'matcher', None)
+        if isinstance(child.node, FeatureTesterNode):
+            by_check.setdefault(id(check), child.node)
+            if isinstance(check, TypeCheck):
+                by_type.setdefault(check.fact_type, list()).append(child)
+                return
+            if isinstance(check, FeatureCheck) and isinstance(check.how, L) and check.how.__bind__ is None \
+                    and isinstance(check.what, str) and '__' not in check.what:
+                try:
+                    by_value.setdefault(check.what, dict()).setdefault(check.how.value, list()).append(child)
+                    return
+                except TypeError:
+                    pass
+        others.append(child)
+
+    def append(self, child: ChildNode):
+        super().append(child)
+        if self._index is not None:
+            self._index_child(child)
+
+    def find(self, check) -> typing.Optional[FeatureTesterNode]:
+        """
+        :param check: An alpha check.
+        :return: The child alpha node testing the given check, None if missing.
+        """
+        return (self._index or self._build_index())[0].get(id(check))
+
+    def candidates(self, fact) -> typing.Iterator[ChildNode]:
+        """
+        :param fact: A fact.
+        :return: The children which the fact may activate.
+        """
+        _, by_type, by_value, others = self._index or self._build_index()
+        yield from others
+        yield from by_type.get(type(fact), ())
+        for what, values in by_value.items():
+            value = fact.get(what, _missing)
+            if value is not _missing:
+                try:
+                    yield from values.get(value, ())
+                except TypeError:
+                    yield from chain.from_iterable(values.values())
+
+
+def _invalidating(name: str):
+    method = getattr(list, name)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._index = None
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+for _name in ('extend', 'insert', 'remove', 'pop', 'clear', 'sort', 'reverse',
+              '__setitem__', '__delitem__', '__iadd__'):
+    setattr(_AlphaChildren, _name, _invalidating(_name))
+
+
+def _prepare_rule(rule):
+    # The rules built by the engine come from the normal form of their condition, already prepared
+    return rule if isinstance(rule, _Rule) else prepare_rule(rule)
+
+
+def _candidates(node, fact) -> typing.Iterable[ChildNode]:
+    children = node.children
+    return children.candidates(fact) if isinstance(children, _AlphaChildren) else children
+
+
+class _RootNode(BusNode):
+    """ Bus node passing each fact only to the type tests of its class. """
+
+    def __init__(self):
+        super().__init__()
+        self.children = _AlphaChildren()
+
+    def add_child(self, node, callback):
+        self.children.append(ChildNode(node, callback))
+
+    def add(self, fact):
+        token = Token.valid(fact)
+        for child in self.children.candidates(fact):
+            child.callback(token)
+
+    def remove(self, fact):
+        token = Token.invalid(fact)
+        for child in self.children.candidates(fact):
+            child.callback(token)
+
+
+class _AlphaNode(FeatureTesterNode):
+    """ Feature tester node passing the tokens only to the children whose test the fact may pass. """
+
+    def __init__(self, matcher):
+        super().__init__(matcher)
+        self.children = _AlphaChildren()
+
+    def add_child(self, node, callback):
+        # Nodes are never added twice while building: skip the linear membership test of the children
+        self.children.append(ChildNode(node, callback))
+
+    def _activate(self, token):
+        if len(token.data) != 1:
+            raise ValueError("Alpha nodes are activated by single fact tokens")
+        fact = next(iter(token.data))
+        match = self.matcher(fact)
+        if match:
+            if isinstance(match, Mapping):
+                for key, value in match.items():
+                    if isinstance(key, tuple):  # Negated condition
+                        if key[1] in token.context and token.context[key[1]] == value:
+                            return False
+                    else:
+                        if token.context.get(key, value) != value:
+                            return False
+                        if (False, key) in token.context and token.context[(False, key)] == value:
+                            return False
+                token.context.update(match)
+            for child in self.children.candidates(fact):
+                child.callback(token)
+
+
+class _RuleEngineMatcher(ReteMatcher):
+    """
+    RETE matcher which allows to attach and detach single rules on the network of a running engine,
+    without rebuilding the whole network and re-declaring the working memory.
+    The nodes are shared among the rules: the alpha nodes testing the same feature of a fact (the engine interns
+    the predicates, so that identical comparisons are the same test), and the join nodes of the rules built
+    together whose conditions are identical.
+    The conflict set nodes reached by a change are tracked, so that collecting the activations costs as much as
+    the rules actually affected, instead of polling every rule.
+    The alpha nodes index their children by type and by literal attribute values (see _AlphaChildren).
+    The rules supported by the columnar matcher of the engine, if any (see ColumnarMatcher), are routed to it instead
+    of the network: their activations are collected together with the ones of the network.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._columnar: typing.Optional[ColumnarMatcher] = None
+        self._conflict_set_nodes: typing.List[ConflictSetNode] = None
+        self._conflict_set_order: typing.Dict[int, int] = dict()
+        self._changed_nodes: typing.Set[ConflictSetNode] = set()
+        super().__init__(*args, **kwargs)
+
+    def _get_conflict_set_nodes(self) -> typing.List[ConflictSetNode]:
+        if self._conflict_set_nodes is None:
+            nodes, visited = list(), set()
+
+            def collect(node):
+                if id(node) not in visited:
+                    visited.add(id(node))
+                    if isinstance(node, ConflictSetNode):
+                        nodes.append(node)
+                    for child in node.children:
+                        collect(child.node)
+
+            collect(self.root_node)
+            self._conflict_set_nodes, self._conflict_set_order = list(), dict()
+            self._track_conflict_set_nodes(nodes)
+        return self._conflict_set_nodes
+
+    def _track_conflict_set_nodes(self, nodes: typing.Iterable[ConflictSetNode]):
+        """
+        Append conflict set nodes to the ordered list of the nodes of the network, tracking their activations.
+        :param nodes: The conflict set nodes.
+        """
+        for node in nodes:
+            if id(node) not in self._conflict_set_order:
+                self._conflict_set_order[id(node)] = len(self._conflict_set_nodes)
+                self._conflict_set_nodes.append(node)
+                if '_activate' not in vars(node):
+                    # Newly wired node: track its activations, and collect the ones it may already have
+                    node._activate = functools.partial(self._activate_conflict_set_node, node, node._activate)
+                    self._changed_nodes.add(node)
+
+    def _activate_conflict_set_node(self, node: ConflictSetNode, activate, token):
+        self._changed_nodes.add(node)
+        activate(token)
+
+    def changes(self, adding=None, deleting=None):
+        """
+        Pass the given changes to the network.
+        :param adding: The declared facts.
+        :param deleting: The retracted facts.
+        :return: The added and the removed activations: the ones of the columnar matcher, followed by the ones
+                 collected from the changed conflict set nodes in network order.
+        """
+        deleting, adding = deleting or (), adding or ()
+        added, removed = list(), list()
+        if self._columnar is not None:
+            added, removed = self._columnar.changes(adding, deleting)
+        for fact in deleting:
+            self.root_node.remove(fact)
+        for fact in adding:
+            self.root_node.add(fact)
+        self._get_conflict_set_nodes()
+        order = self._conflict_set_order
+        changed_nodes = sorted((node for node in self._changed_nodes if id(node) in order), key=lambda n: order[id(n)])
+        self._changed_nodes = set()
+        for node in changed_nodes:
+            node_added, node_removed = node.get_activations()
+            added.extend(node_added)
+            removed.extend(node_removed)
+        return added, removed
+
+    def prepare_ruleset(self, engine):
+        """
+        :param engine: The knowledge engine.
+        :return: The prepared rules of the engine wired in the network, the others being added to the columnar matcher.
+        """
+        ruleset = [_prepare_rule(rule) for rule in engine.get_rules()]
+        if self._columnar is not None:
+            ruleset = self._columnar.attach(ruleset)
+        return set(ruleset)
+
+    def reset(self):
+        super().reset()
+        if self._columnar is not None:
+            self._columnar.reset()
+
+    def build_network(self):
+        self._columnar = getattr(self.engine, '__columnar__', None)
+        self.root_node = _RootNode()
+        super().build_network()
+        self._split_new_edges(self.root_node, dict(), dict())
+
+    @staticmethod
+    def build_alpha_part(ruleset, root_node):
+        """
+        Build the alpha part of the rules starting at the root node, as the RETE matcher does: the checks of each
+        fact, sorted by type and by the number of facts sharing them, follow a path of alpha nodes, reusing the
+        existing ones. The alpha nodes are indexed, and so is the lookup of the existing nodes.
+        :param ruleset: The prepared rules.
+        :param root_node: The root node.
+        :return: The last alpha node of each fact of the rules.
+        """
+        # The alpha part matching the InitialFact is always built, for the conditions using it
+        ruleset = set(ruleset)
+        ruleset.add(Rule(InitialFact()))
+        rule_facts = {rule: extract_facts(rule) for rule in ruleset}
+        fact_checks = {fact: set(generate_checks(fact)) for fact in chain.from_iterable(rule_facts.values())}
+        check_rank = Counter(chain.from_iterable(fact_checks.values()))
+
+        def check_weight(check):
+            if isinstance(check, TypeCheck):
+                return float('inf'), hash(check)
+            elif isinstance(check, FactCapture):
+                return float('-inf'), hash(check)
+            return check_rank[check], hash(check)
+
+        def rule_weight(rule):
+            return sum(check_rank[check] for fact in rule_facts[rule] for check in fact_checks[fact]) / \
+                len(rule_facts[rule])
+
+        fact_terminal_nodes = dict()
+        for rule in sorted(ruleset, key=rule_weight, reverse=True):
+            for fact in rule_facts[rule]:
+                current_node = root_node
+                for check in sorted(fact_checks[fact], key=check_weight, reverse=True):
+                    node = current_node.children.find(check)
+                    if node is None:
+                        node = _AlphaNode(check)
+                        current_node.add_child(node, node.activate)
+                    current_node = node
+                fact_terminal_nodes[fact] = current_node
+        return fact_terminal_nodes
+
+    def build_beta_part(self, ruleset, alpha_terminals) -> typing.List[ConflictSetNode]:
+        """
+        Wire the beta part of the rules, as the RETE matcher does, except that the rules with identical conditions
+        share their join nodes: only their conflict set nodes are distinct. A single pattern needs no join, so its
+        conflict set node is added right below its alpha terminal.
+        :param ruleset: The prepared rules.
+        :param alpha_terminals: The last alpha node of each fact of the rules.
+        :return: The conflict set nodes of the rules.
+        """
+        last_nodes, conflict_set_nodes = dict(), list()
+        for rule in ruleset:
+            for lhs in (rule[0] if isinstance(rule[0], OR) else (rule,)):
+                key = tuple(lhs) if isinstance(lhs, ConditionalElement) else (lhs,)
+                last_node = last_nodes.get(key)
+                if last_node is None:
+                    fact = self._single_fact(lhs)
+                    if fact is not None:
+                        last_node = last_nodes[key] = alpha_terminals[fact]
+                if last_node is None:
+                    terminals = {id(node): node for node in (alpha_terminals[fact] for fact in extract_facts(lhs))}
+                    sizes = {node_id: len(node.children) for node_id, node in terminals.items()}
+                    wire_rule(rule, alpha_terminals, lhs=lhs)
+                    last_node, conflict_set_node = self._find_last_node(rule, terminals.values(), sizes)
+                    last_nodes[key] = last_node
+                else:
+                    conflict_set_node = ConflictSetNode(rule)
+                    last_node.add_child(conflict_set_node, conflict_set_node.activate)
+                conflict_set_nodes.append(conflict_set_node)
+        return conflict_set_nodes
+
+    @staticmethod
+    def _single_fact(lhs) -> typing.Optional[Fact]:
+        if isinstance(lhs, Fact):
+            return lhs
+        if isinstance(lhs, (Rule, AND)) and len(lhs) == 1 and isinstance(lhs[0], Fact):
+            return lhs[0]
+        return None
+
+    @staticmethod
+    def _find_last_node(rule, terminals, sizes: typing.Dict[int, int]) -> tuple:
+        """
+        Find the conflict set node of a rule, walking the nodes just added below its alpha terminals.
+        :param rule: The wired rule.
+        :param terminals: The alpha terminals of the facts of the rule.
+        :param sizes: The number of children of each terminal before the rule was wired.
+        :return: The conflict set node of the rule and its parent node.
+        """
+        stack = [(node, node.children[sizes[id(node)]:]) for node in terminals]
+        while stack:
+            parent, children = stack.pop()
+            for child in children:
+                if isinstance(child.node, ConflictSetNode) and child.node.rule is rule:
+                    return parent, child.node
+                stack.append((child.node, child.node.children))
+
+    def _split_new_edges(self, node, sizes: typing.Dict[int, int], views: typing.Dict[int, tuple]) -> list:
+        """
+        Visit the alpha network after some rules have been built on it, pruning the alpha nodes which lead
+        to no rule, and collecting for each node the edges which lead to the new nodes.
+        :param node: The visited node.
+        :param sizes: The number of children, before the build, of the alpha nodes which the build may have extended.
+                      The other nodes are either new (if their parent edge is new) or left untouched.
+        :param views: Where to collect the node and its new edges, by node id.
+        :return: The edges of the node leading to new nodes.
+        """
+        size = sizes.get(id(node), 0)
+        children, new_edges = list(), list()
+        for index, child in enumerate(node.children):
+            is_new = index >= size
+            if isinstance(child.node, FeatureTesterNode) and (is_new or id(child.node) in sizes):
+                child_new_edges = self._split_new_edges(child.node, sizes, views)
+                if not child.node.children:
+                    continue
+                if is_new or child_new_edges:
+                    new_edges.append(child)
+            elif is_new:
+                new_edges.append(child)
+            children.append(child)
+        node.children[:] = children
+        views[id(node)] = (node, new_edges)
+        return new_edges
+
+    def attach(self, *rules):
+        """
+        Wire built rules in the network, sharing the existing alpha nodes. The facts of the working memory whose
+        class is referenced by the rules are fed only to the new nodes, through the shared ones.
+        :param rules: The built rules to attach.
+        """
+        ruleset = [_prepare_rule(rule) for rule in rules]
+        if self._columnar is not None:
+            ruleset = self._columnar.attach(ruleset, self.engine.facts.values())
+            if not ruleset:
+                return
+        ruleset = set(ruleset)
+        facts = set(chain.from_iterable(extract_facts(r) for r in ruleset))
+        fact_types = {type(fact) for fact in facts}
+        fact_types.add(InitialFact)
+        # The build may only extend the alpha nodes testing the features of the new facts
+        checks = {id(check): check for check in chain.from_iterable(generate_checks(fact) for fact in facts)}
+        checks[id(TypeCheck(InitialFact))] = TypeCheck(InitialFact)
+        sizes, stack = dict(), [self.root_node]
+        while stack:
+            node = stack.pop()
+            sizes[id(node)] = len(node.children)
+            stack.extend(child.node for child in node.children
+                         if isinstance(child.node, FeatureTesterNode) and id(child.node.matcher) in checks)
+        alpha_terminals = self.build_alpha_part(ruleset, self.root_node)
+        conflict_set_nodes = self.build_beta_part(ruleset, alpha_terminals)
+        if self._conflict_set_nodes is not None:
+            self._track_conflict_set_nodes(conflict_set_nodes)
+        views: typing.Dict[int, tuple] = dict()
+        self._split_new_edges(self.root_node, sizes, views)
+        # Temporarily restrict the children of the alpha nodes to the new edges while feeding the facts
+        full_children = {node_id: list(node.children) for node_id, (node, _) in views.items()}
+        try:
+            for node, new_edges in views.values():
+                node.children[:] = new_edges
+            for fact in self.engine.facts.values():
+                if type(fact) in fact_types:
+                    self.root_node.add(fact)
+        finally:
+            for node, _ in views.values():
+                node.children[:] = full_children[id(node)]
+
+    def detach(self, action: Action):
+        """
+        Remove from the network the conflict set nodes of the rule related to the given action,
+        pruning the nodes which no longer lead to any rule.
+        :param action: The action of the rule to detach.
+        """
+        if self._columnar is not None and self._columnar.detach(action):
+            return
+        useful: typing.Dict[int, bool] = dict()
+
+        def prune(node) -> bool:
+            if id(node) not in useful:
+                if isinstance(node, ConflictSetNode):
+                    useful[id(node)] = node.rule.action is not action
+                else:
+                    node.children[:] = [child for child in node.children if prune(child.node)]
+                    useful[id(node)] = bool(node.children)
+            return useful[id(node)]
+
+        prune(self.root_node)
+        self._conflict_set_nodes = None
+
+    def load(self, facts: typing.Iterable):
+        """
+        Feed the network with a bulk of declared facts. Since the alpha nodes are memoryless, the alpha tests are
+        first run on the bare fact: the facts which cannot reach any beta node (e.g. entities whose state is not
+        referenced by any rule) are skipped without building and copying their tokens.
+        :param facts: The declared facts.
+        """
+        if self._columnar is not None:
+            facts = list(facts)
+            self._columnar.load(facts)
+
+        def reaches_beta(node, fact) -> bool:
+            for child in _candidates(node, fact):
+                if not isinstance(child.node, FeatureTesterNode):
+                    return True
+                if child.node.matcher(fact) and reaches_beta(child.node, fact):
+                    return True
+            return False
+
+        for fact in facts:
+            if reaches_beta(self.root_node, fact):
+                self.root_node.add(fact)
+
+    def statistics(self) -> dict:
+        """
+        Measure the size of the network and the sharing of its nodes.
+        :return: The number of wired rules, of their distinct conditions, of alpha nodes, of the alpha tests of
+                 the rule patterns (as if every rule had its own alpha nodes), of beta nodes and of conflict set
+                 nodes, the sharing ratio (alpha tests per alpha node) and the number of rules matched by the
+                 columnar matcher.
+        """
+        alpha_nodes, beta_nodes, visited = 0, 0, set()
+        rules = dict()
+
+        def visit(node):
+            nonlocal alpha_nodes, beta_nodes
+            if id(node) in visited:
+                return
+            visited.add(id(node))
+            if isinstance(node, FeatureTesterNode):
+                alpha_nodes += 1
+            elif isinstance(node, ConflictSetNode):
+                rules[id(node.rule)] = node.rule
+            elif node is not self.root_node:
+                beta_nodes += 1
+            for child in node.children:
+                visit(child.node)
+
+        visit(self.root_node)
+        alpha_tests = sum(len(set(generate_checks(fact)))
+                          for rule in rules.values() for fact in extract_facts(rule))
+        return dict(
+            rules=len(rules),
+            conditions=len({tuple(rule) for rule in rules.values()}),
+            alpha_nodes=alpha_nodes,
+            alpha_tests=alpha_tests,
+            beta_nodes=beta_nodes,
+            conflict_set_nodes=len(self._get_conflict_set_nodes()),
+            sharing_ratio=alpha_tests / alpha_nodes if alpha_nodes else None,
+            columnar_rules=len(self._columnar) if self._columnar is not None else 0
+        )
+
+
+class _WorkingMemory:
+    """
+    Adapter of the working memory of an experta knowledge engine, gathering the accesses to its internals which the
+    engine relies on to update the facts without the overhead of the public interface. Written against experta 1.9.4,
+    it assumes that:
+        - the fact list counts the declared facts by their id (FactList._get_fact_id), and rejects a declared fact
+          whose id is already counted, while retracting a fact uncounts the id of its current state;
+        - the fact list stores each fact by its index, saved in the '__factid__' attribute of the fact;
+        - the engine updates the agenda on each declaration and retraction, unless it is running.
+    """
+
+    def __init__(self, engine: KnowledgeEngine):
+        self._engine: KnowledgeEngine = engine
+
+    @contextmanager
+    def deferred_agenda(self) -> typing.Iterator[bool]:
+        """
+        Defer the updates of the agenda on the declarations and retractions of the block, so that they can be
+        collected as a single update.
+        :return: Whether the updates were already deferred (i.e. the engine is running).
+        """
+        running, self._engine.running = self._engine.running, True
+        try:
+            yield running
+        finally:
+            self._engine.running = running
+
+    def refresh(self, fact: Fact, properties: dict):
+        """
+        Update in place the properties of a declared fact, without propagating the change to the matcher. The fact
+        is counted by its new state, as if retracted and declared again.
+        :param fact: The declared fact.
+        :param properties: The properties to update.
+        """
+        reference_counter = self._engine.facts.reference_counter
+        fact_id = FactList._get_fact_id(fact)
+        reference_counter[fact_id] -= 1
+        if reference_counter[fact_id] <= 0:
+            del reference_counter[fact_id]
+        fact.refresh(properties)
+        reference_counter[FactList._get_fact_id(fact)] += 1
+
+    def load(self, facts: typing.List[Fact]):
+        """
+        Declare a bulk of facts at once, skipping their validation, and feed them to the matcher (see
+        _RuleEngineMatcher.load). The activations are collected on the next update of the agenda.
+        :param facts: The facts to declare.
+        """
+        fact_list = self._engine.facts
+        fact_list.reference_counter.update(FactList._get_fact_id(fact) for fact in facts)
+        for fact in facts:
+            fact.__factid__ = fact_list.last_index
+            fact_list[fact_list.last_index] = fact
+            fact_list.last_index += 1
+        self._engine.matcher.load(facts)
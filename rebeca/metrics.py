@@ -0,0 +1,178 @@
+import math
+import time
+import typing
+from collections import Counter
+
+Labels = typing.Tuple[typing.Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    Latency histogram with log-linear buckets (HDR-style). Values are recorded as integer microseconds: values
+    below 2**precision have their own bucket, larger ones share buckets whose width is bounded by 2**-(precision-1)
+    of their value, so percentiles keep the same relative error over any range of latencies.
+    """
+
+    def __init__(self, precision: int = 7):
+        """
+        :param precision: Number of significant bits of the buckets.
+        """
+        self._precision: int = precision
+        self._buckets: Counter = Counter()
+        self.count: int = 0
+        self.sum: float = 0.
+        self.min: float = math.inf
+        self.max: float = 0.
+
+    def record(self, seconds: float):
+        """
+        Record a latency.
+        :param seconds: The latency, in seconds.
+        """
+        value = int(seconds * 1e6)
+        shift = max(value.bit_length() - self._precision, 0)
+        self._buckets[(shift << self._precision) | (value >> shift)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def _bucket_bounds(self, index: int) -> typing.Tuple[int, int]:
+        shift, mantissa = index >> self._precision, index & ((1 << self._precision) - 1)
+        return mantissa << shift, (mantissa + 1) << shift
+
+    def percentile(self, percentile: float) -> typing.Optional[float]:
+        """
+        :param percentile: The percentile, between 0 and 100.
+        :return: The latency at the given percentile in seconds, None if no latency has been recorded.
+        """
+        if not self.count:
+            return None
+        rank = math.ceil(percentile / 100 * self.count)
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                lower, upper = self._bucket_bounds(index)
+                return min(max((lower + upper) / 2e6, self.min), self.max)
+        return self.max
+
+    def as_dict(self, percentiles: typing.Iterable[float] = (50, 90, 99, 99.9)) -> dict:
+        return dict(count=self.count, sum=self.sum, min=self.min if self.count else None,
+                    max=self.max if self.count else None,
+                    **{f"p{p:g}": self.percentile(p) for p in percentiles})
+
+
+class Metrics:
+    """
+    Opt-in collector of the counters and of the latency histograms of a rule engine:
+        - phase_seconds{phase}: latency of each phase of a trigger ('entity' construction, 'match' of the entities
+          on the network, 'aggregation' update, 'run' of the agenda including the synchronous actions);
+        - action_seconds{category} and rule_action_seconds{rule}: latency of the fired actions (of their dispatch,
+          when executed by an action dispatcher);
+        - events_total, events_coalesced_total (events merged with another update of the same entity by a
+          coalesced batch), actions_total{category}, activations_added_total{rule} and
+          activations_removed_total{rule}.
+    Metrics can be exported as a dictionary or in the Prometheus text format.
+
+        rebeca = Rebeca(metrics=Metrics())
+    """
+
+    clock = staticmethod(time.perf_counter)
+
+    def __init__(self, prefix: str = 'rebeca', precision: int = 7):
+        """
+        :param prefix: Prefix of the names of the exported metrics.
+        :param precision: Number of significant bits of the histogram buckets.
+        """
+        self._prefix: str = prefix
+        self._precision: int = precision
+        self._counters: typing.Dict[str, typing.Dict[Labels, int]] = dict()
+        self._histograms: typing.Dict[str, typing.Dict[Labels, Histogram]] = dict()
+
+    def increment(self, name: str, labels: Labels = (), value: int = 1):
+        """
+        Increment a counter.
+        :param name: Name of the counter.
+        :param labels: Labels of the counter, as (name, value) pairs.
+        :param value: The increment.
+        """
+        counters = self._counters.setdefault(name, dict())
+        counters[labels] = counters.get(labels, 0) + value
+
+    def record(self, name: str, labels: Labels, seconds: float):
+        """
+        Record a latency on a histogram.
+        :param name: Name of the histogram.
+        :param labels: Labels of the histogram, as (name, value) pairs.
+        :param seconds: The latency, in seconds.
+        """
+        histograms = self._histograms.setdefault(name, dict())
+        histogram = histograms.get(labels)
+        if histogram is None:
+            histogram = histograms[labels] = Histogram(self._precision)
+        histogram.record(seconds)
+
+    def observe(self, name: str, labels: Labels, start: float) -> float:
+        """
+        Record on a histogram the time elapsed from the given start.
+        :param name: Name of the histogram.
+        :param labels: Labels of the histogram, as (name, value) pairs.
+        :param start: The start time, as returned by the clock.
+        :return: The current time, so that consecutive phases can be chained.
+        """
+        now = self.clock()
+        self.record(name, labels, now - start)
+        return now
+
+    def histogram(self, name: str, labels: Labels = ()) -> typing.Optional[Histogram]:
+        return self._histograms.get(name, {}).get(labels)
+
+    def reset(self):
+        """ Clear every counter and histogram. """
+        self._counters = dict()
+        self._histograms = dict()
+
+    @staticmethod
+    def _format_labels(labels: Labels) -> str:
+        return ",".join(f"{k}={v}" for k, v in labels)
+
+    def as_dict(self) -> dict:
+        """
+        :return: The counters and the histograms, by name and by formatted labels (e.g. 'rule=LightsOn').
+        """
+        return dict(
+            counters={name: {self._format_labels(labels): value for labels, value in counters.items()}
+                      for name, counters in self._counters.items()},
+            histograms={name: {self._format_labels(labels): histogram.as_dict()
+                               for labels, histogram in histograms.items()}
+                        for name, histograms in self._histograms.items()}
+        )
+
+    @staticmethod
+    def _prometheus_labels(labels: Labels) -> str:
+        if not labels:
+            return ""
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+    def to_prometheus(self, quantiles: typing.Iterable[float] = (0.5, 0.9, 0.99)) -> str:
+        """
+        :return: The metrics in the Prometheus text exposition format, histograms being exported as summaries.
+        """
+        lines = list()
+        for name, counters in sorted(self._counters.items()):
+            metric = f"{self._prefix}_{name}"
+            lines.append(f"# TYPE {metric} counter")
+            for labels, value in counters.items():
+                lines.append(f"{metric}{self._prometheus_labels(labels)} {value}")
+        for name, histograms in sorted(self._histograms.items()):
+            metric = f"{self._prefix}_{name}"
+            lines.append(f"# TYPE {metric} summary")
+            for labels, histogram in histograms.items():
+                for quantile in quantiles:
+                    quantile_labels = self._prometheus_labels(labels + (('quantile', f"{quantile:g}"),))
+                    lines.append(f"{metric}{quantile_labels} {histogram.percentile(quantile * 100)!r}")
+                lines.append(f"{metric}_sum{self._prometheus_labels(labels)} {histogram.sum!r}")
+                lines.append(f"{metric}_count{self._prometheus_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
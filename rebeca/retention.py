@@ -0,0 +1,80 @@
+import typing
+from collections import Counter, OrderedDict
+
+
+class RetentionPolicy:
+    """
+    Retention policy of the entities of a class, bounding how many of them the engine keeps declared.
+    Entities are tracked in least recently updated order: an entity not updated for longer than the TTL expires,
+    and the least recently updated entities are evicted as soon as the class holds more than the maximum count.
+    Updating an entity and collecting the evicted ones take O(1) per entity.
+    """
+
+    ttl_reason = 'ttl'
+    max_count_reason = 'max_count'
+
+    def __init__(self, ttl: float = None, max_count: int = None):
+        """
+        :param ttl: Time to live of an entity since its last update, in seconds. If None, entities never expire.
+        :param max_count: Maximum number of entities of the class. If None, the number is unbounded.
+        """
+        if ttl is not None and ttl <= 0:
+            raise ValueError("The TTL must be positive")
+        if max_count is not None and max_count <= 0:
+            raise ValueError("The maximum count must be positive")
+        self._ttl: typing.Optional[float] = ttl
+        self._max_count: typing.Optional[int] = max_count
+        self._updates: typing.OrderedDict[object, float] = OrderedDict()
+        self._evictions: Counter = Counter()
+
+    def __len__(self):
+        return len(self._updates)
+
+    @property
+    def ttl(self) -> typing.Optional[float]:
+        return self._ttl
+
+    @property
+    def max_count(self) -> typing.Optional[int]:
+        return self._max_count
+
+    @property
+    def evictions(self) -> dict:
+        """ Number of evicted entities, by reason ('ttl' or 'max_count'). """
+        return dict(self._evictions)
+
+    def touch(self, entity_key, now: float):
+        """
+        Mark an entity as the most recently updated one.
+        :param entity_key: Key of the entity.
+        :param now: Time of the update, in seconds.
+        """
+        self._updates[entity_key] = now
+        self._updates.move_to_end(entity_key)
+
+    def discard(self, entity_key):
+        """
+        Stop tracking an entity.
+        :param entity_key: Key of the entity.
+        """
+        self._updates.pop(entity_key, None)
+
+    def clear(self):
+        self._updates.clear()
+
+    def expired(self, now: float) -> typing.List[typing.Tuple[object, str]]:
+        """
+        Collect the entities to evict, which are no longer tracked afterwards.
+        :param now: The current time, in seconds.
+        :return: The (entity key, reason) tuples of the evicted entities, least recently updated first.
+        """
+        evicted = list()
+        if self._max_count is not None:
+            while len(self._updates) > self._max_count:
+                evicted.append((self._updates.popitem(last=False)[0], self.max_count_reason))
+        if self._ttl is not None:
+            deadline = now - self._ttl
+            while self._updates and next(iter(self._updates.values())) <= deadline:
+                evicted.append((self._updates.popitem(last=False)[0], self.ttl_reason))
+        self._evictions.update(reason for _, reason in evicted)
+        return evicted
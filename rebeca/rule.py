@@ -5,6 +5,7 @@ from .actions import Action
 
 
 class _Rule(ExpRule):
+    """ Rule of the knowledge engine, built from the normal form of the condition of a Rebeca rule. """
 
     @property
     def action(self):
@@ -26,6 +27,7 @@ class Rule:
         self._condition: Condition = condition
         self._action: Action = action
         self._data: dict = kwargs
+        self._action.rule_name = kwargs.get('name')
 
     def __repr__(self):
         return f"Rule({self.name}, {self._condition} ==> {self._action})"
@@ -51,7 +53,7 @@ class Rule:
         return self._action
 
     def build(self) -> _Rule:
-        return _Rule(self._condition.expression)(self._action.execution)
+        return _Rule(*self._condition.normal_form)(self._action.execution)
 
     @property
     def info(self) -> dict:
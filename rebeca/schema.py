@@ -0,0 +1,190 @@
+import numbers
+import re
+import typing
+
+from .actions import _category_key, _class_key, _data_key, _placeholder_pattern
+from .condition import ConditionFamily
+from .entity.aggregation import WindowState, get_state_factory
+
+
+class RuleSchema:
+    """
+    Schema of the rule payloads, checked before parsing them. Instead of failing on the first error, the check
+    reports every error of a payload, each one with the path of the offending field
+    (e.g. "condition.$and[1].device.$properties.count[0]: '>>' is not a valid operator").
+    """
+
+    _aggregation_key = '$aggregation'
+    _aggregation_function_key = '$function'
+    _aggregation_window_key = '$window'
+    _properties_key = '$properties'
+    _property_key = '$property'
+    _entities_key = '$entities'
+
+    def __init__(self, entity_classes: typing.Iterable[str], operators: typing.Iterable[str],
+                 conjunctions: typing.Iterable[str], action_classes: typing.Iterable[str]):
+        """
+        :param entity_classes: Names of the registered entity classes.
+        :param operators: Supported comparison operators.
+        :param conjunctions: Supported conjunction keywords (e.g. '$and').
+        :param action_classes: Names of the supported action classes.
+        """
+        self._entity_classes: typing.Set[str] = set(entity_classes)
+        self._operators: typing.Set[str] = set(operators)
+        self._conjunctions: typing.Set[str] = set(conjunctions)
+        self._action_classes: typing.Set[str] = set(action_classes)
+
+    def errors(self, payload) -> typing.List[str]:
+        """
+        Check a rule payload.
+        :param payload: The payload of the rule.
+        :return: The errors of the payload, empty if it is valid.
+        """
+        errors = list()
+        if not isinstance(payload, dict):
+            return [f"rule must be a mapping, not {type(payload).__name__}"]
+        if not isinstance(payload.get('name'), str):
+            errors.append("name: a string is required")
+        if 'description' in payload and not isinstance(payload['description'], str):
+            errors.append("description: must be a string")
+        if 'meta' in payload and not isinstance(payload['meta'], dict):
+            errors.append("meta: must be a mapping")
+        aliases: typing.Set[str] = set()
+        condition = payload.get('condition')
+        if not isinstance(condition, dict):
+            errors.append("condition: a mapping is required")
+        elif self._aggregation_key in condition:
+            self._check_aggregation(condition[self._aggregation_key], f"condition.{self._aggregation_key}", errors)
+        else:
+            self._check_expression(condition, 'condition', aliases, errors)
+        self._check_action(payload.get('action'), 'action', aliases, errors)
+        return errors
+
+    def _check_expression(self, expression, path: str, aliases: typing.Set[str], errors: typing.List[str]):
+        if not isinstance(expression, dict) or len(expression) != 1:
+            errors.append(f"{path}: a mapping with a single conjunction or entity is required")
+            return
+        (key, value), = expression.items()
+        path = f"{path}.{key}"
+        if key.startswith(ConditionFamily._any_key):
+            member = key[len(ConditionFamily._any_key):]
+            class_name, _, alias = member.partition(ConditionFamily._alias_key)
+            if not class_name.startswith(ConditionFamily._function_key) or not alias:
+                errors.append(f"{path}: a member must be in the form '$any->class||alias'")
+                return
+            class_name = class_name[len(ConditionFamily._function_key):]
+            if alias in aliases:
+                errors.append(f"{path}: alias '{alias}' already defined")
+            aliases.add(alias)
+            self._check_entity(class_name, value, path, errors)
+        elif key.startswith('$'):
+            if key not in self._conjunctions:
+                errors.append(f"{path}: '{key}' is not a valid conjunction")
+            if not isinstance(value, list) or not value:
+                errors.append(f"{path}: a non-empty list of expressions is required")
+            else:
+                for index, item in enumerate(value):
+                    self._check_expression(item, f"{path}[{index}]", aliases, errors)
+        else:
+            self._check_entity(key, value, path, errors)
+
+    def _check_entity(self, class_name: str, body, path: str, errors: typing.List[str], properties: bool = True):
+        if class_name not in self._entity_classes:
+            errors.append(f"{path}: '{class_name}' is not a registered entity class")
+        if not isinstance(body, dict):
+            errors.append(f"{path}: a mapping of attributes is required")
+            return
+        for attribute, value in body.items():
+            if attribute != self._properties_key and isinstance(value, (dict, list)):
+                errors.append(f"{path}.{attribute}: must be a literal value")
+        if not properties:
+            return
+        comparisons = body.get(self._properties_key)
+        if not isinstance(comparisons, dict):
+            errors.append(f"{path}.{self._properties_key}: a mapping of properties is required")
+            return
+        for property_name, property_comparisons in comparisons.items():
+            self._check_comparisons(property_comparisons, f"{path}.{self._properties_key}.{property_name}", errors)
+
+    def _check_comparisons(self, comparisons, path: str, errors: typing.List[str]):
+        if not isinstance(comparisons, list) or not comparisons:
+            errors.append(f"{path}: a non-empty list of comparisons is required")
+            return
+        for index, comparison in enumerate(comparisons):
+            if not isinstance(comparison, dict) or not comparison:
+                errors.append(f"{path}[{index}]: a mapping of operators is required")
+                continue
+            for operator_key, operand in comparison.items():
+                if operator_key not in self._operators:
+                    errors.append(f"{path}[{index}]: '{operator_key}' is not a valid operator")
+                elif operator_key == 'between' and (not isinstance(operand, list) or len(operand) != 2):
+                    errors.append(f"{path}[{index}]: 'between' requires a list of two operands")
+                elif operator_key == 'regex':
+                    try:
+                        re.compile(operand)
+                    except (re.error, TypeError) as e:
+                        errors.append(f"{path}[{index}]: invalid regular expression ({e})")
+
+    def _check_aggregation(self, aggregation, path: str, errors: typing.List[str]):
+        if not isinstance(aggregation, dict):
+            errors.append(f"{path}: a mapping is required")
+            return
+        function_name = aggregation.get(self._aggregation_function_key)
+        if not isinstance(function_name, str) or get_state_factory(function_name) is None:
+            errors.append(f"{path}.{self._aggregation_function_key}: '{function_name}' is not a valid function")
+        entities = aggregation.get(self._entities_key)
+        if not isinstance(entities, list) or not entities:
+            errors.append(f"{path}.{self._entities_key}: a non-empty list of entities is required")
+        else:
+            for index, entity in enumerate(entities):
+                entity_path = f"{path}.{self._entities_key}[{index}]"
+                if not isinstance(entity, dict) or len(entity) != 1:
+                    errors.append(f"{entity_path}: a mapping with a single entity is required")
+                else:
+                    (class_name, body), = entity.items()
+                    self._check_entity(class_name, body, f"{entity_path}.{class_name}", errors, properties=False)
+        aggregation_property = aggregation.get(self._property_key)
+        if not isinstance(aggregation_property, dict) or len(aggregation_property) != 1:
+            errors.append(f"{path}.{self._property_key}: a mapping with a single property is required")
+        else:
+            (property_name, comparisons), = aggregation_property.items()
+            self._check_comparisons(comparisons, f"{path}.{self._property_key}.{property_name}", errors)
+        window = aggregation.get(self._aggregation_window_key)
+        if window is not None:
+            window_path = f"{path}.{self._aggregation_window_key}"
+            if not isinstance(window, dict):
+                errors.append(f"{window_path}: a mapping is required")
+                return
+            size = window.get('size')
+            if not isinstance(size, numbers.Real) or isinstance(size, bool) or size <= 0:
+                errors.append(f"{window_path}.size: a positive number is required")
+            if window.get('type', WindowState.sliding) not in (WindowState.sliding, WindowState.tumbling):
+                errors.append(f"{window_path}.type: must be '{WindowState.sliding}' or '{WindowState.tumbling}'")
+            capacity = window.get('capacity')
+            if capacity is not None and (not isinstance(capacity, int) or isinstance(capacity, bool) or capacity <= 0):
+                errors.append(f"{window_path}.capacity: a positive integer is required")
+
+    def _check_action(self, action, path: str, aliases: typing.Set[str], errors: typing.List[str]):
+        if not isinstance(action, dict):
+            errors.append(f"{path}: a mapping is required")
+            return
+        if action.get(_class_key) not in self._action_classes:
+            errors.append(f"{path}.{_class_key}: '{action.get(_class_key)}' is not a valid action class")
+        if not isinstance(action.get(_category_key), str):
+            errors.append(f"{path}.{_category_key}: a string is required")
+        if _data_key not in action:
+            errors.append(f"{path}.{_data_key}: is required")
+        else:
+            self._check_placeholders(action[_data_key], f"{path}.{_data_key}", aliases, errors)
+
+    def _check_placeholders(self, data, path: str, aliases: typing.Set[str], errors: typing.List[str]):
+        if isinstance(data, dict):
+            for key, value in data.items():
+                self._check_placeholders(value, f"{path}.{key}", aliases, errors)
+        elif isinstance(data, list):
+            for index, value in enumerate(data):
+                self._check_placeholders(value, f"{path}[{index}]", aliases, errors)
+        elif isinstance(data, str):
+            match = _placeholder_pattern.match(data)
+            if match is not None and match.group(1) not in aliases:
+                errors.append(f"{path}: rule member '{match.group(1)}' undefined")
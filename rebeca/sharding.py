@@ -0,0 +1,420 @@
+import copy
+import itertools
+import logging
+import multiprocessing
+import typing
+import zlib
+from collections import Counter
+
+from experta.conditionalelement import ConditionalElement
+from experta.fieldconstraint import FieldConstraint
+
+from .engine import Rebeca
+from .entity import Entity, AggregationEntity
+from .rule import Rule
+from .exceptions import RuleNotFoundError
+
+logger = logging.getLogger(__name__)
+
+
+def _run_shard(factory: typing.Callable[[], Rebeca], commands: multiprocessing.Queue,
+               replies: multiprocessing.Queue, batch_size: int, coalesce: bool):
+    """
+    Main loop of a shard process: it executes the commands received from the sharded engine on its own Rebeca
+    engine. Consecutive triggered events are evaluated in batches.
+    """
+    rebeca: Rebeca = factory()
+    command = commands.get()
+    while command[0] != 'stop':
+        name, args = command[0], command[1:]
+        next_command = None
+        try:
+            if name == 'trigger':
+                events = [args]
+                while len(events) < batch_size and not commands.empty():
+                    next_command = commands.get()
+                    if next_command[0] != 'trigger':
+                        break
+                    events.append(next_command[1:])
+                    next_command = None
+                rebeca.trigger_many(events, coalesce)
+            elif name == 'add_rule':
+                rule_ids = set(rebeca.rules)
+                rebeca.add_rule(args[0])
+                replies.put(next(iter(set(rebeca.rules) - rule_ids)))
+            elif name == 'update_rule':
+                rebeca.update_rule(*args)
+            elif name == 'remove_rule':
+                rebeca.remove_rule(*args)
+            elif name == 'retract':
+                class_name, entities_data = args
+                entity_class = rebeca.type_entities[class_name]
+                rebeca._retract_entities([entity_class(**entity_data) for entity_data in entities_data])
+            elif name == 'register_entity_class':
+                rebeca.register_entity_class(*args)
+            elif name == 'start':
+                rebeca.start()
+            elif name == 'entities':
+                class_name, = args
+                replies.put([(entity.class_name, entity.as_dict()) for entity in rebeca.entities.values()
+                             if class_name is None or entity.class_name == class_name])
+            elif name == 'join':
+                replies.put(None)
+        except Exception:
+            logger.exception("Error while executing the '%s' command on a shard", name)
+            if name in ('add_rule', 'join'):
+                replies.put(None)
+            elif name == 'entities':
+                replies.put([])
+        command = next_command if next_command is not None else commands.get()
+
+
+class _Shard:
+
+    def __init__(self, context, factory: typing.Callable[[], Rebeca], batch_size: int, coalesce: bool):
+        self.commands: multiprocessing.Queue = context.Queue()
+        self.replies: multiprocessing.Queue = context.Queue()
+        self.process = context.Process(target=_run_shard, daemon=True,
+                                       args=(factory, self.commands, self.replies, batch_size, coalesce))
+        self.process.start()
+
+    def send(self, *command):
+        self.commands.put(command)
+
+    def call(self, *command):
+        self.commands.put(command)
+        return self.replies.get()
+
+
+class _RulePlacement:
+    """
+    Placement of a rule on a shard, with the routes of the entities the rule references:
+    the keys of the entities fully identified by the rule, and the class-wide patterns (e.g. '$any' members).
+    """
+
+    def __init__(self, rule: Rule, payload: dict, shard: int, keys: typing.Set[object],
+                 patterns: typing.List[typing.Tuple[str, dict]], local_id: int = None):
+        self.rule: Rule = rule
+        self.payload: dict = payload
+        self.shard: int = shard
+        self.keys: typing.Set[object] = keys
+        self.patterns: typing.List[typing.Tuple[str, dict]] = patterns
+        self.local_id: int = local_id
+
+
+class ShardedRebeca:
+    """
+    Rule engine partitioning the entities across a pool of processes (shards), each running its own Rebeca engine.
+    Entities are owned by a shard according to their key ('key' partitioning) or to their class ('class'
+    partitioning). Each rule is placed on the shard owning most of the entities it references, and the events of
+    the referenced entities owned by other shards (e.g. the 'utc' entity, the members of an aggregation, or any
+    entity matched by a '$any' member) are routed to that shard too, so that cross-shard conditions and aggregations
+    are evaluated on the replicated state. Replicas are retracted once no rule of their shard references them.
+    Actions are executed on the shard of the fired rule.
+
+    Events are dispatched asynchronously: use join() to wait for their evaluation.
+
+        with ShardedRebeca(MyRuleEngine, shards=4) as rebeca:
+            rebeca.add_rule(*rules)
+            rebeca.trigger('device', {'id': 2, 'type': 'people_counter', 'count': 1})
+    """
+
+    partitions = ('key', 'class')
+
+    def __init__(self, factory: typing.Callable[[], Rebeca], shards: int = None, partition: str = 'key',
+                 batch_size: int = 100, coalesce: bool = False, mp_context: str = None):
+        """
+        :param factory: Picklable callable building the engine of a shard (e.g. a Rebeca subclass), which must
+                        register the entity classes and the actions.
+        :param shards: Number of shards, the number of CPUs by default.
+        :param partition: Partitioning of the entities, by 'key' or by 'class'.
+        :param batch_size: Maximum number of queued events evaluated by a shard in a single batch.
+        :param coalesce: Whether to fire actions only on the final state of each batch (see Rebeca.trigger_many).
+        :param mp_context: Start method of the shard processes, the platform default if None.
+        """
+        if partition not in self.partitions:
+            raise ValueError(f"'{partition}' is not a valid partition, use one of {self.partitions}")
+        self._factory: typing.Callable[[], Rebeca] = factory
+        self._router: Rebeca = factory()
+        self._shards_count: int = shards or multiprocessing.cpu_count()
+        self._partition: str = partition
+        self._batch_size: int = batch_size
+        self._coalesce: bool = coalesce
+        self._context = multiprocessing.get_context(mp_context)
+        self._shards: typing.List[_Shard] = None
+        self._placements: typing.Dict[int, _RulePlacement] = dict()
+        self._rule_ids = itertools.count(1)
+        self._key_routes: typing.Dict[object, Counter] = dict()
+        self._class_routes: typing.Dict[str, typing.Dict[int, list]] = dict()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    @property
+    def is_running(self) -> bool:
+        return self._shards is not None
+
+    @property
+    def rules(self) -> typing.Dict[int, Rule]:
+        """ Dictionary of rules defined in the engine. """
+        return {rule_id: placement.rule for rule_id, placement in self._placements.items()}
+
+    @property
+    def entities(self) -> typing.Dict[object, Entity]:
+        """ Dictionary of the entities states owned by the shards. """
+        entities = dict()
+        for shard_index, shard in enumerate(self._shards or ()):
+            for class_name, entity_data in shard.call('entities', None):
+                entity = self._router.type_entities[class_name](**entity_data) \
+                    if class_name in self._router.type_entities else None
+                if entity is not None and self._owner(entity) == shard_index:
+                    entities[entity.key] = entity
+        return entities
+
+    def read_rules(self) -> dict:
+        """
+        Read the data of all the stored rules.
+        :return: JSON data of the stored rules.
+        """
+        return {rule_id: placement.rule.info for rule_id, placement in self._placements.items()}
+
+    def register_entity_class(self, class_name: str, attributes: typing.List[str], broadcast: bool = False):
+        self._router.register_entity_class(class_name, attributes, broadcast)
+        for shard in self._shards or ():
+            shard.send('register_entity_class', class_name, attributes, broadcast)
+
+    def _shard_of(self, value) -> int:
+        return zlib.crc32(repr(value).encode('utf-8')) % self._shards_count
+
+    def _owner(self, entity: Entity) -> int:
+        return self._shard_of(entity.key if self._partition == 'key' else entity.class_name)
+
+    # Rule placement
+
+    def _place(self, payload: dict) -> _RulePlacement:
+        """
+        Parse a rule and place it on the shard owning most of the entities it references,
+        or on the shard with the least rules if it references no single entity.
+        The router never stores the rule: its predicates are released as soon as it is parsed.
+        """
+        try:
+            rule = self._router._parse_rule(copy.deepcopy(payload))
+        finally:
+            self._router._release_predicates()
+        keys, patterns, owners = set(), list(), Counter()
+        for pattern in rule.condition.patterns:
+            if isinstance(pattern, AggregationEntity):
+                keys.update(pattern.entity_keys)
+                if self._partition == 'key':
+                    owners.update(self._shard_of(entity_key) for entity_key in pattern.entity_keys)
+                continue
+            entity_class = self._router.type_entities[pattern.class_name]
+            attributes = {k: v for k, v in pattern.attributes.items()
+                          if not isinstance(v, (ConditionalElement, FieldConstraint))}
+            if all(k in attributes for k in entity_class._identity_keys):
+                entity = entity_class(**attributes)
+                keys.add(entity.key)
+                owners[self._owner(entity)] += 1
+            else:
+                patterns.append((pattern.class_name, attributes))
+                if self._partition == 'class':
+                    owners[self._shard_of(pattern.class_name)] += 1
+        if owners:
+            shard = owners.most_common(1)[0][0]
+        else:
+            load = Counter({shard: 0 for shard in range(self._shards_count)})
+            load.update(placement.shard for placement in self._placements.values())
+            shard = min(load, key=load.get)
+        return _RulePlacement(rule, payload, shard, keys, patterns)
+
+    def _add_routes(self, rule_id: int, placement: _RulePlacement):
+        for key in placement.keys:
+            self._key_routes.setdefault(key, Counter())[placement.shard] += 1
+        for class_name, attributes in placement.patterns:
+            self._class_routes.setdefault(class_name, dict()).setdefault(rule_id, list()).append(
+                (attributes, placement.shard))
+
+    def _remove_routes(self, rule_id: int, placement: _RulePlacement):
+        for key in placement.keys:
+            routes = self._key_routes[key]
+            routes[placement.shard] -= 1
+            if routes[placement.shard] <= 0:
+                del routes[placement.shard]
+            if not routes:
+                del self._key_routes[key]
+        for class_name, _ in placement.patterns:
+            self._class_routes[class_name].pop(rule_id, None)
+
+    def _sync_entities(self, placement: _RulePlacement):
+        """
+        Send to the shard of a rule added at run-time the current state of the entities it references,
+        which may be owned by other shards.
+        """
+        target = self._shards[placement.shard]
+        class_names = [None] if placement.keys else {class_name for class_name, _ in placement.patterns}
+        for class_name in class_names:
+            for shard_index, shard in enumerate(self._shards):
+                if shard_index == placement.shard:
+                    continue
+                for entity_class_name, entity_data in shard.call('entities', class_name):
+                    entity = self._router.type_entities[entity_class_name](**entity_data)
+                    if entity.key in placement.keys or self._matches(placement.patterns, entity_class_name,
+                                                                     entity_data):
+                        target.send('trigger', entity_class_name, entity_data)
+
+    def _release_replicas(self, shard_index: int, placement: _RulePlacement):
+        """
+        Retract from a shard, after the removal of a rule placed on it, the replicas of the entities the rule
+        referenced which the shard neither owns nor receives for another rule. Routes are counted per rule,
+        so a replica is kept while any rule of the shard still references it.
+        """
+        shard = self._shards[shard_index]
+        class_names = [None] if placement.keys else {class_name for class_name, _ in placement.patterns}
+        released = dict()
+        for class_name in class_names:
+            for entity_class_name, entity_data in shard.call('entities', class_name):
+                entity = self._router.type_entities[entity_class_name](**entity_data)
+                if (entity.key in placement.keys or self._matches(placement.patterns, entity_class_name, entity_data)) \
+                        and shard_index not in self._route(entity):
+                    released.setdefault(entity_class_name, list()).append(entity_data)
+        for class_name, entities_data in released.items():
+            shard.send('retract', class_name, entities_data)
+
+    @staticmethod
+    def _matches(patterns: typing.List[typing.Tuple[str, dict]], class_name: str, entity_data: dict) -> bool:
+        return any(class_name == pattern_class_name and all(entity_data.get(k) == v for k, v in attributes.items())
+                   for pattern_class_name, attributes in patterns)
+
+    def _deploy(self, rule_id: int, placement: _RulePlacement):
+        shard = self._shards[placement.shard]
+        self._sync_entities(placement)
+        placement.local_id = shard.call('add_rule', copy.deepcopy(placement.payload))
+
+    def add_rule(self, *payloads):
+        """
+        Parse and add one or more rule(s) to the engine, placing each one on a shard.
+        :param payloads: Content of the rule(s) to add.
+        """
+        for payload in payloads:
+            placement = self._place(payload)
+            rule_id = next(self._rule_ids)
+            self._placements[rule_id] = placement
+            self._add_routes(rule_id, placement)
+            if self.is_running:
+                self._deploy(rule_id, placement)
+
+    def remove_rule(self, rule_id):
+        """
+        Remove a rule by its id.
+        :param rule_id: The id of the rule to remove.
+        :return: The removed rule.
+        """
+        placement = self._placements.pop(rule_id, None)
+        if placement is None:
+            raise RuleNotFoundError(rule_id)
+        self._remove_routes(rule_id, placement)
+        if self.is_running:
+            self._shards[placement.shard].send('remove_rule', placement.local_id)
+            self._release_replicas(placement.shard, placement)
+        return placement.rule
+
+    def update_rule(self, rule_id, payload):
+        """
+        Update a rule by its id, moving it to another shard if the entities it references changed.
+        :param rule_id: Id of the rule to update.
+        :param payload: Payload of the rule.
+        """
+        previous = self._placements.get(rule_id)
+        if previous is None:
+            return
+        placement = self._place(payload)
+        self._remove_routes(rule_id, previous)
+        self._placements[rule_id] = placement
+        self._add_routes(rule_id, placement)
+        if self.is_running:
+            if placement.shard == previous.shard:
+                self._sync_entities(placement)
+                placement.local_id = previous.local_id
+                self._shards[placement.shard].send('update_rule', placement.local_id, copy.deepcopy(payload))
+            else:
+                self._shards[previous.shard].send('remove_rule', previous.local_id)
+                self._deploy(rule_id, placement)
+            self._release_replicas(previous.shard, previous)
+
+    # Engine
+
+    def start(self):
+        """
+        Start the shard processes, deploying the defined rules.
+        """
+        if self.is_running:
+            return
+        self._shards = [_Shard(self._context, self._factory, self._batch_size, self._coalesce)
+                        for _ in range(self._shards_count)]
+        for class_name, entity_class in self._router._registered_type_entities.items():
+            for shard in self._shards:
+                shard.send('register_entity_class', class_name, list(entity_class.attribute_keys),
+                           entity_class.broadcast)
+        for rule_id, placement in self._placements.items():
+            placement.local_id = self._shards[placement.shard].call('add_rule', copy.deepcopy(placement.payload))
+        for shard in self._shards:
+            shard.send('start')
+
+    def stop(self):
+        """
+        Stop the shard processes, after the evaluation of the dispatched events.
+        """
+        if not self.is_running:
+            return
+        for shard in self._shards:
+            shard.send('stop')
+        for shard in self._shards:
+            shard.process.join()
+        self._shards = None
+
+    def join(self):
+        """ Wait until every dispatched event has been evaluated. """
+        for shard in self._shards or ():
+            shard.call('join')
+
+    def _route(self, entity: Entity) -> typing.Set[int]:
+        """
+        Shards which an entity event is sent to: its owner and the shards of the rules referencing it,
+        or every shard for a broadcast entity.
+        """
+        if entity.broadcast:
+            return set(range(self._shards_count))
+        shards = {self._owner(entity)}
+        routes = self._key_routes.get(entity.key)
+        if routes is not None:
+            shards.update(routes)
+        class_routes = self._class_routes.get(entity.class_name)
+        if class_routes:
+            for rule_routes in class_routes.values():
+                for attributes, shard in rule_routes:
+                    if all(entity.get(k) == v for k, v in attributes.items()):
+                        shards.add(shard)
+        return shards
+
+    def trigger(self, entity_name: str, entity_data: dict):
+        """
+        Dispatch an Entity state update to the shards owning or referencing the entity.
+        """
+        if not self.is_running:
+            raise Exception("Must start the rule engine before triggering entities")
+        entity_class = self._router.type_entities.get(entity_name)
+        if entity_class is not None:
+            for shard in self._route(entity_class(**entity_data)):
+                self._shards[shard].send('trigger', entity_name, entity_data)
+
+    def trigger_many(self, events: typing.Iterable[typing.Tuple[str, dict]]):
+        """
+        Dispatch a batch of Entity state updates.
+        :param events: Iterable of (entity_name, entity_data) tuples.
+        """
+        for entity_name, entity_data in events:
+            self.trigger(entity_name, entity_data)
@@ -0,0 +1,37 @@
+import os
+import pickle
+
+from .exceptions import SnapshotError
+
+_format_version = 2
+
+
+def write_snapshot(path: str, state: dict):
+    """
+    Write the state of a rule engine to a binary snapshot file. The file is replaced atomically, so a crash while
+    writing never leaves a truncated snapshot behind.
+    :param path: Path of the snapshot file.
+    :param state: State of the rule engine.
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'wb') as f:
+        pickle.dump((_format_version, state), f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+def read_snapshot(path: str) -> dict:
+    """
+    Read the state of a rule engine from a binary snapshot file.
+    :param path: Path of the snapshot file.
+    :return: State of the rule engine.
+    """
+    try:
+        with open(path, 'rb') as f:
+            version, state = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError) as e:
+        raise SnapshotError(path, e)
+    if version != _format_version:
+        raise SnapshotError(path, f"format version {version} not supported")
+    return state
@@ -0,0 +1,106 @@
+import heapq
+import typing
+from collections.abc import Mapping
+
+from .rule import Rule
+
+
+class RuleStore(Mapping):
+    """
+    Storage of the rules by id, with secondary indexes by rule name and by referenced entity class.
+    Ids start from 1 and the ids of the removed rules are reused, smallest first, through a heap of free ids,
+    so that adding and removing a rule takes O(log n).
+    """
+
+    def __init__(self):
+        self._rules: typing.Dict[int, Rule] = dict()
+        self._free_ids: typing.List[int] = list()
+        self._next_id: int = 1
+        self._names: typing.Dict[str, typing.Set[int]] = dict()
+        self._classes: typing.Dict[str, typing.Set[int]] = dict()
+
+    def __getitem__(self, rule_id: int) -> Rule:
+        return self._rules[rule_id]
+
+    def __iter__(self):
+        return iter(self._rules)
+
+    def __len__(self):
+        return len(self._rules)
+
+    def _allocate_id(self) -> int:
+        while self._free_ids:
+            rule_id = heapq.heappop(self._free_ids)
+            if rule_id not in self._rules:
+                return rule_id
+        rule_id = self._next_id
+        self._next_id += 1
+        return rule_id
+
+    @staticmethod
+    def _class_names(rule: Rule) -> typing.Set[str]:
+        return {pattern.class_name for pattern in rule.condition.patterns}
+
+    def _index(self, rule_id: int, rule: Rule):
+        self._names.setdefault(rule.name, set()).add(rule_id)
+        for class_name in self._class_names(rule):
+            self._classes.setdefault(class_name, set()).add(rule_id)
+
+    def _unindex(self, rule_id: int, rule: Rule):
+        keys = [(self._names, rule.name)] + [(self._classes, class_name) for class_name in self._class_names(rule)]
+        for index, key in keys:
+            rule_ids = index.get(key)
+            if rule_ids is not None:
+                rule_ids.discard(rule_id)
+                if not rule_ids:
+                    del index[key]
+
+    def add(self, rule: Rule) -> int:
+        """
+        Store a new rule.
+        :param rule: The rule.
+        :return: The id of the stored rule.
+        """
+        rule_id = self._allocate_id()
+        self._rules[rule_id] = rule
+        self._index(rule_id, rule)
+        return rule_id
+
+    def replace(self, rule_id: int, rule: Rule) -> Rule:
+        """
+        Replace a stored rule, keeping its id.
+        :param rule_id: The id of the rule.
+        :param rule: The new rule.
+        :return: The replaced rule.
+        """
+        previous = self._rules[rule_id]
+        self._unindex(rule_id, previous)
+        self._rules[rule_id] = rule
+        self._index(rule_id, rule)
+        return previous
+
+    def pop(self, rule_id: int, default=None) -> typing.Optional[Rule]:
+        """
+        Remove a rule, freeing its id.
+        :param rule_id: The id of the rule.
+        :param default: Value returned if the rule is not stored.
+        :return: The removed rule.
+        """
+        rule = self._rules.pop(rule_id, None)
+        if rule is None:
+            return default
+        self._unindex(rule_id, rule)
+        if rule_id == self._next_id - 1:
+            self._next_id -= 1
+        else:
+            heapq.heappush(self._free_ids, rule_id)
+        return rule
+
+    def by_name(self, name: str) -> typing.Set[int]:
+        """ Ids of the rules with the given name. """
+        return set(self._names.get(name, ()))
+
+    def by_class(self, class_name: str) -> typing.Set[int]:
+        """ Ids of the rules referencing the given entity class (the 'aggregation' class, for aggregations). """
+        return set(self._classes.get(class_name, ()))
+
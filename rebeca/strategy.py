@@ -1,23 +1,91 @@
 import typing
 from experta.activation import Activation
+from experta.fact import Fact
 from experta.strategies import DepthStrategy
 
+from .actions import Action
+from .entity import Entity
+from .metrics import Metrics
+
+
+def _match_key(activation: Activation) -> tuple:
+    """ Identity of the match of an activation: its rule and the keys of the matched entities. """
+    return (activation.rule.action,
+            frozenset(fact.key for fact in activation.facts if isinstance(fact, Entity)))
+
+
+def _order_key(activation: Activation) -> tuple:
+    # The facts bound to the anonymous patterns are named by the id of the pattern, which is not stable
+    bindings = sorted((slot, fact['__factid__']) for slot, fact in activation.context.items()
+                      if isinstance(fact, Fact) and not slot.startswith('__pattern_'))
+    # Among the activations of the same facts, the ones of the first added rules are the last to be sorted, so that
+    # they fire first
+    return activation.key, -activation.rule.action.rule_id, bindings
+
+
+def _ordered(activations: typing.Iterable[Activation], reverse: bool = False) -> typing.List[Activation]:
+    """
+    Sort activations by their facts, from the least recently declared as the agenda does (see DepthStrategy),
+    then by the id of the rule, then by the facts bound to the aliases of the rule. The network collects the
+    activations of a rule in a set, and the matchers (e.g. the columnar one) collect the activations of the rules in
+    different orders, so their order would otherwise be arbitrary.
+    """
+    return sorted(activations, key=_order_key, reverse=reverse)
+
 
 class _RuleEngineStrategy(DepthStrategy):
+    """
+    Depth strategy notifying the actions of the changes of the matches of their rule. A match is identified by the
+    rule and by the set of the matched entities, regardless of their state. For each update of the agenda:
+        - a match both removed and added (i.e. its entities changed, but still match the rule) is refreshed:
+          the action gets the new facts, without exiting nor entering again;
+        - a match only removed exits: the action is notified once per evaluation cycle, however many of its
+          matches exit;
+        - a match only added enters: the action is notified for each new match, after the exits.
+    The engine updates the agenda once per modified entity, so that the removal and the addition of its matches
+    are seen together. When several matches of a rule enter (or exit) in the same update, e.g. a rule attached to
+    the running engine matching the stored entities, the action is left bound to the most recent one: the match
+    whose latest entity was declared last, then the one with the most recent other entities. The bookkeeping is
+    linear in the number of activations.
+    The activations are added to the agenda in the same order, whatever matcher collected them: activations of the
+    same facts fire (and exit) in the order of the ids of their rules, i.e. in the order the rules were added.
+    """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, metrics: Metrics = None, **kwargs):
         super().__init__(*args, **kwargs)
-        self._removed_rules = list()
+        self._exited_actions: typing.Set[Action] = set()
+        self._metrics: Metrics = metrics
 
     def _update_agenda(self, agenda, added: typing.List[Activation], removed: typing.List[Activation]):
+        added = _ordered(added)
         super()._update_agenda(agenda, added, removed)
-        for activation in removed:
-            if activation.rule not in self._removed_rules:
-                activation.rule.action.on_removed(activation.facts)
-            self._removed_rules.append(activation.rule)
+        if self._metrics is not None:
+            for name, activations in (('activations_added_total', added), ('activations_removed_total', removed)):
+                for activation in activations:
+                    self._metrics.increment(name, (('rule', activation.rule.action.rule_name),))
+        # A match may have several activations (e.g. an entity satisfying two branches of a '$or'): every added
+        # activation of a removed match refreshes it, and a new match enters once. The activations are notified in
+        # the order of their facts, so that an action is bound to its most recent match (see _ordered)
+        removed_matches = dict()
+        for activation in _ordered(removed, reverse=True):
+            removed_matches.setdefault(_match_key(activation), activation)
+        refreshed_keys, entered_keys, entered = set(), set(), list()
         for activation in added:
-            if activation.rule not in self._removed_rules:
-                activation.rule.action.on_added(activation.facts)
+            match_key = _match_key(activation)
+            if match_key in removed_matches:
+                refreshed_keys.add(match_key)
+                activation.rule.action.on_refreshed(activation.facts, activation.context)
+            elif match_key not in entered_keys:
+                entered_keys.add(match_key)
+                entered.append(activation)
+        for match_key, activation in removed_matches.items():
+            action = match_key[0]
+            if match_key not in refreshed_keys and action not in self._exited_actions:
+                self._exited_actions.add(action)
+                action.on_removed(activation.facts, activation.context)
+        for activation in entered:
+            activation.rule.action.on_added(activation.facts, activation.context)
 
     def reset(self):
-        self._removed_rules = list()
+        """ End the evaluation cycle. """
+        self._exited_actions = set()
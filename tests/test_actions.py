@@ -0,0 +1,57 @@
+import pytest
+
+from rebeca import Rebeca
+from rebeca.exceptions import RuleParsingError
+
+
+class _Engine(Rebeca):
+
+    def __init__(self):
+        super().__init__()
+        self.register_entity_class('device', ['id', 'type'])
+        self.calls = list()
+
+    @Rebeca.action('actions_service')
+    def on_actions_service(self, **kwargs):
+        self.calls.append(kwargs)
+
+
+def _rule(data: dict) -> dict:
+    return {'name': 'rule', 'description': '', 'meta': {},
+            'condition': {'$and': [
+                {'$any->device||counter': {'type': 'counter', '$properties': {'count': [{'>': 0}]}}},
+                {'$any->device||lamp': {'type': 'lamp', '$properties': {'on': [{'=': True}]}}}]},
+            'action': {'$class': 'single', '$category': 'actions_service', '$data': data}}
+
+
+def test_templates_render_the_bound_properties_with_their_type():
+    engine = _Engine()
+    engine.add_rule(_rule({
+        'target': '$lamp.id', 'count': '$counter.count', 'levels': '$counter.levels',
+        'nested': {'values': ['$counter.id', 'constant', 3, None], 'on': '$lamp.on'},
+        'missing': '$lamp.missing', 'text': 'not $lamp.id'}))
+    engine.start()
+    engine.trigger('device', {'id': 7, 'type': 'lamp', 'on': True})
+    engine.trigger('device', {'id': 2, 'type': 'counter', 'count': 5, 'levels': {'low': [1, 2]}})
+    assert engine.calls == [{
+        'target': 7, 'count': 5, 'levels': {'low': [1, 2]},
+        'nested': {'values': [2, 'constant', 3, None], 'on': True},
+        'missing': None, 'text': 'not $lamp.id'}]
+
+
+def test_enter_and_exit_templates():
+    engine = _Engine()
+    engine.add_rule(_rule({'$enter': {'on': '$lamp.id'}, '$exit': {'off': '$counter.id'}}))
+    engine.start()
+    engine.trigger('device', {'id': 7, 'type': 'lamp', 'on': True})
+    engine.trigger('device', {'id': 2, 'type': 'counter', 'count': 5})
+    engine.trigger('device', {'id': 2, 'type': 'counter', 'count': 0})
+    assert engine.calls == [{'on': 7}, {'off': 2}]
+
+
+def test_undefined_alias_is_a_parsing_error():
+    engine = _Engine()
+    with pytest.raises(RuleParsingError):
+        engine.add_rule(_rule({'target': '$other.id'}))
+    assert not engine.rules
+
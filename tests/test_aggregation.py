@@ -0,0 +1,146 @@
+import math
+import random
+import time
+
+import pytest
+
+from rebeca import Rebeca
+from rebeca.entity.aggregation import PercentileState, get_state_factory
+from rebeca.entity.classes import AggregationFunction
+
+
+def _percentile(values: list, percentile: float) -> object:
+    """ Reference percentile, linearly interpolated on the sorted values. """
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * percentile / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+@pytest.mark.parametrize('name', ['p0', 'p1', 'p25', 'p50', 'p95', 'p99.9', 'p100'])
+def test_percentile_follows_the_members(name):
+    rng = random.Random(name)
+    state = get_state_factory(name)()
+    assert isinstance(state, PercentileState)
+    members = list()
+    for _ in range(3000):
+        if members and rng.random() < .45:
+            state.remove(members.pop(rng.randrange(len(members))))
+        else:
+            # Few distinct values, so that the members have many duplicates
+            value = rng.choice([rng.randint(-5, 5), rng.uniform(-5, 5)])
+            members.append(value)
+            state.add(value)
+        assert state.count == len(members)
+        assert state.value == _percentile(members, float(name[1:]))
+
+
+@pytest.mark.parametrize('name', ['sum', 'count', 'min', 'max', 'not', 'avg'])
+def test_running_state_follows_the_members(name):
+    rng = random.Random(name)
+    function = AggregationFunction(name, 'count')
+    members = dict()
+    for _ in range(500):
+        entity_key = rng.randrange(20)
+        # Members without the property leave the aggregation
+        properties = {'count': rng.randint(-50, 50)} if rng.random() < .8 else {}
+        members[entity_key] = properties
+        value = function.update(entity_key, properties)
+        assert value == function.apply(list(members.values())) == function.value
+
+
+class _Engine(Rebeca):
+
+    def __init__(self):
+        super().__init__()
+        self.register_entity_class('device', ['id', 'type'])
+        self.calls = list()
+
+    @Rebeca.action('aggregation_service')
+    def on_aggregation_service(self, **kwargs):
+        self.calls.append(kwargs['rule'])
+
+
+def _aggregation_rule(name: str, function: str, threshold: int, device_ids: list) -> dict:
+    return {'name': name, 'description': '', 'meta': {},
+            'condition': {'$aggregation': {
+                '$function': function, '$property': {'count': [{'>=': threshold}]},
+                '$entities': [{'device': {'id': device_id, 'type': 'counter'}} for device_id in device_ids]}},
+            'action': {'$class': 'single', '$category': 'aggregation_service', '$data': {'rule': name}}}
+
+
+def test_member_feeds_every_aggregation():
+    engine = _Engine()
+    rule_ids = engine.add_rules([_aggregation_rule('sum', 'sum', 10, [1, 2]),
+                                 _aggregation_rule('max', 'max', 8, [1, 2]),
+                                 _aggregation_rule('other', 'max', 5, [2, 3])])
+    engine.start()
+
+    def trigger(device_id, count):
+        engine.trigger('device', {'id': device_id, 'type': 'counter', 'count': count})
+        calls = sorted(engine.calls)
+        engine.calls.clear()
+        return calls
+
+    # The aggregations over the same members are distinct, and a member feeds all of them
+    assert trigger(1, 9) == ['max']
+    assert trigger(2, 6) == ['other', 'sum']
+    aggregations = [key for key, entity in engine.entities.items() if entity.class_name == 'aggregation']
+    assert len(aggregations) == 3
+    # Removing a rule stops feeding its aggregation, and retracts it
+    engine.remove_rule(rule_ids[2])
+    assert trigger(2, 0) == []
+    assert trigger(2, 7) == ['sum']
+    assert len([entity for entity in engine.entities.values() if entity.class_name == 'aggregation']) == 2
+    device_3 = engine.type_entities['device'](id=3, type='counter').key
+    assert device_3 not in engine._aggregation_entities
+    # A rule sharing an aggregation keeps it when the other one is removed
+    engine.add_rule(_aggregation_rule('copy', 'sum', 10, [1, 2]))
+    engine.remove_rule(rule_ids[0])
+    assert trigger(1, 0) == []
+    assert trigger(1, 9) == ['copy', 'max']
+
+
+def _window_rule(function: str, threshold: int, size: float) -> dict:
+    return {'name': 'window', 'description': '', 'meta': {},
+            'condition': {'$aggregation': {
+                '$function': function, '$property': {'count': [{'>=': threshold}]},
+                '$window': {'size': size, 'type': 'sliding'},
+                '$entities': [{'device': {'id': device_id, 'type': 'counter'}} for device_id in (1, 2)]}},
+            'action': {'$class': 'single', '$category': 'aggregation_service',
+                       '$data': {'$enter': {'rule': 'on'}, '$exit': {'rule': 'off'}}}}
+
+
+@pytest.mark.parametrize('function, threshold', [('count', 2), ('avg', 1)])
+def test_window_expires_while_the_members_are_quiet(function, threshold):
+    for expire in ('expire_windows', 'tick'):
+        engine = _Engine()
+        engine.add_rule(_window_rule(function, threshold, size=.2))
+        engine.start()
+        for count in (1, 3):
+            engine.trigger('device', {'id': 1, 'type': 'counter', 'count': count})
+        assert engine.calls == ['on']
+        assert engine.expire_windows() == 0
+        # Only time passes: the samples expire, and so does the match (the average of no samples is undefined)
+        time.sleep(.25)
+        getattr(engine, expire)()
+        assert engine.calls == ['on', 'off']
+        assert engine.expire_windows() == 0
+
+
+def test_members_leaving_a_window_take_their_samples():
+    engine = _Engine()
+    engine.add_rule(_window_rule('count', 2, size=60))
+    engine.start()
+    for count in (1, 2):
+        engine.trigger('device', {'id': 1, 'type': 'counter', 'count': count})
+    assert engine.calls == ['on']
+    engine.set_retention_policy('device', max_count=1)
+    # Device 1 is evicted by the update of device 2
+    engine.trigger('device', {'id': 2, 'type': 'counter', 'count': 1})
+    assert engine.calls == ['on', 'off']
+    engine.trigger('device', {'id': 2, 'type': 'counter', 'count': 1})
+    assert engine.calls == ['on', 'off', 'on']
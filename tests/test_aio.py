@@ -0,0 +1,81 @@
+import asyncio
+import threading
+
+from rebeca import Rebeca, AsyncRebeca
+
+
+class _Engine(Rebeca):
+
+    def __init__(self):
+        super().__init__()
+        self.register_entity_class('device', ['id', 'type'])
+        self.calls = list()
+        self.threads = set()
+        self.add_rule({
+            'name': 'counting', 'description': '', 'meta': {},
+            'condition': {'$any->device||d': {'type': 'counter', '$properties': {'count': [{'>': 0}]}}},
+            'action': {'$class': 'single', '$category': 'aio_service', '$data': {'id': '$d.id'}}
+        })
+
+    @Rebeca.action('aio_service')
+    def on_aio_service(self, **kwargs):
+        self.calls.append(kwargs['id'])
+        self.threads.add(threading.current_thread().name)
+
+
+def _event(device_id: int, count: int = 1) -> tuple:
+    return 'device', {'id': device_id, 'type': 'counter', 'count': count}
+
+
+def test_queued_events_are_evaluated_on_the_engine_thread():
+    async def run():
+        engine = _Engine()
+        async with AsyncRebeca(engine, batch_size=2, coalesce=False) as front_end:
+            for device_id in range(5):
+                assert await front_end.trigger(*_event(device_id))
+            await front_end.join()
+            assert front_end.stats == dict(queued=0, processed=5, dropped=0, failed=0)
+            await front_end.call(engine.remove_rule, 1)
+        return engine
+
+    engine = asyncio.run(run())
+    assert engine.calls == list(range(5))
+    assert engine.threads and all(name.startswith('rebeca') for name in engine.threads)
+    assert not engine.rules
+
+
+def _overflow(policy: str, drain: bool) -> tuple:
+    async def run():
+        engine = _Engine()
+        front_end = AsyncRebeca(engine, maxsize=2, policy=policy, coalesce=False)
+        await front_end.start()
+        # The engine task does not run until the caller awaits, so the queue overflows
+        accepted = [await front_end.trigger(*_event(device_id)) for device_id in range(5)]
+        await front_end.stop(drain=drain)
+        return engine.calls, accepted, front_end.stats
+
+    return asyncio.run(run())
+
+
+def test_overflow_policies():
+    calls, accepted, stats = _overflow('drop_new', drain=True)
+    assert calls == [0, 1] and accepted == [True, True, False, False, False]
+    assert stats['dropped'] == 3 and stats['processed'] == 2
+    calls, accepted, stats = _overflow('drop_old', drain=True)
+    assert calls == [3, 4] and all(accepted)
+    assert stats['dropped'] == 3 and stats['processed'] == 2
+    # Undrained events are discarded on stop
+    calls, _, stats = _overflow('drop_old', drain=False)
+    assert calls == [] and stats['dropped'] == 5 and stats['processed'] == 0
+
+
+def test_blocking_policy_waits_for_a_free_slot():
+    async def run():
+        engine = _Engine()
+        async with AsyncRebeca(engine, maxsize=1, policy='block', batch_size=1) as front_end:
+            await asyncio.wait_for(asyncio.gather(*(front_end.trigger(*_event(i)) for i in range(4))), 5)
+            await front_end.join()
+            return sorted(engine.calls), front_end.stats
+
+    calls, stats = asyncio.run(run())
+    assert calls == [0, 1, 2, 3] and stats['dropped'] == 0
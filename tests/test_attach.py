@@ -0,0 +1,84 @@
+import copy
+import random
+
+import pytest
+
+from rebeca import Rebeca
+
+
+class _Engine(Rebeca):
+
+    def __init__(self):
+        super().__init__()
+        self.register_entity_class('device', ['id', 'type'])
+        self.register_entity_class('room', ['id'])
+        self.calls = list()
+
+    @Rebeca.action('attach_service')
+    def on_attach_service(self, **kwargs):
+        self.calls.append((kwargs['rule'], kwargs['targets']))
+
+
+def _rule(index: int, condition: dict, targets: list) -> dict:
+    return {'name': f'R{index}', 'description': '', 'meta': {}, 'condition': condition,
+            'action': {'$class': 'single', '$category': 'attach_service',
+                       '$data': {'rule': index, 'targets': targets}}}
+
+
+def _random_rule(rng: random.Random, index: int) -> dict:
+    """ Random conjunction of aliased members, some of them also matched by anonymous patterns. """
+    members = list()
+    for member in range(rng.randint(1, 3)):
+        class_name = rng.choice(['device', 'room'])
+        body = {'$properties': {'count': [{rng.choice(['>', '<=']): rng.randint(0, 2)}]}}
+        key = f'$any->{class_name}||m{member}' if rng.random() < .7 else class_name
+        members.append({key: body})
+    targets = [f'${key.split("||")[1]}.id' for member in members for key in member if '||' in key]
+    return _rule(index, {'$and': members}, targets)
+
+
+def _run(seed: int, mode: str) -> list:
+    """
+    Trigger random events on random rules, added before the start of the engine, or after it in bulk or one by one
+    in reverse order.
+    :return: The fired actions of each step, with their rendered data.
+    """
+    rng = random.Random(seed)
+    rules = [_random_rule(rng, index) for index in range(30)]
+    events = [(class_name, {'id': rng.randint(0, 5), 'count': rng.randint(0, 3)})
+              for class_name in (rng.choice(['device', 'room']) for _ in range(120))]
+    engine = _Engine()
+    if mode == 'before':
+        engine.add_rules(copy.deepcopy(rules))
+    engine.start()
+    if mode == 'bulk':
+        engine.add_rules(copy.deepcopy(rules))
+    elif mode == 'reversed':
+        for rule in reversed(rules):
+            engine.add_rule(copy.deepcopy(rule))
+    steps = list()
+    for class_name, data in events:
+        engine.trigger(class_name, data)
+        steps.append(sorted(engine.calls))
+        engine.calls.clear()
+    return steps
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_attached_rules_match_and_bind_as_built_ones(seed):
+    built = _run(seed, 'before')
+    assert any(targets for step in built for _, targets in step)
+    assert _run(seed, 'bulk') == built
+    assert _run(seed, 'reversed') == built
+
+
+def test_rule_attached_to_several_matches_binds_the_most_recent():
+    for ids in ((1, 2), (2, 1)):
+        engine = _Engine()
+        engine.start()
+        for device_id in ids:
+            engine.trigger('device', {'id': device_id, 'type': 'counter', 'count': 1})
+        engine.add_rule(_rule(0, {'$any->device||d': {'$properties': {'count': [{'>': 0}]}}}, ['$d.id']))
+        # The activations of the attached rule are run by the next trigger
+        engine.trigger('room', {'id': 1, 'count': 0})
+        assert engine.calls == [(0, [ids[-1]])]
@@ -0,0 +1,82 @@
+import pytest
+
+from rebeca import Rebeca
+from rebeca.metrics import Metrics
+
+
+class _Engine(Rebeca):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.register_entity_class('device', ['id', 'type'])
+        self.calls = list()
+        self.add_rule({
+            'name': 'counting', 'description': '', 'meta': {},
+            'condition': {'device': {'id': 1, '$properties': {'count': [{'>': 0}]}}},
+            'action': {'$class': 'single', '$category': 'batch_service',
+                       '$data': {'$enter': {'state': 'on'}, '$exit': {'state': 'off'}}}
+        })
+        self.add_rule({
+            'name': 'total', 'description': '', 'meta': {},
+            'condition': {'$aggregation': {
+                '$function': 'sum', '$property': {'count': [{'>=': 10}]},
+                '$entities': [{'device': {'id': device_id, 'type': 'counter'}} for device_id in (1, 2)]}},
+            'action': {'$class': 'single', '$category': 'batch_service', '$data': {'state': 'full'}}
+        })
+
+    @Rebeca.action('batch_service')
+    def on_batch_service(self, **kwargs):
+        self.calls.append(kwargs['state'])
+
+
+def _events(*counts) -> list:
+    return [('device', {'id': device_id, 'type': 'counter', 'count': count}) for device_id, count in counts]
+
+
+def test_coalesced_batch_fires_on_the_final_states():
+    engine = _Engine()
+    engine.start()
+    engine.trigger_many(_events((1, 1), (1, 0), (2, 4), (1, 5)))
+    assert engine.calls == ['on']
+    # Intermediate states of the batch reaching the threshold of the aggregation do not fire it
+    engine.trigger_many(_events((2, 9), (2, 3)))
+    assert engine.calls == ['on']
+    engine.trigger_many(_events((1, 0), (2, 10), (1, 1)))
+    assert engine.calls == ['on', 'full']
+    assert engine.entities[engine.type_entities['device'](id=1, type='counter').key]['count'] == 1
+
+
+def test_uncoalesced_batch_fires_on_every_state():
+    engine = _Engine()
+    engine.start()
+    engine.trigger_many(_events((1, 1), (1, 0), (1, 2)), coalesce=False)
+    assert engine.calls == ['on', 'off', 'on']
+
+
+def test_batch_block_buffers_the_triggers():
+    engine = _Engine()
+    engine.start()
+    with engine.batch():
+        engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 1})
+        with engine.batch():
+            engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 0})
+        engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 2})
+        assert engine.calls == [] and not engine.entities
+    assert engine.calls == ['on']
+    # The updates of a block which raises are discarded
+    with pytest.raises(RuntimeError):
+        with engine.batch():
+            engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 0})
+            raise RuntimeError()
+    engine.trigger('device', {'id': 2, 'type': 'counter', 'count': 0})
+    assert engine.calls == ['on']
+
+
+def test_coalesced_events_are_counted_as_triggered():
+    engine = _Engine(metrics=Metrics())
+    engine.start()
+    engine.trigger_many(_events((1, 1), (1, 0), (2, 4), (1, 5)) + [('unknown', {'id': 1})])
+    engine.trigger_many(_events((2, 5)), coalesce=False)
+    counters = engine.metrics.as_dict()['counters']
+    assert counters['events_total'] == {'': 5}
+    assert counters['events_coalesced_total'] == {'': 2}
@@ -0,0 +1,82 @@
+import json
+
+from experta.operator import GT
+
+from rebeca import Rebeca
+from rebeca.cache import rule_cache_key, write_rule_cache
+from rebeca.loader import RuleLoader
+
+
+class _Engine(Rebeca):
+
+    def __init__(self):
+        super().__init__()
+        self.register_entity_class('device', ['id', 'type'])
+        self.calls = list()
+
+    @Rebeca.action('cache_service')
+    def on_cache_service(self, **kwargs):
+        self.calls.append(kwargs)
+
+
+class _OtherOperatorsEngine(_Engine):
+
+    _comparison_operators_map = {**Rebeca._comparison_operators_map, '>=': GT}
+
+
+def _rules_file(tmp_path) -> str:
+    path = str(tmp_path / 'rules.jsonl')
+    with open(path, 'w') as f:
+        for threshold in (1, 5):
+            f.write(json.dumps({
+                'name': f'above-{threshold}', 'description': '', 'meta': {},
+                'condition': {'device': {'id': 1, '$properties': {'count': [{'>=': threshold}]}}},
+                'action': {'$class': 'single', '$category': 'cache_service', '$data': {'threshold': threshold}}}))
+            f.write('\n')
+    return path
+
+
+def _load(engine: Rebeca, path: str, cache_path: str, monkeypatch) -> int:
+    """ Load the rules, returning the number of times the rules file was parsed. """
+    parsed = list()
+    parse = RuleLoader._parse
+    monkeypatch.setattr(RuleLoader, '_parse', lambda self, *args: parsed.append(args) or parse(self, *args))
+    engine.load_rules(path, cache_path=cache_path)
+    return len(parsed)
+
+
+def test_cached_rules_are_loaded_back(tmp_path, monkeypatch):
+    path, cache_path = _rules_file(tmp_path), str(tmp_path / 'rules.cache')
+    assert _load(_Engine(), path, cache_path, monkeypatch) == 1
+    engine = _Engine()
+    assert _load(engine, path, cache_path, monkeypatch) == 0
+    assert sorted(rule.name for rule in engine.rules.values()) == ['above-1', 'above-5']
+    engine.start()
+    engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 5})
+    assert sorted(call['threshold'] for call in engine.calls) == [1, 5]
+
+
+def test_cache_is_keyed_by_the_operators(tmp_path, monkeypatch):
+    path, cache_path = _rules_file(tmp_path), str(tmp_path / 'rules.cache')
+    assert _load(_Engine(), path, cache_path, monkeypatch) == 1
+    engine = _OtherOperatorsEngine()
+    assert _load(engine, path, cache_path, monkeypatch) == 1
+    engine.start()
+    engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 5})
+    assert [call['threshold'] for call in engine.calls] == [1]
+
+
+def test_cache_which_cannot_be_rebuilt_is_a_miss(tmp_path, monkeypatch):
+    path, cache_path = _rules_file(tmp_path), str(tmp_path / 'rules.cache')
+    engine = _Engine()
+    engine.load_rules(path)
+    rules = list(engine.rules.values())
+    # The predicates of the cached rules reference an unknown operator
+    predicates = {predicate_id: ('~', values) for predicate_id, (_, values) in engine._predicate_definitions.items()}
+    with open(path, 'rb') as f:
+        key = rule_cache_key(f, engine.type_entities, engine._comparison_operators_map)
+    write_rule_cache(cache_path, key, rules, predicates, engine.type_entities)
+    engine = _Engine()
+    assert _load(engine, path, cache_path, monkeypatch) == 1
+    assert len(engine.rules) == 2
+    assert _load(_Engine(), path, cache_path, monkeypatch) == 0
@@ -0,0 +1,48 @@
+import datetime
+
+from rebeca import Rebeca
+from rebeca.entity.imps import UTC
+
+
+class _Engine(Rebeca):
+
+    def __init__(self):
+        super().__init__()
+        self.calls = list()
+        self.add_rule({
+            'name': 'evening', 'description': '', 'meta': {},
+            'condition': {'utc': {'$properties': {'hours': [{'>=': 18}], 'minutes': [{'>=': 30}]}}},
+            'action': {'$class': 'single', '$category': 'clock_service',
+                       '$data': {'$enter': {'state': 'on'}, '$exit': {'state': 'off'}}}
+        })
+
+    @Rebeca.action('clock_service')
+    def on_clock_service(self, **kwargs):
+        self.calls.append(kwargs['state'])
+
+
+def _time(hours: int, minutes: int) -> datetime.datetime:
+    return datetime.datetime(2024, 5, 6, hours, minutes, tzinfo=datetime.timezone.utc)
+
+
+def _utc_fact(engine: Rebeca):
+    return engine.entities[UTC().key]
+
+
+def test_ticks_reach_the_network_only_when_a_comparison_flips():
+    engine = _Engine()
+    engine.start()
+    engine.tick(_time(19, 5))
+    fact_id = _utc_fact(engine)['__factid__']
+    # Neither the hours nor the minutes cross a boundary: the fact is refreshed in place, and not evaluated
+    engine.tick(_time(20, 6))
+    assert _utc_fact(engine)['__factid__'] == fact_id
+    assert (_utc_fact(engine)['hours'], _utc_fact(engine)['minutes']) == (20, 6)
+    assert not engine._pending_evaluation and engine.calls == []
+    # The minutes cross 30: the fact is modified and the rule fires
+    engine.tick(_time(20, 30))
+    assert _utc_fact(engine)['__factid__'] != fact_id
+    assert engine.calls == ['on']
+    engine.tick(_time(20, 45))
+    engine.tick(_time(21, 10))
+    assert engine.calls == ['on', 'off']
@@ -0,0 +1,90 @@
+import copy
+import random
+
+import pytest
+
+from rebeca import Rebeca
+
+pytest.importorskip('numpy')
+
+_values = [0, 1, 2, -1, 1.5, 2.0, True, False, 3, 2 ** 60, 2 ** 53 + 1, float('nan'), float('inf')]
+_text_values = ['a', 'b', 'abc', 'xy']
+
+
+class _Engine(Rebeca):
+
+    def __init__(self, columnar: bool):
+        super().__init__(columnar=columnar)
+        self.register_entity_class('device', ['id', 'type'])
+        self.calls = list()
+
+    @Rebeca.action('columnar_service')
+    def on_columnar_service(self, **kwargs):
+        self.calls.append(kwargs['rule'])
+
+
+def _random_rule(rng: random.Random, index: int) -> dict:
+    """ Random single entity rule, comparing the numeric properties 'x' and 'y' and the text property 'z'. """
+    properties = dict()
+    for property_name in rng.sample(['x', 'y', 'z'], rng.randint(1, 2)):
+        comparisons = list()
+        for _ in range(rng.randint(1, 2)):
+            if property_name == 'z':
+                operator_key = rng.choice(['=', '!=', 'contains'])
+                operand = 'a' if operator_key == 'contains' else rng.choice(['a', 1, 0, 2.5])
+            else:
+                operator_key = rng.choice(['>', '>=', '<', '<=', '=', '!=', 'between'])
+                if operator_key == 'between':
+                    operand = sorted(rng.sample([-1, 0, 1, 1.5, 2, 3], 2))
+                else:
+                    operand = rng.choice([-1, 0, 1, 1.5, 2, 3, True, 2 ** 60])
+            comparisons.append({operator_key: operand})
+        properties[property_name] = comparisons
+    body = {'$properties': properties}
+    if rng.random() < .6:
+        body['type'] = rng.choice(['c', 'd'])
+    if rng.random() < .3:
+        body['id'] = rng.randint(0, 4)
+    condition = {'device': body} if rng.random() < .5 else {'$and': [{'$any->device||d': body}]}
+    return {'name': f'R{index}', 'description': '', 'meta': {}, 'condition': condition,
+            'action': {'$class': 'single', '$category': 'columnar_service',
+                       '$data': {'$enter': {'rule': index}, '$exit': {'rule': -index - 1}}}}
+
+
+def _run(seed: int, columnar: bool) -> tuple:
+    """
+    Trigger random events on a random rule set, adding and removing rules at run-time.
+    :return: The fired actions of each step, in firing order, and the number of rules matched by the columnar
+             matcher.
+    """
+    rng = random.Random(seed)
+    rules = [_random_rule(rng, index) for index in range(50)]
+    engine = _Engine(columnar)
+    rule_ids = [engine.add_rule(copy.deepcopy(rule))[0] for rule in rules[:25]]
+    engine.start()
+    steps = list()
+    for _ in range(300):
+        choice = rng.random()
+        if choice < .05 and len(rules) > 25:
+            rule_ids.append(engine.add_rule(copy.deepcopy(rules.pop()))[0])
+        elif choice < .08 and rule_ids:
+            engine.remove_rule(rule_ids.pop(rng.randrange(len(rule_ids))))
+        else:
+            data = {'id': rng.randint(0, 4), 'type': rng.choice(['c', 'd'])}
+            for property_name in ('x', 'y', 'z'):
+                if rng.random() < .8:
+                    data[property_name] = rng.choice(_text_values if property_name == 'z' else _values)
+            engine.trigger('device', data)
+        steps.append(list(engine.calls))
+        engine.calls.clear()
+    return steps, engine.network_statistics()['columnar_rules']
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_columnar_matches_as_rete(seed):
+    columnar_steps, columnar_rules = _run(seed, columnar=True)
+    rete_steps, rete_columnar_rules = _run(seed, columnar=False)
+    assert columnar_rules > 0 and rete_columnar_rules == 0
+    # The actions fire in the same order: the agenda orders the activations the same way, whichever matcher
+    # collected them
+    assert columnar_steps == rete_steps
@@ -0,0 +1,96 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from rebeca.dispatcher import ActionDispatcher
+
+
+class _Fact(dict):
+
+    def __init__(self, key):
+        super().__init__()
+        self.key = key
+
+
+class _Action:
+    """ Fired action, as seen by the dispatcher. """
+
+    def __init__(self, category: str, *entity_keys):
+        self.category = category
+        self.facts = tuple(_Fact(key) for key in entity_keys)
+
+
+def test_actions_of_the_same_entity_run_in_firing_order():
+    rng = random.Random(0)
+    executed = {key: list() for key in range(4)}
+
+    def execute(key, index, delay):
+        time.sleep(delay)
+        executed[key].append(index)
+
+    dispatcher = ActionDispatcher(ThreadPoolExecutor(max_workers=4), ordering='entity')
+    for index in range(60):
+        key = rng.randrange(4)
+        dispatcher.dispatch(_Action('service', key), execute, dict(key=key, index=index, delay=rng.random() / 500))
+    assert dispatcher.join(timeout=10)
+    assert dispatcher.pending == 0
+    assert sum(map(len, executed.values())) == 60
+    assert all(indexes == sorted(indexes) for indexes in executed.values())
+    dispatcher.shutdown()
+
+
+@pytest.mark.parametrize('retries, completed', [(2, True), (1, False)])
+def test_failing_actions_are_retried(retries, completed):
+    attempts, results, failures = list(), list(), list()
+
+    def execute(value):
+        attempts.append(value)
+        if len(attempts) < 3:
+            raise ValueError(value)
+        return value * 2
+
+    dispatcher = ActionDispatcher(retries=retries, on_complete=lambda *args: results.append(args),
+                                  on_failure=lambda category, data, exception: failures.append((category, data)))
+    dispatcher.dispatch(_Action('service', 1), execute, dict(value=4))
+    assert dispatcher.join(timeout=5)
+    assert attempts == [4] * (retries + 1)
+    assert results == ([('service', {'value': 4}, 8)] if completed else [])
+    assert failures == ([] if completed else [('service', {'value': 4})])
+    dispatcher.shutdown()
+
+
+def test_join_waits_for_the_running_actions():
+    release = threading.Event()
+    dispatcher = ActionDispatcher()
+    dispatcher.dispatch(_Action('service', 1), release.wait, dict(timeout=5))
+    assert not dispatcher.join(timeout=.05)
+    assert dispatcher.pending == 1
+    release.set()
+    assert dispatcher.join(timeout=5)
+    dispatcher.shutdown()
+
+
+def test_rejected_actions_release_their_slot():
+    release = threading.Event()
+    failures = list()
+    executor = ThreadPoolExecutor(max_workers=1)
+    dispatcher = ActionDispatcher(executor, ordering='rule',
+                                  on_failure=lambda category, data, exception: failures.append(data['index']))
+    action = _Action('service', 1)
+    dispatcher.dispatch(action, lambda index: release.wait(5), dict(index=0))
+    # Queued behind the running action, then rejected when submitted
+    dispatcher.dispatch(action, lambda index: None, dict(index=1))
+    executor.shutdown(wait=False)
+    with pytest.raises(RuntimeError):
+        dispatcher.dispatch(_Action('other'), lambda index: None, dict(index=2))
+    assert dispatcher.pending == 2
+    release.set()
+    assert dispatcher.join(timeout=5)
+    assert failures == [1]
+    # Later actions of the same key are not queued behind a dead queue
+    with pytest.raises(RuntimeError):
+        dispatcher.dispatch(action, lambda index: None, dict(index=3))
+    assert dispatcher.pending == 0 and dispatcher.join(timeout=0)
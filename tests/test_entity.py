@@ -0,0 +1,84 @@
+from experta.utils import unfreeze
+
+from rebeca import Rebeca
+from rebeca.entity.classes import _key_digest
+from rebeca.entity.utils import get_id_from_dict
+
+
+def test_cached_keys_match_the_digest_of_the_key_attributes():
+    engine = Rebeca()
+    engine.register_entity_class('device', ['id', 'type'])
+    device = engine.type_entities['device']
+    _key_digest.cache_clear()
+    for count in range(3):
+        for device_id in (1, 1.0, True, '1', None):
+            entity = device(id=device_id, type='counter', count=count)
+            assert entity.key == get_id_from_dict({'id': device_id, 'type': 'counter'}, device.__name__)
+    assert _key_digest.cache_info().hits == 2 * 5
+    # Values which are not scalars are hashed on each state
+    entity = device(id=[1, 2], type='counter')
+    assert entity.key == get_id_from_dict({'id': [1, 2], 'type': 'counter'}, device.__name__)
+    assert _key_digest.cache_info().currsize == 5
+
+
+class _Engine(Rebeca):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.register_entity_class('device', ['id', 'type'])
+        self.register_entity_class('room', ['id'], fast_keys=False)
+        self.calls = list()
+        self.add_rule({
+            'name': 'total', 'description': '', 'meta': {},
+            'condition': {'$aggregation': {
+                '$function': 'sum', '$property': {'count': [{'>=': 3}]},
+                '$entities': [{'device': {'id': device_id, 'type': 'counter'}} for device_id in (1, 2)]}},
+            'action': {'$class': 'single', '$category': 'entity_service', '$data': {'state': 'full'}}
+        })
+
+    @Rebeca.action('entity_service')
+    def on_entity_service(self, **kwargs):
+        self.calls.append(kwargs['state'])
+
+
+def test_key_mode_of_the_registered_classes():
+    for fast_keys in (False, True):
+        engine = _Engine(fast_keys=fast_keys)
+        device, room = engine.type_entities['device'], engine.type_entities['room']
+        assert device.fast_keys is fast_keys and room.fast_keys is False
+        key = device(id=1, type='counter', count=1).key
+        assert key == (('device', 1, 'counter') if fast_keys else
+                       get_id_from_dict({'id': 1, 'type': 'counter'}, device.__name__))
+        engine.start()
+        engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 1})
+        engine.trigger('device', {'id': 2, 'type': 'counter', 'count': 2})
+        assert key in engine.entities and device(id=2, type='counter').key in engine.entities
+        assert engine.calls == ['full']
+
+
+def test_states_split_and_diff_by_field():
+    engine = Rebeca()
+    engine.register_entity_class('sensor', ['id', 'site'])
+    sensor = engine.type_entities['sensor']
+    assert sensor.attribute_keys == ('id', 'site') and sensor._attribute_set == {'id', 'site'}
+    state = sensor(id=1, site='a', count=2, labels=['x'])
+    assert state.attributes == {'id': 1, 'site': 'a'}
+    assert state.properties == {'count': 2, 'labels': ['x']}
+    assert state.property_keys == {'count', 'labels'}
+    # Only the changed and the new properties are returned, with their values in the new state
+    new_state = sensor(id=1, site='a', count=2, labels=['x', 'y'], status='ok')
+    assert unfreeze(new_state.diff(state)) == {'labels': ['x', 'y'], 'status': 'ok'}
+    assert new_state.diff(new_state) == {}
+    assert unfreeze(state.diff({})) == state.properties
+
+
+def test_triggers_modify_only_the_changed_properties():
+    engine = _Engine()
+    engine.start()
+    engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 1, 'label': 'a'})
+    entity = engine.entities[engine.type_entities['device'](id=1, type='counter').key]
+    assert entity.properties == {'count': 1, 'label': 'a'}
+    engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 2})
+    entity = engine.entities[entity.key]
+    # Properties missing from an update keep their value
+    assert entity.properties == {'count': 2, 'label': 'a'}
@@ -0,0 +1,71 @@
+import os
+
+from rebeca import Rebeca
+from rebeca.eventlog import EventLog, read_events
+
+
+class _Engine(Rebeca):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.register_entity_class('device', ['id', 'type'])
+        self.calls = list()
+        self.add_rule({
+            'name': 'counting', 'description': '', 'meta': {},
+            'condition': {'device': {'id': 1, '$properties': {'count': [{'>': 0}]}}},
+            'action': {'$class': 'single', '$category': 'eventlog_service',
+                       '$data': {'$enter': {'state': 'on'}, '$exit': {'state': 'off'}}}
+        })
+
+    @Rebeca.action('eventlog_service')
+    def on_eventlog_service(self, **kwargs):
+        self.calls.append(kwargs['state'])
+
+
+def _record(path: str, *counts, segment_size: int = 64 * 1024) -> _Engine:
+    engine = _Engine(event_log=EventLog(path, segment_size=segment_size))
+    engine.start()
+    for count in counts:
+        engine.trigger('device', {'id': 1, 'type': 'counter', 'count': count})
+    engine.event_log.close()
+    return engine
+
+
+def test_events_are_read_back_in_order_across_segments(tmp_path):
+    path = str(tmp_path / 'events')
+    _record(path, *range(50), segment_size=256)
+    assert len(os.listdir(path)) > 1
+    events = list(read_events(path))
+    assert [(entity_name, entity_data['count']) for _, entity_name, entity_data in events] == \
+        [('device', count) for count in range(50)]
+    assert [timestamp for timestamp, _, _ in events] == sorted(timestamp for timestamp, _, _ in events)
+    # A reopened log appends new segments after the existing ones
+    _record(path, 50)
+    assert [entity_data['count'] for _, _, entity_data in read_events(path)] == list(range(51))
+
+
+def test_replay_captures_the_actions(tmp_path):
+    path = str(tmp_path / 'events')
+    recorder = _record(path, 1, 0, 2)
+    assert recorder.calls == ['on', 'off', 'on']
+    engine = _Engine(event_log=EventLog(str(tmp_path / 'replayed')))
+    engine.start()
+    actions = engine.replay(path, batch_size=2)
+    assert actions == [('eventlog_service', {'state': state}) for state in ('on', 'off', 'on')]
+    assert engine.calls == []
+    # Replayed events are not recorded again
+    engine.event_log.close()
+    assert list(read_events(engine.event_log.path)) == []
+
+
+def test_replay_executes_or_coalesces(tmp_path):
+    path = str(tmp_path / 'events')
+    _record(path, 1, 0, 2)
+    engine = _Engine()
+    engine.start()
+    assert engine.replay(path, execute=True) == []
+    assert engine.calls == ['on', 'off', 'on']
+    # Coalesced batches fire only on their final state
+    engine = _Engine()
+    engine.start()
+    assert engine.replay(path, coalesce=True) == [('eventlog_service', {'state': 'on'})]
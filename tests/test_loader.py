@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+from rebeca import Rebeca
+from rebeca.exceptions import RuleLoadingError
+
+
+class _Engine(Rebeca):
+
+    def __init__(self):
+        super().__init__()
+        self.register_entity_class('device', ['id', 'type'])
+
+    @Rebeca.action('loader_service')
+    def on_loader_service(self, **kwargs):
+        pass
+
+
+def _rule(name: str, operator: str = '>') -> dict:
+    return {'name': name, 'description': '', 'meta': {},
+            'condition': {'device': {'id': 1, '$properties': {'count': [{operator: 0}]}}},
+            'action': {'$class': 'single', '$category': 'loader_service', '$data': {}}}
+
+
+def _write(tmp_path, name: str, text: str) -> str:
+    path = str(tmp_path / name)
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+_yaml_rules = """# Rules
+- name: first
+  description: ''
+  meta: {}
+  condition:
+    device:
+      id: 1
+      $properties:
+        count:
+          - '>': 0
+  action:
+    $class: single
+    $category: loader_service
+    $data: {}
+- name: second
+  description: ''
+  meta: {}
+  condition:
+    device:
+      id: 1
+      $properties:
+        count:
+          - '%s': 0
+  action:
+    $class: single
+    $category: loader_service
+    $data: {}
+"""
+
+
+@pytest.mark.parametrize('workers', (0, 1))
+def test_rules_of_each_format_are_loaded(tmp_path, workers):
+    sources = [
+        _write(tmp_path, 'rules.jsonl', ''.join(json.dumps(_rule(name)) + '\n\n' for name in ('first', 'second'))),
+        _write(tmp_path, 'rules.json', json.dumps([_rule('first'), _rule('second')], indent=2)),
+        _write(tmp_path, 'rules.yml', _yaml_rules % '<'),
+        _write(tmp_path, 'flow.yaml', '[' + ', '.join(json.dumps(_rule(name)) for name in ('first', 'second')) + ']'),
+    ]
+    for path in sources:
+        engine = _Engine()
+        assert engine.load_rules(path, workers=workers, batch_size=1) == [1, 2]
+        assert [rule.name for rule in engine.rules.values()] == ['first', 'second']
+
+
+@pytest.mark.parametrize('workers', (0, 1))
+def test_errors_are_reported_with_their_line(tmp_path, workers):
+    invalid = dict(_rule('invalid'), condition='not a condition')
+    path = _write(tmp_path, 'rules.jsonl', '\n'.join([
+        json.dumps(_rule('first', '>=')), '{"name": ', json.dumps(_rule('unknown', '~')), '', json.dumps(invalid)]))
+    engine = _Engine()
+    engine.add_rule(_rule('stored'))
+    with pytest.raises(RuleLoadingError) as info:
+        engine.load_rules(path, workers=workers, batch_size=2)
+    assert [position for position, _ in info.value.errors] == [f'{path}:2', f'{path}:3', f'{path}:5']
+    assert str(info.value).count(path) >= 3
+    # No rule is added, and no predicate of the rules is kept
+    assert [rule.name for rule in engine.rules.values()] == ['stored']
+    assert len(engine._predicates) == 1
+
+
+def test_yaml_errors_are_reported_with_their_line(tmp_path):
+    path = _write(tmp_path, 'rules.yml', _yaml_rules % '~')
+    with pytest.raises(RuleLoadingError) as info:
+        _Engine().load_rules(path)
+    assert [position for position, _ in info.value.errors] == [f'{path}:15']
+    broken = _yaml_rules.replace("    $data: {}\n- name: second", "    $data: {\n- name: second")
+    path = _write(tmp_path, 'broken.yml', broken)
+    with pytest.raises(RuleLoadingError) as info:
+        _Engine().load_rules(path)
+    assert info.value.errors[0][0] == f'{path}:15'
@@ -0,0 +1,137 @@
+import copy
+import random
+from collections import Counter
+
+import pytest
+from experta import Fact
+from experta.fieldconstraint import L
+from experta.matchers.rete.check import FeatureCheck, TypeCheck
+from experta.matchers.rete.mixins import ChildNode
+
+from rebeca import Rebeca
+from rebeca.matcher import _AlphaChildren, _AlphaNode
+
+
+class _Engine(Rebeca):
+
+    def __init__(self):
+        super().__init__()
+        self.register_entity_class('device', ['id', 'type'])
+        self.register_entity_class('room', ['id'])
+        self.calls = list()
+
+    @Rebeca.action('matcher_service')
+    def on_matcher_service(self, **kwargs):
+        # Which member a single time action renders, among the ones entering together, is arbitrary
+        self.calls.append(kwargs['rule'])
+
+
+def _random_entity(rng: random.Random, alias: str = None) -> dict:
+    class_name = rng.choice(['device', 'room'])
+    body = {'$properties': {'count': [{rng.choice(['>', '<=', '=']): rng.randint(0, 3)}]}}
+    if class_name == 'device' and rng.random() < .7:
+        body['type'] = rng.choice(['a', 'b', 'c'])
+    if rng.random() < .4:
+        body['id'] = rng.randint(0, 3)
+    key = class_name if alias is None else f'$any->{class_name}||{alias}'
+    return {key: body}
+
+
+def _random_rule(rng: random.Random, index: int) -> dict:
+    """ Random rule on single entities, conjunctions and aliased members, some of them sharing their tests. """
+    members = rng.randint(1, 2)
+    aliases = [f'm{member}' if rng.random() < .5 else None for member in range(members)]
+    entities = [_random_entity(rng, alias) for alias in aliases]
+    condition = entities[0] if members == 1 and aliases[0] is None else {rng.choice(['$and', '$or']): entities}
+    if '$or' in condition:
+        aliases = [None] * members
+    targets = [f'${alias}.id' for alias in aliases if alias is not None]
+    return {'name': f'R{index}', 'description': '', 'meta': {}, 'condition': condition,
+            'action': {'$class': 'single', '$category': 'matcher_service',
+                       '$data': {'rule': index, 'targets': targets}}}
+
+
+def _run(seed: int) -> list:
+    """
+    Trigger random events on a random rule set, adding and removing rules at run-time.
+    :return: The fired actions of each step.
+    """
+    rng = random.Random(seed)
+    rules = [_random_rule(rng, index) for index in range(60)]
+    engine = _Engine()
+    rule_ids = [engine.add_rule(copy.deepcopy(rule))[0] for rule in rules[:30]]
+    engine.start()
+    steps = list()
+    for _ in range(200):
+        choice = rng.random()
+        if choice < .06 and len(rules) > 30:
+            rule_ids.extend(engine.add_rules([copy.deepcopy(rules.pop()) for _ in range(rng.randint(1, 3))]))
+        elif choice < .1 and rule_ids:
+            engine.remove_rule(rule_ids.pop(rng.randrange(len(rule_ids))))
+        elif choice < .12 and rule_ids and rules:
+            engine.update_rule(rule_ids[rng.randrange(len(rule_ids))], copy.deepcopy(rules.pop()))
+        else:
+            class_name = rng.choice(['device', 'room'])
+            data = {'id': rng.randint(0, 3), 'count': rng.randint(0, 3)}
+            if class_name == 'device':
+                data['type'] = rng.choice(['a', 'b', 'c'])
+            engine.trigger(class_name, data)
+        steps.append(Counter(engine.calls))
+        engine.calls.clear()
+    return steps
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_indexed_dispatch_matches_unindexed(seed, monkeypatch):
+    indexed = _run(seed)
+    # Unindexed dispatch: every fact is passed to every child, which runs its test
+    monkeypatch.setattr(_AlphaChildren, 'candidates', lambda children, fact: iter(list(children)))
+    assert indexed == _run(seed)
+
+
+class _Device(Fact):
+    pass
+
+
+class _Room(Fact):
+    pass
+
+
+def _child(check) -> ChildNode:
+    node = _AlphaNode(check)
+    return ChildNode(node, node.activate)
+
+
+def _candidate_nodes(children: _AlphaChildren, fact: Fact) -> list:
+    return sorted(id(child.node) for child in children.candidates(fact))
+
+
+def test_index_follows_the_mutations_of_the_children():
+    rng = random.Random(0)
+    checks = [TypeCheck(_Device), TypeCheck(_Room)] + \
+        [FeatureCheck(what, L(value)) for what in ('type', 'id') for value in ('a', 'b', 1, 2)]
+    facts = [fact_class(type=fact_type, id=fact_id)
+             for fact_class in (_Device, _Room) for fact_type in ('a', 'b', 'c') for fact_id in (1, 2, 3)]
+    children = _AlphaChildren(_child(check) for check in checks)
+    mutations = [
+        lambda: children.append(_child(rng.choice(checks))),
+        lambda: children.extend(_child(rng.choice(checks)) for _ in range(2)),
+        lambda: children.insert(rng.randrange(len(children) + 1), _child(rng.choice(checks))),
+        lambda: children.remove(rng.choice(children)) if children else None,
+        lambda: children.pop() if children else None,
+        lambda: children.__setitem__(slice(None), children[::2]),
+        lambda: children.__setitem__(0, _child(rng.choice(checks))) if children else None,
+        lambda: children.__delitem__(0) if children else None,
+        lambda: children.reverse(),
+        lambda: children.sort(key=id),
+        lambda: children.__iadd__([_child(rng.choice(checks))]),
+        lambda: children.clear() if rng.random() < .1 else None,
+    ]
+    for _ in range(300):
+        rng.choice(mutations)()
+        for fact in facts:
+            # Each candidate is a child, and every child whose test the fact passes is a candidate
+            candidates = _candidate_nodes(children, fact)
+            assert candidates == _candidate_nodes(_AlphaChildren(list(children)), fact)
+            assert set(candidates) <= {id(child.node) for child in children}
+            assert {id(child.node) for child in children if child.node.matcher(fact)} <= set(candidates)
@@ -0,0 +1,64 @@
+from rebeca import Rebeca
+
+
+class _Engine(Rebeca):
+
+    def __init__(self):
+        super().__init__()
+        self.register_entity_class('device', ['id', 'type'])
+        self.calls = list()
+
+    @Rebeca.action('network_service')
+    def on_network_service(self, **kwargs):
+        self.calls.append(kwargs['rule'])
+
+
+def _rule(index: int, threshold: int, device_id: int = None) -> dict:
+    entity = {'type': 'counter', '$properties': {'count': [{'>': threshold}, {'<': 1000}]}}
+    if device_id is not None:
+        entity['id'] = device_id
+    return {'name': f'rule{index}', 'description': '', 'meta': {}, 'condition': {'device': entity},
+            'action': {'$class': 'single', '$category': 'network_service', '$data': {'rule': index}}}
+
+
+def test_identical_comparisons_share_the_alpha_nodes():
+    engine = _Engine()
+    engine.add_rules([_rule(index, threshold=index % 2) for index in range(20)])
+    engine.start()
+    statistics = engine.network_statistics()
+    assert statistics['rules'] == 20
+    assert statistics['conditions'] == 2
+    # Each pattern tests the class, the type, the comparisons and captures the fact: the class and type tests are
+    # shared by all the rules, the other ones by the rules with the same threshold
+    assert statistics['alpha_tests'] == 20 * 4
+    assert statistics['alpha_nodes'] == 2 + 2 * 2
+    assert statistics['sharing_ratio'] == 80 / 6
+    # Rules attached to the running engine reuse the existing tests, and only capture their facts in new nodes
+    engine.add_rules([_rule(index, threshold=index % 2) for index in range(20, 30)])
+    statistics = engine.network_statistics()
+    assert statistics['rules'] == 30
+    assert statistics['alpha_nodes'] == 6 + 2
+    engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 1})
+    assert sorted(engine.calls) == [index for index in range(30) if index % 2 == 0]
+
+
+def test_removed_rules_release_their_predicates():
+    engine = _Engine()
+    rule_ids = engine.add_rules([_rule(index, threshold=index) for index in range(10)])
+    assert len(engine._predicates) == len(engine._predicate_definitions) == 11
+    engine.start()
+    # Rule churn on the running engine: the predicates of the removed rules are released
+    for index in range(10, 200):
+        engine.remove_rule(rule_ids.pop(0))
+        rule_ids.extend(engine.add_rule(_rule(index, threshold=index)))
+        assert len(engine._predicates) == len(engine._predicate_definitions) == 11
+    engine.update_rule(rule_ids[0], _rule(0, threshold=1000))
+    assert len(engine._predicates) == 11
+    # Predicates shared with other rules are kept
+    engine.remove_rule(rule_ids.pop(1))
+    assert len(engine._predicates) == 10
+    engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 500})
+    assert sorted(engine.calls) == list(range(192, 200))
+    for rule_id in rule_ids:
+        engine.remove_rule(rule_id)
+    assert not engine._predicates and not engine._predicate_definitions and not engine._predicate_references
@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+from rebeca import Rebeca
+from rebeca.metrics import Metrics
+
+
+class _Engine(Rebeca):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.register_entity_class('session', ['id'])
+        self.calls = list()
+        self.add_rule({
+            'name': 'active', 'description': '', 'meta': {},
+            'condition': {'$and': [{'$any->session||s': {'$properties': {'active': [{'=': True}]}}}]},
+            'action': {'$class': 'single', '$category': 'retention_service',
+                       '$data': {'$enter': {'on': '$s.id'}, '$exit': {'off': '$s.id'}}}
+        })
+        self.add_rule({
+            'name': 'total', 'description': '', 'meta': {},
+            'condition': {'$aggregation': {
+                '$function': 'sum', '$property': {'count': [{'>=': 3}]},
+                '$entities': [{'session': {'id': session_id}} for session_id in (1, 2)]}},
+            'action': {'$class': 'single', '$category': 'retention_service',
+                       '$data': {'$enter': {'on': 'total'}, '$exit': {'off': 'total'}}}
+        })
+
+    @Rebeca.action('retention_service')
+    def on_retention_service(self, **kwargs):
+        self.calls.append(kwargs)
+
+
+def _session(session_id: int, count: int = 1) -> dict:
+    return {'id': session_id, 'active': True, 'count': count}
+
+
+def test_expired_entities_are_retracted():
+    engine = _Engine(metrics=Metrics())
+    engine.set_retention_policy('session', ttl=60)
+    engine.start()
+    engine.trigger('session', _session(1))
+    engine.trigger('session', _session(2, 2))
+    assert engine.calls == [{'on': 1}, {'on': 'total'}, {'on': 2}]
+    engine.calls.clear()
+    now = time.monotonic()
+    assert engine.evict(now) == 0
+    engine.trigger('session', _session(2, 5))
+    # Only the session not updated for longer than the TTL expires, leaving the aggregation
+    assert engine.evict(now + 60) == 1
+    assert engine.calls == [{'off': 1}]
+    assert [entity['id'] for entity in engine.entities.values() if entity.class_name == 'session'] == [2]
+    assert engine.evict(time.monotonic() + 120) == 1
+    assert engine.calls == [{'off': 1}, {'off': 2}, {'off': 'total'}]
+    assert engine.evictions == {'session': {'ttl': 2}}
+    assert engine.metrics.as_dict()['counters']['entities_evicted_total'] == {'class=session,reason=ttl': 2}
+
+
+def test_least_recently_updated_entities_are_evicted_beyond_the_maximum_count():
+    engine = _Engine()
+    engine.start()
+    for session_id in range(1, 5):
+        engine.trigger('session', _session(session_id))
+    # The current entities are tracked as just updated, in their order
+    engine.set_retention_policy('session', max_count=3)
+    assert engine.evict() == 1
+    engine.trigger('session', _session(2))
+    engine.trigger('session', _session(5))
+    assert [call['off'] for call in engine.calls if 'off' in call] == [1, 3]
+    assert sorted(entity['id'] for entity in engine.entities.values() if entity.class_name == 'session') == [2, 4, 5]
+    assert engine.evictions == {'session': {'max_count': 2}}
+
+
+def test_policy_of_unregistered_class():
+    engine = _Engine()
+    with pytest.raises(Exception):
+        engine.set_retention_policy('unregistered', ttl=60)
+    with pytest.raises(ValueError):
+        engine.set_retention_policy('session', ttl=0)
@@ -0,0 +1,70 @@
+import pytest
+
+from rebeca import Rebeca, ShardedRebeca
+
+
+class _Engine(Rebeca):
+
+    def __init__(self):
+        super().__init__()
+        self.register_entity_class('device', ['id', 'type'])
+        self.register_entity_class('room', ['id'])
+
+    @Rebeca.action('sharding_service')
+    def on_sharding_service(self, **kwargs):
+        pass
+
+
+def _rule(*members) -> dict:
+    return {'name': 'rule', 'description': '', 'meta': {}, 'condition': {'$and': list(members)},
+            'action': {'$class': 'single', '$category': 'sharding_service', '$data': {}}}
+
+
+def _stored(rebeca: ShardedRebeca, shard: int) -> list:
+    return sorted((class_name, entity_data['id']) for class_name, entity_data in
+                  rebeca._shards[shard].call('entities', None))
+
+
+def test_placement_releases_the_router_predicates():
+    rebeca = ShardedRebeca(_Engine, shards=2)
+    rebeca.add_rule(_rule({'device': {'id': 1, 'type': 'counter', '$properties': {'count': [{'>': 0}]}}}))
+    rebeca.update_rule(1, _rule({'device': {'id': 1, 'type': 'counter', '$properties': {'count': [{'<': 5}]}}}))
+    with pytest.raises(Exception):
+        rebeca.add_rule(_rule({'device': {'id': 1, 'type': 'counter', '$properties': {'count': [{'~': 0}]}}}))
+    rebeca.remove_rule(1)
+    assert not rebeca._router._predicates and not rebeca._router._predicate_definitions
+
+
+@pytest.mark.parametrize('partition', ShardedRebeca.partitions)
+def test_replicas_are_retracted_with_their_last_rule(partition):
+    # With 5 shards, the 'device' and 'room' classes are owned by different shards
+    rebeca = ShardedRebeca(_Engine, shards=5, partition=partition)
+    devices = [rebeca._router.type_entities['device'](id=device_id, type='counter') for device_id in range(1, 20)]
+    room = rebeca._router.type_entities['room'](id=1)
+    # A device owned by another shard than the room
+    device = next(device for device in devices if rebeca._owner(device) != rebeca._owner(room))
+    member = {'device': {'id': device['id'], 'type': 'counter', '$properties': {'count': [{'>': 0}]}}} \
+        if partition == 'key' else {'$any->device||d': {'type': 'counter', '$properties': {'count': [{'>': 0}]}}}
+    with rebeca:
+        rebeca.add_rule(_rule(member, {'room': {'id': 1, '$properties': {'open': [{'=': True}]}}}))
+        # Force the rule on the shard of the room
+        rebeca.update_rule(1, _rule(member, {'room': {'id': 1, '$properties': {'open': [{'=': True}]}}},
+                                    {'room': {'id': 1, '$properties': {'people': [{'>=': 0}]}}}))
+        rule_shard, device_shard = rebeca._owner(room), rebeca._owner(device)
+        assert rebeca._placements[1].shard == rule_shard
+        rebeca.add_rule(_rule(member))
+        rebeca.trigger('device', {'id': device['id'], 'type': 'counter', 'count': 1})
+        rebeca.trigger('room', {'id': 1, 'open': True, 'people': 1})
+        rebeca.join()
+        assert ('device', device['id']) in _stored(rebeca, rule_shard)
+        # The replica is kept while another rule of the shard references it
+        rebeca.add_rule(_rule(member, {'room': {'id': 1, '$properties': {'people': [{'>': 0}]}}},
+                              {'room': {'id': 1, '$properties': {'open': [{'=': True}]}}}))
+        assert rebeca._placements[3].shard == rule_shard
+        rebeca.remove_rule(1)
+        rebeca.join()
+        assert ('device', device['id']) in _stored(rebeca, rule_shard)
+        rebeca.remove_rule(3)
+        rebeca.join()
+        assert _stored(rebeca, rule_shard) == [('room', 1)]
+        assert ('device', device['id']) in _stored(rebeca, device_shard)
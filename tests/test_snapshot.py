@@ -0,0 +1,82 @@
+from collections import Counter
+
+from experta.factlist import FactList
+
+from rebeca import Rebeca
+
+
+class _Engine(Rebeca):
+
+    def __init__(self):
+        super().__init__()
+        self.register_entity_class('device', ['id', 'type'])
+        self.calls = list()
+        self.add_rule({
+            'name': 'counting', 'description': '', 'meta': {},
+            'condition': {'$and': [{'$any->device||d': {'type': 'counter', '$properties': {'count': [{'>': 0}]}}}]},
+            'action': {'$class': 'single', '$category': 'snapshot_service',
+                       '$data': {'$enter': {'on': '$d.id'}, '$exit': {'off': '$d.id'}}}
+        })
+
+    @Rebeca.action('snapshot_service')
+    def on_snapshot_service(self, **kwargs):
+        self.calls.append(kwargs)
+
+
+def test_snapshot_restore_trigger_round_trip(tmp_path):
+    path = str(tmp_path / 'state.bin')
+    engine = _Engine()
+    engine.start()
+    engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 1})
+    engine.trigger('device', {'id': 2, 'type': 'counter', 'count': 0})
+    assert engine.calls == [{'on': 1}]
+    engine.snapshot(path)
+
+    restored = _Engine()
+    restored.restore(path)
+    facts = restored._engine.facts
+    entities = [fact for fact in facts.values() if isinstance(fact, restored.type_entities['device'])]
+    assert len(entities) == 2
+    # The restored entities are counted as if declared one by one
+    assert Counter(FactList._get_fact_id(entity) for entity in entities) == \
+        Counter({fact_id: count for fact_id, count in facts.reference_counter.items()
+                 if any(item is restored.type_entities['device'] for item in fact_id)})
+    # The action already fired before the snapshot
+    restored.trigger('device', {'id': 1, 'type': 'counter', 'count': 1})
+    restored.trigger('device', {'id': 1, 'type': 'counter', 'count': 2})
+    assert restored.calls == []
+    restored.trigger('device', {'id': 1, 'type': 'counter', 'count': 0})
+    assert restored.calls == [{'off': 1}]
+    restored.trigger('device', {'id': 2, 'type': 'counter', 'count': 3})
+    assert restored.calls == [{'off': 1}, {'on': 2}]
+
+
+def test_action_states_are_kept_by_rule_id(tmp_path):
+    path = str(tmp_path / 'state.bin')
+
+    def build():
+        engine = _Engine()
+        # A second rule with the same name, firing on other devices
+        engine.add_rule({
+            'name': 'counting', 'description': '', 'meta': {},
+            'condition': {'$and': [{'$any->device||d': {'type': 'meter', '$properties': {'count': [{'>': 0}]}}}]},
+            'action': {'$class': 'single', '$category': 'snapshot_service',
+                       '$data': {'$enter': {'on': '$d.id'}, '$exit': {'off': '$d.id'}}}
+        })
+        return engine
+
+    engine = build()
+    engine.start()
+    engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 1})
+    engine.trigger('device', {'id': 2, 'type': 'meter', 'count': 0})
+    assert engine.calls == [{'on': 1}]
+    engine.snapshot(path)
+
+    restored = build()
+    restored.restore(path)
+    restored.trigger('device', {'id': 1, 'type': 'counter', 'count': 2})
+    assert restored.calls == []
+    restored.trigger('device', {'id': 2, 'type': 'meter', 'count': 1})
+    assert restored.calls == [{'on': 2}]
+    restored.trigger('device', {'id': 1, 'type': 'counter', 'count': 0})
+    assert restored.calls == [{'on': 2}, {'off': 1}]
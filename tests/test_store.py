@@ -0,0 +1,53 @@
+import pytest
+
+from rebeca import Rebeca
+from rebeca.exceptions import RuleParsingError
+
+
+class _Engine(Rebeca):
+
+    def __init__(self):
+        super().__init__()
+        self.register_entity_class('device', ['id', 'type'])
+        self.register_entity_class('room', ['id'])
+
+    @Rebeca.action('store_service')
+    def on_store_service(self, **kwargs):
+        pass
+
+
+def _rule(name: str, class_name: str = 'device', operator: str = '>') -> dict:
+    return {'name': name, 'description': '', 'meta': {},
+            'condition': {class_name: {'id': 1, '$properties': {'count': [{operator: 0}]}}},
+            'action': {'$class': 'single', '$category': 'store_service', '$data': {}}}
+
+
+def test_removed_ids_are_reused_smallest_first():
+    engine = _Engine()
+    assert engine.add_rules(_rule(f'rule-{i}') for i in range(5)) == [1, 2, 3, 4, 5]
+    for rule_id in (4, 2, 5):
+        engine.remove_rule(rule_id)
+    assert sorted(engine.rules) == [1, 3]
+    assert engine.add_rule(_rule('a'), _rule('b'), _rule('c'), _rule('d')) == [2, 4, 5, 6]
+    assert engine.rules[2].name == 'a' and engine.rules[6].name == 'd'
+
+
+def test_rules_are_indexed_by_name_and_class():
+    engine = _Engine()
+    engine.add_rule(_rule('same'), _rule('same', 'room'), _rule('other', 'room'))
+    assert engine.rules.by_name('same') == {1, 2}
+    assert engine.rules.by_class('room') == {2, 3}
+    engine.update_rule(2, _rule('other'))
+    assert engine.rules.by_name('same') == {1} and engine.rules.by_name('other') == {2, 3}
+    assert engine.rules.by_class('room') == {3} and engine.rules.by_class('device') == {1, 2}
+    engine.remove_rule(3)
+    assert engine.rules.by_class('room') == set() and engine.rules.by_name('other') == {2}
+
+
+def test_bulk_add_stores_nothing_on_error():
+    engine = _Engine()
+    engine.add_rule(_rule('first'))
+    with pytest.raises(RuleParsingError):
+        engine.add_rules([_rule('second'), _rule('invalid', operator='~')])
+    assert list(engine.rules) == [1]
+    assert engine.add_rules([_rule('second')]) == [2]
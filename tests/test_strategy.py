@@ -0,0 +1,64 @@
+from rebeca import Rebeca
+
+
+class _Engine(Rebeca):
+
+    def __init__(self):
+        super().__init__()
+        self.register_entity_class('device', ['id', 'type'])
+        self.calls = list()
+
+    @Rebeca.action('service')
+    def on_service(self, **kwargs):
+        self.calls.append(kwargs)
+
+
+def _rule(condition: dict) -> dict:
+    return {
+        'name': 'rule', 'description': '', 'meta': {}, 'condition': condition,
+        'action': {'$class': 'single', '$category': 'service',
+                   '$data': {'$enter': {'state': 'on'}, '$exit': {'state': 'off'}}}
+    }
+
+
+def test_match_of_several_branches_fires_once():
+    engine = _Engine()
+    engine.add_rule(_rule({'$or': [
+        {'device': {'id': 4, '$properties': {'count': [{'>': 0}]}}},
+        {'device': {'id': 4, '$properties': {'count': [{'>': 2}]}}},
+    ]}))
+    engine.start()
+    for count in (3, 1, 3, 1, 3):
+        engine.trigger('device', {'id': 4, 'type': 'counter', 'count': count})
+    assert engine.calls == [{'state': 'on'}]
+    engine.trigger('device', {'id': 4, 'type': 'counter', 'count': 0})
+    assert engine.calls == [{'state': 'on'}, {'state': 'off'}]
+
+
+def test_match_enters_refreshes_and_exits():
+    engine = _Engine()
+    engine.add_rule(_rule({'device': {'id': 1, '$properties': {'count': [{'>': 0}]}}}))
+    engine.start()
+    engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 1})
+    engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 2})
+    engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 0})
+    engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 5})
+    assert engine.calls == [{'state': 'on'}, {'state': 'off'}, {'state': 'on'}]
+
+
+def test_rules_matching_the_same_facts_fire_in_the_order_they_were_added():
+    for attached in (False, True):
+        engine = _Engine()
+        if attached:
+            engine.start()
+        for index in range(6):
+            # Rules with and without aliases, so that the bound facts do not decide the order
+            member = {'$and': [{'$any->device||d': {'$properties': {'count': [{'>': index % 3}]}}}]} \
+                if index % 2 else {'device': {'id': 1, '$properties': {'count': [{'>': index % 3}]}}}
+            engine.add_rule(dict(_rule(member), action={'$class': 'single', '$category': 'service',
+                                                         '$data': {'$enter': {'on': index}, '$exit': {'off': index}}}))
+        if not attached:
+            engine.start()
+        engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 3})
+        engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 0})
+        assert engine.calls == [{'on': index} for index in range(6)] + [{'off': index} for index in range(6)]
@@ -0,0 +1,70 @@
+from collections import Counter
+
+from rebeca import Rebeca
+
+
+class _Engine(Rebeca):
+
+    def __init__(self):
+        super().__init__()
+        self.register_entity_class('device', ['id', 'type'])
+        self.calls = list()
+        self.add_rule({
+            'name': 'counting', 'description': '', 'meta': {},
+            'condition': {'device': {'type': 'counter', '$properties': {'count': [{'>': 0}]}}},
+            'action': {'$class': 'single', '$category': 'memory_service',
+                       '$data': {'$enter': {'state': 'on'}, '$exit': {'state': 'off'}}}
+        })
+
+    @Rebeca.action('memory_service')
+    def on_memory_service(self, **kwargs):
+        self.calls.append(kwargs['state'])
+
+
+def _fact_list(engine: Rebeca) -> tuple:
+    """ The declared facts and their reference counts, comparable across engines. """
+    facts = engine._engine.facts
+    states = sorted(repr(sorted((key, value) for key, value in fact.items() if not fact.is_special(key)))
+                    for fact in facts.values())
+    counts = Counter({repr(sorted(item for item in fact_id if isinstance(item, tuple))): count
+                      for fact_id, count in facts.reference_counter.items()})
+    return states, counts
+
+
+def _update_label(refresh: bool) -> tuple:
+    """
+    Update a property which no rule tests, either refreshing the fact in place (as the engine does) or modifying it.
+    Then retract the updated state and declare it again.
+    :return: The fact list after the update and at the end, and the fired actions.
+    """
+    engine = _Engine()
+    engine.start()
+    engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 1, 'label': 'a'})
+    entity = next(iter(engine._entities.values()))
+    if refresh:
+        engine.trigger('device', {'id': 1, 'type': 'counter', 'label': 'b'})
+        assert engine._entities[entity.key] is entity
+    else:
+        engine._entities[entity.key] = engine._engine.modify(entity, label='b')
+        engine._update_agenda()
+    updated = _fact_list(engine)
+    engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 0, 'label': 'b'})
+    engine.trigger('device', {'id': 1, 'type': 'counter', 'count': 1, 'label': 'b'})
+    return updated, _fact_list(engine), engine.calls
+
+
+def test_refresh_updates_the_fact_list_as_a_modify():
+    refreshed, modified = _update_label(refresh=True), _update_label(refresh=False)
+    assert refreshed == modified
+    assert refreshed[2] == ['on', 'off', 'on']
+
+
+def test_batch_update_defers_the_agenda():
+    engine = _Engine()
+    engine.start()
+    engine.trigger_many([('device', {'id': i, 'type': 'counter', 'count': 1}) for i in range(3)])
+    assert engine.calls == ['on']
+    assert not engine._engine.running
+    engine.trigger_many([('device', {'id': i, 'type': 'counter', 'count': 0}) for i in range(3)])
+    assert engine.calls == ['on', 'off']
+    assert not engine._engine.running